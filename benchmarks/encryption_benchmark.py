@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de encriptación de la base de datos
+Compara el formato por bloques (AES-GCM) con el formato Fernet anterior
+
+Uso:
+    python benchmarks/encryption_benchmark.py [--size-mb 64]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cryptography.fernet import Fernet
+from modules import encryption
+
+
+def measure(label, size, func):
+    """Ejecutar func midiendo tiempo y pico de memoria"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    mb = size / (1024 * 1024)
+    print(f"{label:<28} {elapsed:8.3f} s {mb / elapsed:9.1f} MB/s "
+          f"{peak / (1024 * 1024):9.1f} MB pico")
+
+
+def fernet_encrypt(path, key):
+    """Encriptar como lo hacía el formato v1: todo el archivo de una vez"""
+    data = path.read_bytes()
+    token = Fernet(key.key).encrypt(data)
+    Path(str(path) + '.fernet').write_bytes(key.salt + token)
+
+
+def fernet_decrypt(path, key):
+    """Desencriptar un archivo generado por fernet_encrypt"""
+    data = Path(str(path) + '.fernet').read_bytes()
+    Path(str(path) + '.plain').write_bytes(Fernet(key.key).decrypt(data[encryption.SALT_SIZE:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de encriptación de Cordiax")
+    parser.add_argument("--size-mb", type=int, default=64,
+                        help="Tamaño del archivo de prueba en MB (por defecto 64)")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    key = encryption.create_session_key("benchmark")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cordiax.db"
+        with open(path, 'wb') as f:
+            # Mezcla de bloques aleatorios y repetidos, como páginas de SQLite
+            block = os.urandom(4096)
+            for i in range(size // 4096):
+                f.write(os.urandom(4096) if i % 4 == 0 else block)
+
+        print(f"Archivo de prueba: {args.size_mb} MB")
+        measure("Fernet (v1) encriptar", size, lambda: fernet_encrypt(path, key))
+        measure("Fernet (v1) desencriptar", size, lambda: fernet_decrypt(path, key))
+        measure("Bloques (v2) encriptar", size, lambda: encryption.encrypt_file(path, key))
+        measure("Bloques (v2) desencriptar", size, lambda: encryption.decrypt_file(path, key))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark del empaquetador de backups .cordiax.zip
+Compara ZIP_DEFLATED para todo (como antes) con la elección STORED/DEFLATED
+por archivo y la compresión en paralelo de los miembros grandes
+
+Genera una carpeta de documentos parecida a la de un centro: .docx, .xlsx y
+.pdf (que ya van comprimidos por dentro), imágenes, textos y CSV, más una
+base de datos SQLite con datos de estudiantes y asistencia.
+
+Uso:
+    python benchmarks/zip_packer_benchmark.py [--docs 300] [--db-mb 32] [--workers 4]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules import zip_packer
+
+
+WORDS = ("alumno aula centro asistencia comedor menú permiso excursión familia "
+         "nota material informe evaluación tutoría horario curso trimestre").split()
+
+
+def random_text(rng, size):
+    """Texto con vocabulario repetido, como el de un documento real"""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def write_office(path, rng, size):
+    """Documento de Office: un zip de XML, como .docx y .xlsx"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr("[Content_Types].xml", "<Types/>")
+        zipf.writestr("word/document.xml", f"<w:document>{random_text(rng, size * 4)}</w:document>")
+        zipf.writestr("word/media/image1.png", rng.randbytes(size // 2))
+
+
+def write_pdf(path, rng, size):
+    """PDF con flujos FlateDecode (texto comprimido)"""
+    stream = zlib.compress(random_text(rng, size * 3).encode())
+    path.write_bytes(b"%PDF-1.7\n1 0 obj << /Filter /FlateDecode >>\nstream\n"
+                     + stream + b"\nendstream\nendobj\n%%EOF\n")
+
+
+def create_documents(docs_dir, count, rng):
+    """Carpeta de documentos con una mezcla de formatos y tamaños"""
+    docs_dir.mkdir(parents=True)
+    for i in range(count):
+        kind = i % 6
+        size = int(rng.lognormvariate(11, 1))  # mediana ~60 KB, algunos de varios MB
+        if kind == 0:
+            write_office(docs_dir / f"acta_{i}.docx", rng, size)
+        elif kind == 1:
+            write_office(docs_dir / f"notas_{i}.xlsx", rng, size)
+        elif kind == 2:
+            write_pdf(docs_dir / f"circular_{i}.pdf", rng, size)
+        elif kind == 3:
+            (docs_dir / f"foto_{i}.jpg").write_bytes(rng.randbytes(size))
+        elif kind == 4:
+            (docs_dir / f"listado_{i}.csv").write_text(
+                "\n".join(f"{j};{random_text(rng, 40)}" for j in range(size // 48)),
+                encoding="utf-8")
+        else:
+            (docs_dir / f"nota_{i}.txt").write_text(random_text(rng, size), encoding="utf-8")
+
+
+def create_database(db_path, size_mb, rng):
+    """Base de datos con tablas de estudiantes y asistencia"""
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("CREATE TABLE estudiantes (id INTEGER PRIMARY KEY, nombre TEXT, notas TEXT)")
+    conn.execute("CREATE TABLE asistencia (id INTEGER PRIMARY KEY, estudiante_id INTEGER, "
+                 "fecha TEXT, presente INTEGER, observaciones TEXT)")
+    rows = size_mb * 1024 * 1024 // 120
+    conn.executemany("INSERT INTO estudiantes (nombre, notas) VALUES (?, ?)",
+                     ((f"Estudiante {i}", random_text(rng, 60)) for i in range(rows // 20)))
+    conn.executemany("INSERT INTO asistencia (estudiante_id, fecha, presente, observaciones) "
+                     "VALUES (?, ?, ?, ?)",
+                     ((rng.randrange(rows // 20), f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                       rng.randint(0, 1), random_text(rng, 40)) for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def deflate_everything(zip_path, files):
+    """Como lo hacía create_backup: ZIP_DEFLATED para todos los archivos"""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for arcname, path in files:
+            zipf.write(str(path), arcname)
+
+
+def measure(label, total, zip_path, func):
+    """Ejecutar func y mostrar tiempo, velocidad y tamaño del zip"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    size = zip_path.stat().st_size
+    print(f"{label:<32} {elapsed:8.2f} s {total / (1024 * 1024) / elapsed:8.1f} MB/s "
+          f"{size / (1024 * 1024):9.1f} MB")
+    zip_path.unlink()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del empaquetador de backups")
+    parser.add_argument("--docs", type=int, default=300,
+                        help="Número de documentos (por defecto 300)")
+    parser.add_argument("--db-mb", type=int, default=32,
+                        help="Tamaño aproximado de la base de datos en MB (por defecto 32)")
+    parser.add_argument("--workers", type=int, default=zip_packer.DEFAULT_WORKERS,
+                        help="Hilos de compresión (por defecto: núcleos, máx. 8)")
+    args = parser.parse_args()
+
+    rng = random.Random(2024)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        docs_dir = tmp / "documentos"
+        create_documents(docs_dir, args.docs, rng)
+        create_database(tmp / "cordiax.db", args.db_mb, rng)
+
+        files = [("cordiax.db", tmp / "cordiax.db")]
+        files += [(f"documentos/{path.name}", path) for path in sorted(docs_dir.iterdir())]
+        total = sum(path.stat().st_size for _, path in files)
+        print(f"{len(files)} archivos, {total / (1024 * 1024):.1f} MB")
+
+        zip_path = tmp / "backup.cordiax.zip"
+        measure("ZIP_DEFLATED para todo", total, zip_path,
+                lambda: deflate_everything(zip_path, files))
+        measure("Empaquetador, 1 hilo", total, zip_path,
+                lambda: zip_packer.pack_files(zip_path, files, workers=1))
+        stats = measure(f"Empaquetador, {args.workers} hilos", total, zip_path,
+                        lambda: zip_packer.pack_files(zip_path, files, workers=args.workers))
+        print(f"Sin recomprimir: {stats['stored']}, comprimidos: {stats['deflated']} "
+              f"({stats['parallel']} en paralelo)")
+
+
+if __name__ == "__main__":
+    main()
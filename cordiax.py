@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import multiprocessing
 import webview
 import json
-config = json.load(open("_config.json", "r"))
-window = webview.create_window('Axia4 - EntreAulas', 'https://tech.eus/entreaulas/')
-webview.start(user_agent=config["ua"])
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Los procesos de verificación de backups vuelven a importar este archivo
+    multiprocessing.freeze_support()
+    config = json.load(open("_config.json", "r"))
+    window = webview.create_window('Axia4 - EntreAulas', 'https://tech.eus/entreaulas/')
+    webview.start(user_agent=config["ua"])
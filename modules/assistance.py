@@ -6,7 +6,8 @@ Gestión de asistencia de estudiantes con check-in y notas
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from modules import database
+from modules import database, db_executor
+from modules.virtual_table import VirtualTable
 from datetime import datetime, date
 import os
 import sys
@@ -20,6 +21,10 @@ class AssistanceModule:
         self.setup_ui()
         self.load_assistance()
         
+        # Actualizar solo las filas afectadas cuando cambian los datos
+        db_executor.watch(self.tree, self.on_data_changed,
+                          ("asistencia", "estudiantes", "centros", "aulas"))
+        
     def setup_ui(self):
         """Configurar la interfaz"""
         # Título
@@ -85,8 +90,8 @@ class AssistanceModule:
         
         # Treeview
         columns = ("ID", "Estudiante", "Centro", "Aula", "Fecha", "Estado", "Entrada", "Salida", "Notas")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -107,30 +112,27 @@ class AssistanceModule:
         
     def load_filters(self):
         """Cargar opciones de filtro"""
-        # Cargar centros
-        centros = database.fetch_all("SELECT id, nombre FROM centros ORDER BY nombre")
-        centro_names = ["Todos"] + [c['nombre'] for c in centros]
-        self.centro_filter_combo['values'] = centro_names
         if not self.centro_filter_var.get():
             self.centro_filter_var.set("Todos")
-        
-        # Cargar aulas
-        aulas = database.fetch_all("SELECT id, nombre FROM aulas ORDER BY nombre")
-        aula_names = ["Todas"] + [a['nombre'] for a in aulas]
-        self.aula_filter_combo['values'] = aula_names
         if not self.aula_filter_var.get():
             self.aula_filter_var.set("Todas")
         
-    def load_assistance(self):
-        """Cargar asistencia de la fecha seleccionada"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        # Cargar centros
+        def show_centros(centros):
+            self.centro_filter_combo['values'] = ["Todos"] + [c['nombre'] for c in centros]
         
-        # Obtener asistencia
-        fecha = self.date_var.get()
+        db_executor.deliver(self.centro_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM centros ORDER BY nombre"), show_centros)
         
-        # Construir consulta con filtros
+        # Cargar aulas
+        def show_aulas(aulas):
+            self.aula_filter_combo['values'] = ["Todas"] + [a['nombre'] for a in aulas]
+        
+        db_executor.deliver(self.aula_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM aulas ORDER BY nombre"), show_aulas)
+        
+    def build_query(self, row_ids=None):
+        """Construir la consulta de asistencia con la fecha y los filtros actuales"""
         query = """
             SELECT a.id, e.nombre, e.apellidos, a.fecha, a.estado, 
                    a.hora_entrada, a.hora_salida, a.notas,
@@ -141,7 +143,12 @@ class AssistanceModule:
             LEFT JOIN aulas au ON e.aula_id = au.id
             WHERE a.fecha = ?
         """
-        params = [fecha]
+        params = [self.date_var.get()]
+        
+        # Solo algunas filas
+        if row_ids:
+            query += f" AND a.id IN ({', '.join('?' for _ in row_ids)})"
+            params.extend(row_ids)
         
         # Filtro por centro
         if self.centro_filter_var.get() and self.centro_filter_var.get() != "Todos":
@@ -154,26 +161,71 @@ class AssistanceModule:
             params.append(self.aula_filter_var.get())
         
         query += " ORDER BY e.apellidos, e.nombre"
+        return query, tuple(params)
+    
+    def record_values(self, record):
+        """Valores de la fila de un registro de asistencia en la tabla"""
+        return (
+            record['id'],
+            f"{record['nombre']} {record['apellidos']}",
+            record['centro_nombre'] or "",
+            record['aula_nombre'] or "",
+            record['fecha'],
+            record['estado'],
+            record['hora_entrada'] or "",
+            record['hora_salida'] or "",
+            record['notas'] or ""
+        )
+    
+    def load_assistance(self):
+        """Cargar asistencia de la fecha seleccionada"""
+        # Limpiar tabla
+        db_executor.show_loading(self.tree)
         
-        records = database.fetch_all(query, tuple(params))
+        # Obtener asistencia
+        query, params = self.build_query()
+        
+        # Solo se pinta el resultado de la última carga solicitada
+        self._load_request = getattr(self, "_load_request", 0) + 1
+        request = self._load_request
+        
+        def show(records):
+            if request == self._load_request:
+                self.show_assistance(records)
+        
+        db_executor.deliver(self.tree, db_executor.fetch_all(query, params), show)
+    
+    def show_assistance(self, records):
+        """Mostrar los registros de asistencia en la tabla"""
+        self.tree.clear()
         
         # Agregar a tabla
         for record in records:
-            self.tree.insert("", tk.END, values=(
-                record['id'],
-                f"{record['nombre']} {record['apellidos']}",
-                record['centro_nombre'] or "",
-                record['aula_nombre'] or "",
-                record['fecha'],
-                record['estado'],
-                record['hora_entrada'] or "",
-                record['hora_salida'] or "",
-                record['notas'] or ""
-            ))
+            self.tree.insert("", tk.END, iid=str(record['id']),
+                             values=self.record_values(record))
+    
+    def on_data_changed(self, table, operation, row_ids):
+        """Aplicar un cambio de la base de datos a la tabla"""
+        if table == "centros" or table == "aulas":
+            self.load_filters()
+        
+        if table != "asistencia" or row_ids is None:
+            # Cambios de estudiantes o masivos: se recarga la fecha completa
+            self.load_assistance()
+            return
+        
+        if operation == "delete":
+            db_executor.patch_rows(self.tree, row_ids, [], self.record_values)
+            return
+        
+        query, params = self.build_query(row_ids)
+        db_executor.deliver(
+            self.tree, db_executor.fetch_all(query, params),
+            lambda rows: db_executor.patch_rows(self.tree, row_ids, rows, self.record_values))
     
     def new_assistance(self):
         """Registrar nueva asistencia"""
-        AssistanceDialog(self.parent, self.load_assistance, self.date_var.get())
+        AssistanceDialog(self.parent, None, self.date_var.get())
     
     def edit_assistance(self):
         """Editar asistencia seleccionada"""
@@ -185,7 +237,7 @@ class AssistanceModule:
         item = self.tree.item(selection[0])
         assistance_id = item['values'][0]
         
-        AssistanceDialog(self.parent, self.load_assistance, self.date_var.get(), assistance_id)
+        AssistanceDialog(self.parent, None, self.date_var.get(), assistance_id)
     
     def delete_assistance(self):
         """Eliminar asistencia seleccionada"""
@@ -198,9 +250,11 @@ class AssistanceModule:
         assistance_id = item['values'][0]
         
         if messagebox.askyesno("Confirmar", "¿Está seguro de eliminar este registro?"):
-            database.execute_query("DELETE FROM asistencia WHERE id = ?", (assistance_id,))
-            self.load_assistance()
-            messagebox.showinfo("Éxito", "Registro eliminado correctamente")
+            db_executor.deliver(
+                self.tree,
+                db_executor.execute_query("DELETE FROM asistencia WHERE id = ?", (assistance_id,)),
+                lambda _: messagebox.showinfo("Éxito", "Registro eliminado correctamente"),
+                lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
     
     def quick_checkin(self):
         """Check-in rápido para todos los estudiantes activos"""
@@ -230,21 +284,36 @@ class AssistanceModule:
             query += " AND au.nombre = ?"
             params.append(self.aula_filter_var.get())
         
-        students = database.fetch_all(query, tuple(params))
-        
+        def done(count):
+            db_executor.set_busy(self.parent, False)
+            if not count:
+                messagebox.showinfo("Información", "Todos los estudiantes ya tienen registro de asistencia")
+                return
+            messagebox.showinfo("Éxito", f"Check-in completado para {count} estudiantes")
+        
+        def failed(e):
+            db_executor.set_busy(self.parent, False)
+            messagebox.showerror("Error", f"Error en el check-in: {str(e)}")
+        
+        # Consulta e inserción en el hilo de escritura, sin huecos entre ambas
+        db_executor.set_busy(self.parent, True)
+        db_executor.run_in_background(self.parent, self._checkin_students,
+                                      query, tuple(params), fecha, hora_actual,
+                                      on_success=done, on_error=failed, write=True)
+    
+    def _checkin_students(self, query, params, fecha, hora):
+        """Registrar como presentes a los estudiantes sin asistencia (fuera del hilo de Tk)"""
+        students = database.fetch_all(query, params)
         if not students:
-            messagebox.showinfo("Información", "Todos los estudiantes ya tienen registro de asistencia")
-            return
+            return 0
         
-        # Registrar asistencia para todos
-        for student in students:
-            database.execute_query("""
-                INSERT INTO asistencia (estudiante_id, fecha, estado, hora_entrada)
-                VALUES (?, ?, ?, ?)
-            """, (student['id'], fecha, "Presente", hora_actual))
-        
-        self.load_assistance()
-        messagebox.showinfo("Éxito", f"Check-in completado para {len(students)} estudiantes")
+        # Registrar asistencia para todos en una sola transacción
+        database.bulk_insert(
+            "asistencia",
+            ["estudiante_id", "fecha", "estado", "hora_entrada"],
+            [(student['id'], fecha, "Presente", hora) for student in students]
+        )
+        return len(students)
 
 
 class AssistanceDialog:
@@ -265,9 +334,7 @@ class AssistanceDialog:
         self._set_icon()
         
         self.setup_ui()
-        
-        if assistance_id:
-            self.load_assistance_data()
+        self.load_students()
     
     def _set_icon(self):
         """Set window icon"""
@@ -294,13 +361,7 @@ class AssistanceDialog:
         self.student_combo = ttk.Combobox(main_frame, textvariable=self.student_var, 
                                          width=37, state="readonly")
         self.student_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
-        
-        # Cargar estudiantes
-        students = database.fetch_all(
-            "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 ORDER BY apellidos, nombre"
-        )
-        self.student_list = [(s['id'], f"{s['nombre']} {s['apellidos']}") for s in students]
-        self.student_combo['values'] = [s[1] for s in self.student_list]
+        self.student_list = []
         row += 1
         
         # Fecha
@@ -347,18 +408,31 @@ class AssistanceDialog:
         
         main_frame.columnconfigure(1, weight=1)
     
+    def load_students(self):
+        """Cargar estudiantes y, al editar, los datos de asistencia"""
+        def show(students):
+            self.student_list = [(s['id'], f"{s['nombre']} {s['apellidos']}") for s in students]
+            self.student_combo['values'] = [s[1] for s in self.student_list]
+            if self.assistance_id:
+                self.load_assistance_data()
+        
+        db_executor.deliver(self.dialog, db_executor.fetch_all_cached(
+            "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 ORDER BY apellidos, nombre"
+        ), show)
+    
     def load_assistance_data(self):
         """Cargar datos de asistencia"""
-        record = database.fetch_one("""
+        db_executor.deliver(self.dialog, db_executor.fetch_one("""
             SELECT a.*, e.nombre, e.apellidos
             FROM asistencia a
             JOIN estudiantes e ON a.estudiante_id = e.id
             WHERE a.id = ?
-        """, (self.assistance_id,))
-        
+        """, (self.assistance_id,)), self.show_assistance_data)
+    
+    def show_assistance_data(self, record):
+        """Mostrar los datos de asistencia en el formulario"""
         if record:
             # Buscar y seleccionar estudiante
-            student_name = f"{record['nombre']} {record['apellidos']}"
             for i, (sid, sname) in enumerate(self.student_list):
                 if sid == record['estudiante_id']:
                     self.student_combo.current(i)
@@ -380,31 +454,33 @@ class AssistanceDialog:
         student_index = self.student_combo.current()
         student_id = self.student_list[student_index][0]
         
-        try:
-            if self.assistance_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE asistencia 
-                    SET estudiante_id=?, fecha=?, estado=?, hora_entrada=?, 
-                        hora_salida=?, notas=?
-                    WHERE id=?
-                """, (student_id, self.fecha_var.get(), self.estado_var.get(),
-                     self.entrada_var.get() or None, self.salida_var.get() or None,
-                     self.notas_text.get("1.0", tk.END).strip() or None,
-                     self.assistance_id))
-            else:
-                # Crear nuevo
-                database.execute_query("""
-                    INSERT INTO asistencia 
-                    (estudiante_id, fecha, estado, hora_entrada, hora_salida, notas)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (student_id, self.fecha_var.get(), self.estado_var.get(),
-                     self.entrada_var.get() or None, self.salida_var.get() or None,
-                     self.notas_text.get("1.0", tk.END).strip() or None))
-            
-            messagebox.showinfo("Éxito", "Asistencia guardada correctamente")
+        if self.assistance_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE asistencia 
+                SET estudiante_id=?, fecha=?, estado=?, hora_entrada=?, 
+                    hora_salida=?, notas=?
+                WHERE id=?
+            """, (student_id, self.fecha_var.get(), self.estado_var.get(),
+                 self.entrada_var.get() or None, self.salida_var.get() or None,
+                 self.notas_text.get("1.0", tk.END).strip() or None,
+                 self.assistance_id))
+        else:
+            # Crear nuevo
+            future = db_executor.execute_query("""
+                INSERT INTO asistencia 
+                (estudiante_id, fecha, estado, hora_entrada, hora_salida, notas)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (student_id, self.fecha_var.get(), self.estado_var.get(),
+                 self.entrada_var.get() or None, self.salida_var.get() or None,
+                 self.notas_text.get("1.0", tk.END).strip() or None))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardada la asistencia"""
+        messagebox.showinfo("Éxito", "Asistencia guardada correctamente")
+        if self.callback:
             self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        self.dialog.destroy()
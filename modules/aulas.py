@@ -6,7 +6,8 @@ Gestión CRUD de aulas
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from modules import database
+from modules import db_executor
+from modules.virtual_table import VirtualTable
 import os
 import sys
 
@@ -49,8 +50,8 @@ class AulasModule:
         
         # Treeview
         columns = ("ID", "Nombre", "Centro", "Capacidad")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -68,26 +69,25 @@ class AulasModule:
         
     def load_aulas(self):
         """Cargar aulas desde la base de datos"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        def show(aulas):
+            # Actualizar la tabla con solo las diferencias
+            db_executor.reconcile(self.tree, [
+                (aula['id'], (
+                    aula['id'],
+                    aula['nombre'],
+                    aula['centro_nombre'] or "Sin centro",
+                    aula['capacidad'] or ""
+                ), ())
+                for aula in aulas
+            ])
         
         # Obtener aulas con información del centro
-        aulas = database.fetch_all("""
+        db_executor.deliver(self.tree, db_executor.fetch_all("""
             SELECT a.id, a.nombre, a.capacidad, c.nombre as centro_nombre
             FROM aulas a
             LEFT JOIN centros c ON a.centro_id = c.id
             ORDER BY c.nombre, a.nombre
-        """)
-        
-        # Agregar a tabla
-        for aula in aulas:
-            self.tree.insert("", tk.END, values=(
-                aula['id'],
-                aula['nombre'],
-                aula['centro_nombre'] or "Sin centro",
-                aula['capacidad'] or ""
-            ))
+        """), show)
     
     def new_aula(self):
         """Crear nueva aula"""
@@ -116,18 +116,27 @@ class AulasModule:
         aula_id = item['values'][0]
         aula_name = item['values'][1]
         
-        # Verificar si hay estudiantes asociados
-        estudiantes = database.fetch_all("SELECT COUNT(*) as count FROM estudiantes WHERE aula_id = ?", (aula_id,))
-        if estudiantes and estudiantes[0]['count'] > 0:
-            messagebox.showwarning("Advertencia", 
-                                 f"No se puede eliminar el aula '{aula_name}' porque tiene estudiantes asociados.")
-            return
-        
-        if messagebox.askyesno("Confirmar", 
-                              f"¿Está seguro de eliminar el aula '{aula_name}'?"):
-            database.execute_query("DELETE FROM aulas WHERE id = ?", (aula_id,))
+        def deleted(_):
             self.load_aulas()
             messagebox.showinfo("Éxito", "Aula eliminada correctamente")
+        
+        def check(estudiantes):
+            # Verificar si hay estudiantes asociados
+            if estudiantes['count'] > 0:
+                messagebox.showwarning("Advertencia", 
+                                     f"No se puede eliminar el aula '{aula_name}' porque tiene estudiantes asociados.")
+                return
+            
+            if messagebox.askyesno("Confirmar", 
+                                  f"¿Está seguro de eliminar el aula '{aula_name}'?"):
+                db_executor.deliver(
+                    self.tree,
+                    db_executor.execute_query("DELETE FROM aulas WHERE id = ?", (aula_id,)),
+                    deleted,
+                    lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
+        
+        db_executor.deliver(self.tree, db_executor.fetch_one(
+            "SELECT COUNT(*) as count FROM estudiantes WHERE aula_id = ?", (aula_id,)), check)
 
 
 class AulaDialog:
@@ -185,9 +194,14 @@ class AulaDialog:
         self.centro_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
         
         # Cargar centros
-        centros = database.fetch_all("SELECT id, nombre FROM centros ORDER BY nombre")
-        self.centros_dict = {f"{c['nombre']}": c['id'] for c in centros}
-        self.centro_combo['values'] = [""] + list(self.centros_dict.keys())
+        self.centros_dict = {}
+        
+        def show_centros(centros):
+            self.centros_dict = {f"{c['nombre']}": c['id'] for c in centros}
+            self.centro_combo['values'] = [""] + list(self.centros_dict.keys())
+        
+        db_executor.deliver(self.dialog, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM centros ORDER BY nombre"), show_centros)
         row += 1
         
         ttk.Label(main_frame, text="Capacidad:").grid(row=row, column=0, sticky=tk.W, pady=5)
@@ -212,20 +226,23 @@ class AulaDialog:
     
     def load_aula_data(self):
         """Cargar datos del aula"""
-        aula = database.fetch_one(
-            "SELECT * FROM aulas WHERE id = ?", (self.aula_id,)
-        )
-        
+        db_executor.deliver(self.dialog, db_executor.fetch_one("""
+            SELECT a.*, c.nombre as centro_nombre
+            FROM aulas a
+            LEFT JOIN centros c ON a.centro_id = c.id
+            WHERE a.id = ?
+        """, (self.aula_id,)), self.show_aula_data)
+    
+    def show_aula_data(self, aula):
+        """Mostrar los datos del aula en el formulario"""
         if aula:
             self.nombre_var.set(aula['nombre'])
             self.capacidad_var.set(aula['capacidad'] or "")
             self.notas_text.insert("1.0", aula['notas'] or "")
             
             # Seleccionar centro
-            if aula['centro_id']:
-                centro = database.fetch_one("SELECT nombre FROM centros WHERE id = ?", (aula['centro_id'],))
-                if centro:
-                    self.centro_var.set(centro['nombre'])
+            if aula['centro_nombre']:
+                self.centro_var.set(aula['centro_nombre'])
     
     def save(self):
         """Guardar aula"""
@@ -255,27 +272,28 @@ class AulaDialog:
             'notas': self.notas_text.get("1.0", tk.END).strip() or None
         }
         
-        try:
-            if self.aula_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE aulas 
-                    SET nombre=?, centro_id=?, capacidad=?, notas=?
-                    WHERE id=?
-                """, (data['nombre'], data['centro_id'], data['capacidad'],
-                     data['notas'], self.aula_id))
-            else:
-                # Crear nueva
-                database.execute_query("""
-                    INSERT INTO aulas 
-                    (nombre, centro_id, capacidad, notas)
-                    VALUES (?, ?, ?, ?)
-                """, (data['nombre'], data['centro_id'], data['capacidad'],
-                     data['notas']))
-            
-            messagebox.showinfo("Éxito", "Aula guardada correctamente")
-            self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        if self.aula_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE aulas 
+                SET nombre=?, centro_id=?, capacidad=?, notas=?
+                WHERE id=?
+            """, (data['nombre'], data['centro_id'], data['capacidad'],
+                 data['notas'], self.aula_id))
+        else:
+            # Crear nueva
+            future = db_executor.execute_query("""
+                INSERT INTO aulas 
+                (nombre, centro_id, capacidad, notas)
+                VALUES (?, ?, ?, ?)
+            """, (data['nombre'], data['centro_id'], data['capacidad'],
+                 data['notas']))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardada el aula"""
+        messagebox.showinfo("Éxito", "Aula guardada correctamente")
+        self.callback()
+        self.dialog.destroy()
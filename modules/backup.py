@@ -1,19 +1,63 @@
 # -*- coding: utf-8 -*-
 """
 Módulo de Backup y Restauración
-Gestión de copias de seguridad en formato .cordiax.zip
+Gestión de copias de seguridad en el almacén deduplicado (backup_store)
+y en formato .cordiax.zip para exportar e importar
 """
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from modules import database, encryption
+from modules import (database, encryption, db_executor, backup_store, backup_jobs,
+                     backup_catalog, backup_verify, backup_restore)
 from modules.unlock_dialog import EncryptionSetupDialog
 from pathlib import Path
-import zipfile
 import shutil
 from datetime import datetime
 
 
+COPY_BLOCK_SIZE = 1024 * 1024
+
+BACKUP_KINDS = {
+    "manual": "Manual",
+    "auto": "Automática",
+    "imported": "Importada",
+    "zip": "Archivo ZIP",
+}
+
+BACKUP_STATUS = {
+    backup_catalog.STATUS_OK: "Correcto",
+    backup_catalog.STATUS_CORRUPT: "Dañado",
+}
+
+
+def format_size(size):
+    """Tamaño en MB para la tabla"""
+    return f"{size / (1024 * 1024):.2f} MB"
+
+
+def collect_backup_files(db_path=None):
+    """Archivos que entran en un backup: (nombre en el backup, ruta)
+    
+    db_path permite usar una copia de la base de datos en lugar del archivo
+    en uso.
+    """
+    files = []
+    # Base de datos
+    db_path = db_path or database.get_db_path()
+    if db_path.exists():
+        files.append(("cordiax.db", db_path))
+    
+    # Documentos y PDFs
+    for folder in ("documentos", "pdfs"):
+        folder_dir = database.USER_DATA_DIR / folder
+        if folder_dir.exists():
+            for file_path in folder_dir.rglob("*"):
+                if file_path.is_file():
+                    files.append((f"{folder}/{file_path.relative_to(folder_dir).as_posix()}",
+                                  file_path))
+    return files
+
+
 class BackupModule:
     """Módulo de backup y restauración"""
     
@@ -21,6 +65,9 @@ class BackupModule:
         self.parent = parent
         self.backup_dir = database.USER_DATA_DIR / "backups"
         self.backup_dir.mkdir(exist_ok=True)
+        self.store = backup_store.open_store(database.USER_DATA_DIR)
+        self.job = None
+        self.catalog_entries = {}
         self.setup_ui()
         self.load_backups()
         
@@ -39,15 +86,33 @@ class BackupModule:
                   command=self.create_backup).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Restaurar", 
                   command=self.restore_backup).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Restaurar Selección", 
+                  command=self.selective_restore).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Exportar Backup", 
                   command=self.export_backup).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Importar Backup", 
                   command=self.import_backup).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Verificar", 
+                  command=self.verify_backups).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Eliminar", 
                   command=self.delete_backup).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Actualizar", 
                   command=self.load_backups).pack(side=tk.LEFT, padx=5)
         
+        # Progreso de la operación en curso
+        progress_frame = ttk.Frame(self.parent)
+        progress_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate", maximum=100)
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        
+        self.cancel_button = ttk.Button(progress_frame, text="Cancelar",
+                                        command=self.cancel_job, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        
+        self.progress_label = ttk.Label(self.parent, text="", font=("Arial", 9))
+        self.progress_label.pack(fill=tk.X, padx=5, pady=(0, 10))
+        
         # Frame de encriptación
         encryption_frame = ttk.LabelFrame(self.parent, text="Encriptación de Base de Datos", padding="10")
         encryption_frame.pack(fill=tk.X, pady=(0, 10))
@@ -82,7 +147,7 @@ class BackupModule:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # Treeview
-        columns = ("Nombre", "Fecha", "Tamaño")
+        columns = ("Nombre", "Tipo", "Fecha", "Tamaño", "Documentos", "Estado")
         self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
@@ -91,17 +156,28 @@ class BackupModule:
         for col in columns:
             self.tree.heading(col, text=col)
         
-        self.tree.column("Nombre", width=400)
+        self.tree.column("Nombre", width=280)
+        self.tree.column("Tipo", width=90)
         self.tree.column("Fecha", width=180)
-        self.tree.column("Tamaño", width=120)
+        self.tree.column("Tamaño", width=100)
+        self.tree.column("Documentos", width=90)
+        self.tree.column("Estado", width=80)
+        self.tree.tag_configure(backup_catalog.STATUS_CORRUPT, foreground="red")
+        self.tree.bind("<<TreeviewSelect>>", self.show_details)
         
         self.tree.pack(fill=tk.BOTH, expand=True)
         
+        # Ficha del backup seleccionado
+        self.details_label = ttk.Label(self.parent, text="", font=("Arial", 9),
+                                       justify=tk.LEFT, wraplength=800)
+        self.details_label.pack(fill=tk.X, pady=(5, 0))
+        
         # Información
         info_frame = ttk.Frame(self.parent)
         info_frame.pack(fill=tk.X, pady=(10, 0))
         
         info_text = ("Los backups incluyen: base de datos, documentos y archivos de configuración.\n"
+                    "Los datos que no cambian entre backups se guardan una sola vez.\n"
                     "Se recomienda hacer backups regulares para proteger sus datos.")
         
         info_label = ttk.Label(info_frame, text=info_text, 
@@ -109,138 +185,265 @@ class BackupModule:
         info_label.pack(anchor=tk.W)
         
     def load_backups(self):
-        """Cargar lista de backups"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Listar archivos de backup
-        for backup_file in sorted(self.backup_dir.glob("*.cordiax.zip"), reverse=True):
-            stat = backup_file.stat()
-            size_mb = stat.st_size / (1024 * 1024)
-            size_str = f"{size_mb:.2f} MB"
-            
-            fecha = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
-            
-            self.tree.insert("", tk.END, values=(
-                backup_file.name,
+        """Cargar lista de backups desde el catálogo"""
+        db_executor.run_in_background(
+            self.parent, self._read_backups, on_success=self.show_backups,
+            on_error=lambda e: print(f"Error al cargar backups: {e}"))
+    
+    def _read_backups(self):
+        """Poner al día el catálogo y leer sus entradas (fuera del hilo de Tk)"""
+        # Solo se leen los manifiestos y .cordiax.zip nuevos o modificados
+        self.store.sync_catalog(self.backup_dir)
+        return self.store.catalog.list()
+    
+    def show_backups(self, entries):
+        """Mostrar las entradas del catálogo en la tabla"""
+        self.catalog_entries = {entry["id"]: entry for entry in entries}
+        
+        rows = []
+        for entry in self.catalog_entries.values():
+            fecha = datetime.fromisoformat(entry["created"]).strftime("%Y-%m-%d %H:%M:%S")
+            status = entry["status"]
+            rows.append((entry["id"], (
+                entry["id"],
+                BACKUP_KINDS.get(entry["kind"], entry["kind"] or ""),
                 fecha,
-                size_str
-            ))
+                format_size(entry["size"] or 0),
+                entry["documents"] if entry["documents"] is not None else "",
+                BACKUP_STATUS.get(status, status)
+            ), (status,)))
+        
+        # Actualizar la tabla con solo las diferencias
+        db_executor.reconcile(self.tree, rows)
+        self.show_details()
+    
+    def show_details(self, event=None):
+        """Mostrar la ficha del backup seleccionado"""
+        selection = self.tree.selection()
+        entry = self.catalog_entries.get(selection[0]) if selection else None
+        if entry is None:
+            self.details_label.config(text="")
+            return
+        
+        lines = [f"Archivos: {entry['files'] or 0}   Documentos: {entry['documents'] or 0}   "
+                 f"Tamaño: {format_size(entry['size'] or 0)}"]
+        if entry["stored"] is not None:
+            lines[0] += f"   Espacio propio: {format_size(entry['stored'])}"
+        if entry["encrypted"] is not None:
+            lines.append("Base de datos encriptada" if entry["encrypted"]
+                         else "Base de datos sin encriptar")
+        if entry["base"]:
+            lines.append(f"Incremental sobre: {entry['base']}")
+        if entry["tables"]:
+            lines.append("Filas: " + ", ".join(f"{table} {count}"
+                                               for table, count in entry["tables"].items()))
+        if entry["hash"]:
+            lines.append(f"SHA-256: {entry['hash']}")
+        if entry["verified_at"]:
+            verified = datetime.fromisoformat(entry["verified_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            lines.append(f"Última verificación: {verified}")
+        else:
+            lines.append("Sin verificar")
+        if entry["detail"]:
+            lines.append(f"Estado: {entry['detail']}")
+        self.details_label.config(text="\n".join(lines))
+    
+    def get_selected_backup(self):
+        """Id de la copia seleccionada (o nombre del .cordiax.zip)"""
+        selection = self.tree.selection()
+        if not selection:
+            messagebox.showwarning("Advertencia", "Por favor, seleccione un backup")
+            return None
+        return selection[0]
     
     def create_backup(self):
         """Crear nuevo backup"""
         # Generar nombre de backup
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"cordiax_backup_{timestamp}.cordiax.zip"
-        backup_path = self.backup_dir / backup_name
+        backup_name = f"cordiax_backup_{timestamp}"
         
-        try:
-            # Crear archivo ZIP
-            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Agregar base de datos
-                db_path = database.get_db_path()
-                if db_path.exists():
-                    zipf.write(str(db_path), "cordiax.db")
-                
-                # Agregar documentos
-                docs_dir = database.USER_DATA_DIR / "documentos"
-                if docs_dir.exists():
-                    for file_path in docs_dir.rglob("*"):
-                        if file_path.is_file():
-                            arcname = f"documentos/{file_path.relative_to(docs_dir)}"
-                            zipf.write(str(file_path), arcname)
-                
-                # Agregar PDFs
-                pdfs_dir = database.USER_DATA_DIR / "pdfs"
-                if pdfs_dir.exists():
-                    for file_path in pdfs_dir.rglob("*"):
-                        if file_path.is_file():
-                            arcname = f"pdfs/{file_path.relative_to(pdfs_dir)}"
-                            zipf.write(str(file_path), arcname)
-            
+        def done(manifest):
             self.load_backups()
             messagebox.showinfo("Éxito", 
-                               f"Backup creado correctamente:\n{backup_name}\n\n"
-                               f"Ubicación: {backup_path}")
+                               f"Backup creado correctamente:\n{manifest['id']}\n\n"
+                               f"Tamaño: {format_size(manifest['size'])}\n"
+                               f"Archivos nuevos o modificados: {len(manifest['files'])}\n"
+                               f"Espacio nuevo ocupado: {format_size(manifest['stored'])}")
+        
+        self.start_job("Backup", backup_name, self._write_backup, backup_name,
+                       on_success=done, error_text="Error al crear backup")
+    
+    def _write_backup(self, job, backup_name):
+        """Guardar el backup en el almacén (se ejecuta fuera del hilo de Tk)"""
+        # Copia consistente de la base de datos: la aplicación puede seguir
+        # escribiendo mientras se trocean los documentos
+        snapshot_path = self.store.tmp_dir / f"{backup_name}.db"
+        try:
+            _, counts = database.snapshot_database(snapshot_path)
+            job.check()
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al crear backup: {str(e)}")
+            # Incremental respecto al último backup manual: solo se leen los
+            # archivos nuevos o modificados desde entonces
+            previous = self.store.latest_backup("manual")
+            base = previous["id"] if previous else None
+            return self.store.create_backup(backup_name, collect_backup_files(snapshot_path),
+                                            kind="manual", meta={"tables": counts},
+                                            base=base, job=job)
+        finally:
+            snapshot_path.unlink(missing_ok=True)
     
     def restore_backup(self):
         """Restaurar desde backup seleccionado"""
-        selection = self.tree.selection()
-        if not selection:
-            messagebox.showwarning("Advertencia", "Por favor, seleccione un backup")
+        backup_name = self.get_selected_backup()
+        if backup_name is None:
             return
         
-        item = self.tree.item(selection[0])
-        backup_name = item['values'][0]
-        backup_path = self.backup_dir / backup_name
-        
         # Confirmar restauración
         if not messagebox.askyesno("Confirmar Restauración", 
                                    f"¿Está seguro de restaurar desde {backup_name}?\n\n"
                                    "ADVERTENCIA: Esto reemplazará todos los datos actuales."):
             return
         
-        try:
-            # Extraer archivo ZIP
-            with zipfile.ZipFile(str(backup_path), 'r') as zipf:
-                # Restaurar base de datos
-                if "cordiax.db" in zipf.namelist():
-                    db_path = database.get_db_path()
-                    zipf.extract("cordiax.db", str(database.USER_DATA_DIR))
-                    # Mover al lugar correcto si es necesario
-                    extracted = database.USER_DATA_DIR / "cordiax.db"
-                    if extracted != db_path:
-                        shutil.move(str(extracted), str(db_path))
-                
-                # Restaurar documentos
-                docs_dir = database.USER_DATA_DIR / "documentos"
-                for member in zipf.namelist():
-                    if member.startswith("documentos/"):
-                        zipf.extract(member, str(database.USER_DATA_DIR))
-                
-                # Restaurar PDFs
-                pdfs_dir = database.USER_DATA_DIR / "pdfs"
-                for member in zipf.namelist():
-                    if member.startswith("pdfs/"):
-                        zipf.extract(member, str(database.USER_DATA_DIR))
-            
+        def done(_):
             messagebox.showinfo("Éxito", 
                                "Restauración completada correctamente.\n\n"
                                "Por favor, reinicie la aplicación para aplicar los cambios.")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al restaurar backup: {str(e)}")
+        
+        # Por el hilo de escritura: ninguna escritura se cuela al sustituir los datos
+        self.start_job("Restauración", backup_name, self._extract_backup, backup_name,
+                       on_success=done, error_text="Error al restaurar backup", write=True)
+    
+    def _release_database(self):
+        """Cerrar las conexiones antes de sustituir la base de datos
+        
+        Se ejecuta en el hilo de escritura: el WAL se vuelca al archivo antes
+        de cerrar, y el WAL y el -shm los retira SQLite al cerrarse la última
+        conexión (borrarlos con conexiones abiertas podría dañar el archivo).
+        """
+        database.checkpoint()
+        if not database.close_all_connections():
+            raise RuntimeError("La base de datos está en uso; inténtelo de nuevo")
+    
+    def _extract_backup(self, job, backup_name):
+        """Sustituir los datos actuales por los del backup (fuera del hilo de Tk)
+        
+        Los archivos se preparan junto a su destino y se sustituyen todos al
+        final: si se cancela, los datos actuales quedan intactos.
+        """
+        with backup_restore.open_source(self.store, self.backup_dir, backup_name) as source:
+            staged = backup_restore.stage_files(source, None, database.USER_DATA_DIR, job,
+                                                db_path=database.get_db_path())
+        try:
+            job.check()
+            self._release_database()
+        except BaseException:
+            backup_store.discard_staged(staged)
+            raise
+        backup_store.commit_staged(staged)
+    
+    def selective_restore(self):
+        """Comparar o restaurar solo algunas tablas, fechas o documentos"""
+        backup_name = self.get_selected_backup()
+        if backup_name is None:
+            return
+        
+        def done(result):
+            members, tables = result
+            SelectiveRestoreDialog(self.parent, self, backup_name, members, tables)
+        
+        db_executor.run_in_background(
+            self.parent, self._read_members, backup_name, on_success=done,
+            on_error=lambda e: messagebox.showerror("Error", f"Error al abrir backup: {str(e)}"))
+    
+    def _read_members(self, backup_name):
+        """Archivos de una copia y tablas actuales (fuera del hilo de Tk)"""
+        with backup_restore.open_source(self.store, self.backup_dir, backup_name) as source:
+            members = source.members()
+        return members, backup_restore.live_tables()
+    
+    def _compare_backup(self, job, backup_name, tables, date_from, date_to, paths):
+        """Comparar una copia con los datos actuales sin modificar nada (fuera del hilo de Tk)"""
+        with backup_restore.open_source(self.store, self.backup_dir, backup_name) as source:
+            files = backup_restore.diff_files(source, database.USER_DATA_DIR, paths)
+            # Solo documentos: no hace falta abrir la base de datos de la copia
+            if tables is not None and not tables:
+                return [], files
+            conn = backup_restore.load_database(source, database.DB_PASSWORD or None)
+        try:
+            return backup_restore.diff_database(conn, job, tables, date_from, date_to), files
+        finally:
+            conn.close()
+    
+    def _restore_selection(self, job, backup_name, tables, date_from, date_to, paths):
+        """Restaurar las tablas y documentos elegidos (en el hilo de escritura)
+        
+        Los documentos se preparan antes y solo se sustituyen si las tablas se
+        han copiado bien.
+        """
+        with backup_restore.open_source(self.store, self.backup_dir, backup_name) as source:
+            staged = backup_restore.stage_files(source, paths, database.USER_DATA_DIR,
+                                                job) if paths else []
+            try:
+                copied = {}
+                if tables:
+                    conn = backup_restore.load_database(source, database.DB_PASSWORD or None)
+                    try:
+                        copied = backup_restore.restore_tables(conn, job, tables,
+                                                               date_from, date_to)
+                    finally:
+                        conn.close()
+            except BaseException:
+                backup_store.discard_staged(staged)
+                raise
+        backup_store.commit_staged(staged)
+        return copied, len(staged)
     
     def export_backup(self):
         """Exportar backup a una ubicación externa"""
-        selection = self.tree.selection()
-        if not selection:
-            messagebox.showwarning("Advertencia", "Por favor, seleccione un backup")
+        backup_name = self.get_selected_backup()
+        if backup_name is None:
             return
         
-        item = self.tree.item(selection[0])
-        backup_name = item['values'][0]
-        backup_path = self.backup_dir / backup_name
-        
         # Seleccionar ubicación de destino
         dest_path = filedialog.asksaveasfilename(
             defaultextension=".cordiax.zip",
             filetypes=[("Backup Cordiax", "*.cordiax.zip"), ("All files", "*.*")],
-            initialfile=backup_name
+            initialfile=backup_name if backup_name.endswith(".cordiax.zip")
+            else f"{backup_name}.cordiax.zip"
         )
         
         if not dest_path:
             return
         
-        try:
-            shutil.copy2(str(backup_path), dest_path)
+        def done(_):
             messagebox.showinfo("Éxito", f"Backup exportado a:\n{dest_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al exportar backup: {str(e)}")
+        
+        self.start_job("Exportación", backup_name, self._export_backup, backup_name, dest_path,
+                       on_success=done, error_text="Error al exportar backup")
+    
+    def _export_backup(self, job, backup_name, dest_path):
+        """Escribir el .cordiax.zip de una copia (fuera del hilo de Tk)"""
+        if not backup_name.endswith(".cordiax.zip"):
+            self.store.export_zip(backup_name, dest_path, job=job)
+            return
+        
+        source = self.backup_dir / backup_name
+        size = source.stat().st_size
+        job.start(1, size)
+        job.begin_file(backup_name)
+        try:
+            with open(source, 'rb') as src, open(dest_path, 'wb') as dst:
+                while True:
+                    data = src.read(COPY_BLOCK_SIZE)
+                    if not data:
+                        break
+                    dst.write(data)
+                    job.advance(len(data))
+        except BaseException:
+            Path(dest_path).unlink(missing_ok=True)
+            raise
+        shutil.copystat(str(source), dest_path)
+        job.end_file()
     
     def import_backup(self):
         """Importar backup desde ubicación externa"""
@@ -252,45 +455,145 @@ class BackupModule:
         if not filename:
             return
         
-        try:
-            source = Path(filename)
-            # Generar nombre único si es necesario
-            dest_name = source.name
-            dest_path = self.backup_dir / dest_name
-            
-            counter = 1
-            while dest_path.exists():
-                name_parts = source.stem.split('.')
-                dest_name = f"{name_parts[0]}_{counter}.cordiax.zip"
-                dest_path = self.backup_dir / dest_name
-                counter += 1
-            
-            shutil.copy2(filename, str(dest_path))
+        # El almacén genera un id único si el nombre ya existe
+        name = Path(filename).name
+        if name.endswith(".cordiax.zip"):
+            name = name[:-len(".cordiax.zip")]
+        
+        def done(manifest):
             self.load_backups()
-            messagebox.showinfo("Éxito", f"Backup importado como:\n{dest_name}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al importar backup: {str(e)}")
+            messagebox.showinfo("Éxito", f"Backup importado como:\n{manifest['id']}")
+        
+        self.start_job("Importación", name, self._import_backup, filename, name,
+                       on_success=done, error_text="Error al importar backup")
     
-    def delete_backup(self):
-        """Eliminar backup seleccionado"""
+    def _import_backup(self, job, filename, name):
+        """Guardar un .cordiax.zip en el almacén (fuera del hilo de Tk)"""
+        return self.store.import_zip(filename, name, job=job)
+    
+    def verify_backups(self):
+        """Verificar las copias seleccionadas (o todas si no hay selección)"""
         selection = self.tree.selection()
         if not selection:
-            messagebox.showwarning("Advertencia", "Por favor, seleccione un backup")
+            if not messagebox.askyesno("Confirmar", "No hay ningún backup seleccionado.\n\n"
+                                       "¿Desea verificar todos los backups?"):
+                return
+            selection = list(self.catalog_entries)
+        entries = [self.catalog_entries[backup_id] for backup_id in selection
+                   if backup_id in self.catalog_entries]
+        
+        def done(results):
+            self.load_backups()
+            damaged = [backup_id for backup_id, result in results.items()
+                       if result["status"] != backup_catalog.STATUS_OK]
+            if damaged:
+                messagebox.showwarning("Verificación",
+                                       f"Backups dañados ({len(damaged)} de {len(results)}):\n"
+                                       + "\n".join(damaged))
+            else:
+                messagebox.showinfo("Verificación",
+                                    f"{len(results)} backups verificados correctamente")
+        
+        name = entries[0]["id"] if len(entries) == 1 else f"{len(entries)} backups"
+        self.start_job("Verificación", name, self._verify_backups, entries,
+                       on_success=done, error_text="Error al verificar backups")
+    
+    def _verify_backups(self, job, entries):
+        """Verificar copias en un grupo de procesos (fuera del hilo de Tk)"""
+        secret = None
+        if encryption.is_encryption_enabled(database.USER_DATA_DIR):
+            secret = database.get_session_key()
+        return backup_verify.verify_backups(job, self.store, self.backup_dir, entries, secret)
+    
+    def start_job(self, operation, name, func, *args, on_success=None, error_text="Error",
+                  write=False):
+        """Lanzar una operación de backup en segundo plano con progreso y cancelación"""
+        if self.job is not None:
+            messagebox.showwarning("Advertencia",
+                                   f"Ya hay una operación en curso ({self.job.operation})")
             return
         
-        item = self.tree.item(selection[0])
-        backup_name = item['values'][0]
-        backup_path = self.backup_dir / backup_name
+        self.job = backup_jobs.Job(name, operation)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.show_progress(self.job.snapshot())
+        
+        def finish():
+            self.job = None
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_bar.config(value=0)
+        
+        def done(result):
+            snapshot = self.job.snapshot()
+            finish()
+            self.progress_label.config(
+                text=f"{operation} completado en {snapshot['elapsed']:.1f} s "
+                     f"({format_size(snapshot['bytes_done'])}, "
+                     f"{backup_jobs.format_rate(snapshot['rate'])})")
+            if on_success:
+                on_success(result)
+        
+        def cancelled():
+            finish()
+            self.progress_label.config(text=f"{operation} cancelado")
+            messagebox.showinfo("Cancelado", f"{operation} cancelado. No se ha modificado nada.")
+        
+        def failed(e):
+            finish()
+            self.progress_label.config(text=f"{operation} con errores")
+            messagebox.showerror("Error", f"{error_text}: {str(e)}")
+        
+        backup_jobs.run_job(self.parent, self.job, func, *args,
+                            on_progress=self.show_progress, on_success=done,
+                            on_error=failed, on_cancel=cancelled, write=write)
+    
+    def show_progress(self, snapshot):
+        """Mostrar el avance del trabajo en curso"""
+        if snapshot["bytes_total"]:
+            self.progress_bar.config(value=100 * snapshot["bytes_done"] / snapshot["bytes_total"])
+        self.progress_label.config(
+            text=f"{self.job.operation}: {snapshot['files_done']}/{snapshot['files_total']} "
+                 f"archivos  {format_size(snapshot['bytes_done'])} de "
+                 f"{format_size(snapshot['bytes_total'])}  "
+                 f"{backup_jobs.format_rate(snapshot['rate'])}  "
+                 f"quedan {backup_jobs.format_eta(snapshot['eta'])}  {snapshot['current']}")
+    
+    def cancel_job(self):
+        """Cancelar la operación de backup en curso"""
+        if self.job is not None:
+            self.job.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_label.config(text=f"Cancelando {self.job.operation.lower()}...")
+    
+    def delete_backup(self):
+        """Eliminar backup seleccionado"""
+        backup_name = self.get_selected_backup()
+        if backup_name is None:
+            return
         
-        if messagebox.askyesno("Confirmar", 
-                              f"¿Está seguro de eliminar el backup {backup_name}?"):
-            try:
-                backup_path.unlink()
-                self.load_backups()
-                messagebox.showinfo("Éxito", "Backup eliminado correctamente")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error al eliminar backup: {str(e)}")
+        if not messagebox.askyesno("Confirmar", 
+                                   f"¿Está seguro de eliminar el backup {backup_name}?"):
+            return
+        
+        def done(_):
+            db_executor.set_busy(self.parent, False)
+            self.load_backups()
+            messagebox.showinfo("Éxito", "Backup eliminado correctamente")
+        
+        def failed(e):
+            db_executor.set_busy(self.parent, False)
+            messagebox.showerror("Error", f"Error al eliminar backup: {str(e)}")
+        
+        db_executor.set_busy(self.parent, True)
+        db_executor.run_in_background(self.parent, self._delete_backup, backup_name,
+                                      on_success=done, on_error=failed, write=True)
+    
+    def _delete_backup(self, backup_name):
+        """Eliminar una copia y liberar los bloques que solo usaba ella"""
+        if backup_name.endswith(".cordiax.zip"):
+            (self.backup_dir / backup_name).unlink()
+        else:
+            self.store.delete_backup(backup_name)
+            self.store.gc()
     
     def update_encryption_status(self):
         """Actualizar el estado de encriptación en la UI"""
@@ -312,25 +615,25 @@ class BackupModule:
         if password is None:
             return
         
-        try:
-            # Marcar como habilitada
-            encryption.enable_encryption(database.USER_DATA_DIR)
-            
-            # Establecer contraseña en la base de datos
-            database.set_password(password)
-            
-            # Encriptar la base de datos actual
-            db_path = database.get_db_path()
-            if db_path.exists() and not encryption.is_encrypted(db_path):
-                encryption.encrypt_file(db_path, password)
-            
+        def done(_):
+            db_executor.set_busy(self.parent, False)
             self.update_encryption_status()
             messagebox.showinfo("Éxito", 
                                "Encriptación habilitada correctamente.\n\n"
                                "A partir de ahora, se solicitará la contraseña al iniciar la aplicación.")
-        except Exception as e:
+        
+        def failed(e):
+            db_executor.set_busy(self.parent, False)
             encryption.disable_encryption(database.USER_DATA_DIR)
             messagebox.showerror("Error", f"Error al habilitar encriptación: {str(e)}")
+        
+        db_executor.set_busy(self.parent, True)
+        db_executor.run_in_background(self.parent, self._encrypt_database, password,
+                                      on_success=done, on_error=failed, write=True)
+    
+    def _encrypt_database(self, password):
+        """Activar la encriptación y encriptar la base de datos (fuera del hilo de Tk)"""
+        database.encrypt_database(password)
     
     def disable_encryption(self):
         """Deshabilitar encriptación de la base de datos"""
@@ -343,23 +646,183 @@ class BackupModule:
                                   "La base de datos quedará sin protección de contraseña."):
             return
         
-        try:
-            # Desencriptar la base de datos si está encriptada
-            db_path = database.get_db_path()
-            if encryption.is_encrypted(db_path):
-                # La base de datos ya debería estar desencriptada en memoria
-                # Solo necesitamos marcar como deshabilitada
-                pass
-            
-            # Marcar como deshabilitada
-            encryption.disable_encryption(database.USER_DATA_DIR)
-            
-            # Limpiar contraseña
-            database.set_password(None)
-            
+        def done(_):
+            db_executor.set_busy(self.parent, False)
             self.update_encryption_status()
             messagebox.showinfo("Éxito", 
                                "Encriptación deshabilitada correctamente.\n\n"
                                "Ya no se solicitará contraseña al iniciar la aplicación.")
-        except Exception as e:
+        
+        def failed(e):
+            db_executor.set_busy(self.parent, False)
             messagebox.showerror("Error", f"Error al deshabilitar encriptación: {str(e)}")
+        
+        db_executor.set_busy(self.parent, True)
+        db_executor.run_in_background(self.parent, self._decrypt_database,
+                                      on_success=done, on_error=failed, write=True)
+    
+    def _decrypt_database(self):
+        """Desencriptar la base de datos y desactivar la encriptación (fuera del hilo de Tk)"""
+        database.decrypt_database()
+
+
+class SelectiveRestoreDialog:
+    """Diálogo para comparar o restaurar parte de un backup"""
+    
+    def __init__(self, parent, module, backup_name, members, tables):
+        self.module = module
+        self.backup_name = backup_name
+        self.tables = tables
+        self.documents = sorted(path for path in members if path != "cordiax.db")
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title(f"Restaurar Selección - {backup_name}")
+        self.dialog.geometry("760x620")
+        self.dialog.transient(parent)
+        # Sin grab_set: el progreso y el botón Cancelar están en la ventana principal
+        
+        self.setup_ui()
+    
+    def setup_ui(self):
+        """Configurar la interfaz del diálogo"""
+        main_frame = ttk.Frame(self.dialog, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Tablas y documentos
+        lists_frame = ttk.Frame(main_frame)
+        lists_frame.pack(fill=tk.BOTH, expand=True)
+        
+        tables_frame = ttk.LabelFrame(lists_frame, text="Tablas", padding="5")
+        tables_frame.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 5))
+        self.tables_list = tk.Listbox(tables_frame, selectmode=tk.MULTIPLE,
+                                      exportselection=False, height=10)
+        self.tables_list.pack(fill=tk.BOTH, expand=True)
+        for table in self.tables:
+            self.tables_list.insert(tk.END, table)
+        
+        documents_frame = ttk.LabelFrame(lists_frame, text="Documentos", padding="5")
+        documents_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar = ttk.Scrollbar(documents_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.documents_list = tk.Listbox(documents_frame, selectmode=tk.EXTENDED,
+                                         exportselection=False, height=10,
+                                         yscrollcommand=scrollbar.set)
+        scrollbar.config(command=self.documents_list.yview)
+        self.documents_list.pack(fill=tk.BOTH, expand=True)
+        for path in self.documents:
+            self.documents_list.insert(tk.END, path)
+        
+        # Intervalo de fechas (solo tablas con columna fecha)
+        dates_frame = ttk.Frame(main_frame)
+        dates_frame.pack(fill=tk.X, pady=10)
+        
+        ttk.Label(dates_frame, text="Desde (AAAA-MM-DD):").pack(side=tk.LEFT, padx=(0, 5))
+        self.date_from_var = tk.StringVar()
+        ttk.Entry(dates_frame, textvariable=self.date_from_var, width=12).pack(side=tk.LEFT)
+        ttk.Label(dates_frame, text="Hasta:").pack(side=tk.LEFT, padx=(10, 5))
+        self.date_to_var = tk.StringVar()
+        ttk.Entry(dates_frame, textvariable=self.date_to_var, width=12).pack(side=tk.LEFT)
+        ttk.Label(dates_frame, text="(solo tablas con fecha)",
+                  font=("Arial", 9, "italic")).pack(side=tk.LEFT, padx=10)
+        
+        # Botones
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Button(button_frame, text="Comparar", 
+                  command=self.compare).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Restaurar Selección", 
+                  command=self.restore).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Cerrar", 
+                  command=self.dialog.destroy).pack(side=tk.RIGHT, padx=5)
+        
+        # Resultado de la comparación
+        columns = ("Elemento", "Nuevos", "Eliminados", "Modificados", "Iguales")
+        self.result_tree = ttk.Treeview(main_frame, columns=columns, show="headings", height=8)
+        for col in columns:
+            self.result_tree.heading(col, text=col)
+            self.result_tree.column(col, width=100, anchor=tk.E)
+        self.result_tree.column("Elemento", width=260, anchor=tk.W)
+        self.result_tree.pack(fill=tk.BOTH, expand=True)
+        
+        info_text = ("Comparar no modifica nada: cuenta las filas y documentos que la restauración\n"
+                    "añadiría, eliminaría o cambiaría. Sin nada seleccionado se compara todo.")
+        ttk.Label(main_frame, text=info_text, font=("Arial", 9, "italic"),
+                  justify=tk.LEFT).pack(anchor=tk.W, pady=(10, 0))
+    
+    def get_selection(self):
+        """Tablas, fechas y documentos elegidos, o None si las fechas no son válidas"""
+        dates = []
+        for var in (self.date_from_var, self.date_to_var):
+            value = var.get().strip()
+            if value:
+                try:
+                    datetime.strptime(value, "%Y-%m-%d")
+                except ValueError:
+                    messagebox.showerror("Error", f"Fecha no válida: {value}\n\n"
+                                         "Use el formato AAAA-MM-DD", parent=self.dialog)
+                    return None
+            dates.append(value or None)
+        tables = [self.tables_list.get(index) for index in self.tables_list.curselection()]
+        paths = [self.documents[index] for index in self.documents_list.curselection()]
+        return tables, dates[0], dates[1], paths
+    
+    def compare(self):
+        """Comparar la selección (o todo) con los datos actuales"""
+        selection = self.get_selection()
+        if selection is None:
+            return
+        tables, date_from, date_to, paths = selection
+        if not tables and not paths:
+            tables, paths = None, None
+        
+        def done(result):
+            if self.dialog.winfo_exists():
+                self.show_diff(*result)
+        
+        self.module.start_job("Comparación", self.backup_name, self.module._compare_backup,
+                              self.backup_name, tables, date_from, date_to, paths,
+                              on_success=done, error_text="Error al comparar backup")
+    
+    def show_diff(self, tables, files):
+        """Mostrar los recuentos de la comparación"""
+        self.result_tree.delete(*self.result_tree.get_children())
+        for result in tables:
+            self.result_tree.insert("", tk.END, values=(
+                result["table"], result["added"], result["removed"],
+                result["changed"], result["unchanged"]))
+        if sum(files.values()):
+            self.result_tree.insert("", tk.END, values=(
+                "Documentos", files["added"], "", files["changed"], files["unchanged"]))
+    
+    def restore(self):
+        """Restaurar solo las tablas y documentos elegidos"""
+        selection = self.get_selection()
+        if selection is None:
+            return
+        tables, date_from, date_to, paths = selection
+        if not tables and not paths:
+            messagebox.showwarning("Advertencia", "Seleccione tablas o documentos",
+                                   parent=self.dialog)
+            return
+        
+        scope = ""
+        if date_from or date_to:
+            scope = f" entre {date_from or 'el inicio'} y {date_to or 'hoy'}"
+        if not messagebox.askyesno("Confirmar Restauración",
+                                   f"Se sustituirán {len(tables)} tablas{scope} y "
+                                   f"{len(paths)} documentos por los de {self.backup_name}.\n\n"
+                                   "¿Desea continuar?", parent=self.dialog):
+            return
+        
+        def done(result):
+            copied, documents = result
+            messagebox.showinfo("Éxito",
+                                f"Restauración completada:\n{sum(copied.values())} filas en "
+                                f"{len(copied)} tablas y {documents} documentos")
+        
+        # Por el hilo de escritura: las tablas se sustituyen en una transacción
+        self.module.start_job("Restauración", self.backup_name, self.module._restore_selection,
+                              self.backup_name, tables, date_from, date_to, paths,
+                              on_success=done, error_text="Error al restaurar selección",
+                              write=True)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Catálogo de copias de seguridad
+Índice SQLite con los datos de cada copia para listarlas sin abrirlas
+
+Cada copia del almacén se anota al crearse (filas por tabla, documentos,
+tamaño, hash del manifiesto, encriptación y copia base) y los .cordiax.zip
+de backups/ se anotan la primera vez que se ven leyendo solo su directorio
+central. Si un archivo cambia de tamaño o fecha, o ya no se puede leer, se
+vuelve a indexar y, si hace falta, se marca como dañado. La última
+verificación de cada copia (backup_verify) también queda anotada. El
+catálogo es un índice: se puede borrar y se reconstruye a partir de
+manifiestos y archivos.
+"""
+
+import json
+import sqlite3
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+
+CATALOG_FILE = "catalog.db"
+
+STATUS_OK = "ok"
+STATUS_CORRUPT = "dañado"
+
+SOURCE_STORE = "store"
+SOURCE_ZIP = "zip"
+
+_COLUMNS = ("id", "source", "kind", "created", "size", "stored", "files", "documents",
+            "tables", "hash", "encrypted", "base", "status", "detail",
+            "file_size", "file_mtime_ns", "verified_at")
+
+
+def _migration_base_schema(cursor):
+    """Migración 1: tabla de copias"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backups (
+            id TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            kind TEXT,
+            created TEXT NOT NULL,
+            size INTEGER,
+            stored INTEGER,
+            files INTEGER,
+            documents INTEGER,
+            tables TEXT,
+            hash TEXT,
+            encrypted INTEGER,
+            base TEXT,
+            status TEXT NOT NULL DEFAULT 'ok',
+            detail TEXT,
+            file_size INTEGER,
+            file_mtime_ns INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_backups_created ON backups(created)')
+
+
+def _migration_verification(cursor):
+    """Migración 2: fecha de la última verificación"""
+    cursor.execute('ALTER TABLE backups ADD COLUMN verified_at TEXT')
+
+
+# Igual que en database: cada migración sube PRAGMA user_version en uno
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_verification,
+]
+
+
+class BackupCatalog:
+    """Índice de copias guardado en un archivo SQLite aparte
+
+    Se abre una conexión por operación: el catálogo se usa desde el hilo de
+    Tk y desde los trabajos de backup.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._migrate()
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _migrate(self):
+        conn = self._connect()
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                with conn:
+                    migration(conn.cursor())
+                    conn.execute(f"PRAGMA user_version = {number}")
+        finally:
+            conn.close()
+
+    def record(self, entry):
+        """Añadir o sustituir la ficha de una copia"""
+        values = [entry.get(column) for column in _COLUMNS]
+        index = _COLUMNS.index("tables")
+        if values[index] is not None:
+            values[index] = json.dumps(values[index], ensure_ascii=False)
+        if values[_COLUMNS.index("status")] is None:
+            values[_COLUMNS.index("status")] = STATUS_OK
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"INSERT OR REPLACE INTO backups ({', '.join(_COLUMNS)}) "
+                             f"VALUES ({', '.join('?' for _ in _COLUMNS)})", values)
+        finally:
+            conn.close()
+
+    def remove(self, backup_id):
+        """Quitar una copia del catálogo"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM backups WHERE id = ?", (backup_id,))
+        finally:
+            conn.close()
+
+    def set_status(self, backup_id, status, detail=None):
+        """Marcar una copia como correcta o dañada"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE backups SET status = ?, detail = ? WHERE id = ?",
+                             (status, detail, backup_id))
+        finally:
+            conn.close()
+
+    def set_verification(self, backup_id, status, detail=None, file_hash=None):
+        """Anotar el resultado de una verificación (y el hash calculado, si hay)"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE backups SET status = ?, detail = ?, verified_at = ?, "
+                             "hash = COALESCE(?, hash) WHERE id = ?",
+                             (status, detail, datetime.now().isoformat(timespec="seconds"),
+                              file_hash, backup_id))
+        finally:
+            conn.close()
+
+    def get(self, backup_id):
+        """Ficha de una copia (dict) o None"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM backups WHERE id = ?", (backup_id,)).fetchone()
+        finally:
+            conn.close()
+        return _to_dict(row) if row else None
+
+    def list(self, source=None, kind=None):
+        """Fichas de las copias, de la más reciente a la más antigua"""
+        conditions = []
+        params = []
+        if source:
+            conditions.append("source = ?")
+            params.append(source)
+        if kind:
+            conditions.append("kind = ?")
+            params.append(kind)
+        query = "SELECT * FROM backups"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        conn = self._connect()
+        try:
+            rows = conn.execute(query + " ORDER BY created DESC, id DESC", params).fetchall()
+        finally:
+            conn.close()
+        return [_to_dict(row) for row in rows]
+
+    def sync_zips(self, backup_dir):
+        """Indexar los .cordiax.zip nuevos o modificados y olvidar los que ya no están"""
+        known = {entry["id"]: entry for entry in self.list(SOURCE_ZIP)}
+        seen = set()
+        for path in Path(backup_dir).glob("*.cordiax.zip"):
+            seen.add(path.name)
+            stat = path.stat()
+            entry = known.get(path.name)
+            if (entry is None or entry["file_size"] != stat.st_size
+                    or entry["file_mtime_ns"] != stat.st_mtime_ns):
+                self.record(zip_entry(path))
+        for name in known:
+            if name not in seen:
+                self.remove(name)
+
+
+def _to_dict(row):
+    entry = dict(row)
+    if entry.get("tables"):
+        entry["tables"] = json.loads(entry["tables"])
+    return entry
+
+
+def zip_entry(path):
+    """Ficha de un .cordiax.zip leyendo solo su directorio central"""
+    path = Path(path)
+    stat = path.stat()
+    entry = {
+        "id": path.name,
+        "source": SOURCE_ZIP,
+        "kind": SOURCE_ZIP,
+        "created": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+        "size": stat.st_size,
+        "stored": stat.st_size,
+        "file_size": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+    }
+    try:
+        with zipfile.ZipFile(str(path), 'r') as zipf:
+            members = [info for info in zipf.infolist() if not info.is_dir()]
+            entry["files"] = len(members)
+            entry["documents"] = sum(1 for info in members
+                                     if info.filename.startswith("documentos/"))
+            entry["size"] = sum(info.file_size for info in members)
+            if "cordiax.db" not in zipf.namelist():
+                entry["status"] = STATUS_CORRUPT
+                entry["detail"] = "No contiene cordiax.db"
+    except (zipfile.BadZipFile, OSError) as e:
+        entry["status"] = STATUS_CORRUPT
+        entry["detail"] = f"No se puede leer: {e}"
+    return entry
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Trabajos de backup en segundo plano
+Progreso por archivo, velocidad, tiempo restante y cancelación
+
+El trabajo se ejecuta en un hilo propio (o en el de escritura de
+db_executor si sustituye la base de datos) y va anotando su avance en un
+objeto Job; la interfaz lo consulta con after() y puede
+pedir la cancelación, que el trabajo atiende en el siguiente bloque que lee
+o escribe (lanzando JobCancelled para que cada operación limpie lo que ha
+dejado a medias). Cada ejecución queda registrada en logs/backup_jobs.log.
+"""
+
+import time
+import threading
+import logging
+from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from modules import database, db_executor
+
+
+PROGRESS_INTERVAL_MS = 200
+
+# Los trabajos que no sustituyen la base de datos van por su propio hilo para
+# no bloquear durante minutos las escrituras de la aplicación
+_jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cordiax-backup-job")
+_job_log = None
+
+
+class JobCancelled(Exception):
+    """El usuario ha cancelado el trabajo"""
+
+
+class Job:
+    """Estado compartido entre el hilo del trabajo y el de Tk"""
+
+    def __init__(self, name, operation):
+        self.name = name
+        self.operation = operation
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.current = ""
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def start(self, files_total, bytes_total):
+        """Fijar el trabajo total (archivos y bytes) antes de empezar"""
+        with self._lock:
+            self.files_total = files_total
+            self.bytes_total = bytes_total
+
+    def begin_file(self, path):
+        """Empezar un archivo"""
+        self.check()
+        with self._lock:
+            self.current = path
+
+    def end_file(self):
+        """Terminar el archivo actual"""
+        with self._lock:
+            self.files_done += 1
+
+    def advance(self, size):
+        """Sumar bytes procesados y atender una posible cancelación"""
+        with self._lock:
+            self.bytes_done += size
+        self.check()
+
+    def check(self):
+        """Lanzar JobCancelled si se ha pedido cancelar"""
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        """Pedir la cancelación (desde el hilo de Tk)"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def snapshot(self):
+        """Avance actual con velocidad (bytes/s) y tiempo restante estimado"""
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+            remaining = max(self.bytes_total - self.bytes_done, 0)
+            return {
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "current": self.current,
+                "elapsed": elapsed,
+                "rate": rate,
+                "eta": remaining / rate if rate > 0 else None,
+            }
+
+
+def run_job(widget, job, func, *args, on_progress=None, on_success=None,
+            on_error=None, on_cancel=None, write=False):
+    """Ejecutar func(job, *args) fuera del hilo de Tk
+
+    Con write el trabajo va por el hilo de escritura de db_executor (p. ej.
+    una restauración, que no puede cruzarse con ninguna escritura).
+    on_progress(snapshot) se llama periódicamente en el hilo de Tk hasta que
+    el trabajo termina; después se llama on_success(resultado), on_cancel()
+    u on_error(error). El resultado de cada ejecución se registra.
+    """
+    if write:
+        future = db_executor.submit_write(func, job, *args)
+    else:
+        future = _jobs.submit(func, job, *args)
+
+    def progress():
+        try:
+            if not widget.winfo_exists():
+                return
+        except Exception:
+            return
+        if future.done():
+            return
+        if on_progress:
+            on_progress(job.snapshot())
+        widget.after(PROGRESS_INTERVAL_MS, progress)
+
+    def done(result):
+        log_run(job, "completado", result)
+        if on_success:
+            on_success(result)
+
+    def failed(error):
+        if isinstance(error, JobCancelled):
+            log_run(job, "cancelado")
+            if on_cancel:
+                on_cancel()
+            return
+        log_run(job, f"error: {error}")
+        if on_error:
+            on_error(error)
+        else:
+            print(f"Error en {job.operation} de {job.name}: {error}")
+
+    widget.after(PROGRESS_INTERVAL_MS, progress)
+    db_executor.deliver(widget, future, done, failed)
+    return future
+
+
+def format_rate(rate):
+    """Velocidad en MB/s"""
+    return f"{rate / (1024 * 1024):.1f} MB/s"
+
+
+def format_eta(seconds):
+    """Tiempo restante como mm:ss (o h:mm:ss)"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def _get_job_log():
+    """Obtener el registro rotativo de trabajos, creándolo la primera vez"""
+    global _job_log
+    if _job_log is None:
+        log_dir = database.USER_DATA_DIR / "logs"
+        log_dir.mkdir(exist_ok=True)
+        handler = RotatingFileHandler(str(log_dir / "backup_jobs.log"),
+                                      maxBytes=1024 * 1024, backupCount=3,
+                                      encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _job_log = logging.getLogger("cordiax.backup_jobs")
+        _job_log.setLevel(logging.INFO)
+        _job_log.propagate = False
+        _job_log.addHandler(handler)
+    return _job_log
+
+
+def log_run(job, status, result=None):
+    """Registrar duración, tamaño y velocidad de una ejecución"""
+    if database.USER_DATA_DIR is None:
+        return
+    snapshot = job.snapshot()
+    line = (f"{job.operation} {job.name}: {status} en {snapshot['elapsed']:.1f} s, "
+            f"{snapshot['files_done']}/{snapshot['files_total']} archivos, "
+            f"{snapshot['bytes_done'] / (1024 * 1024):.2f} MB, "
+            f"{format_rate(snapshot['rate'])}")
+    if isinstance(result, dict) and "stored" in result:
+        line += f", {result['stored'] / (1024 * 1024):.2f} MB nuevos en el almacén"
+    try:
+        _get_job_log().info(line)
+    except Exception as e:
+        print(f"Error al registrar trabajo de backup: {e}")
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Restauración selectiva de copias de seguridad
+Restaura archivos, tablas o un intervalo de fechas y compara una copia con los datos actuales
+
+Los archivos se leen directamente de la copia (del .cordiax.zip o de los
+bloques del almacén) y se escriben junto a su destino, sin extraer antes la
+copia entera a una carpeta temporal. La base de datos de la copia se carga
+en memoria (desencriptándola si hace falta, sin escribirla en claro a disco)
+y desde ahí se copian las tablas elegidas a la base de datos actual, en una
+sola transacción.
+
+La comparación (sin modificar nada) recorre cada tabla de las dos bases de
+datos ordenada por rowid, calcula un resumen de cada fila y cuenta las filas
+que la restauración añadiría, eliminaría o cambiaría. Para los documentos
+se comparan tamaño y fecha con los archivos actuales.
+"""
+
+import hashlib
+import sqlite3
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from modules import database, encryption, backup_store
+
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Carpetas de datos que se restauran junto con la base de datos
+DATA_FOLDERS = ("documentos/", "pdfs/")
+
+# Columna por la que se filtra una restauración por fechas
+DATE_COLUMN = "fecha"
+
+# Cada cuántas filas se atiende una cancelación
+ROW_BATCH = 1000
+
+# Ids por consulta al buscar conflictos (SQLite antiguos admiten 999 parámetros)
+ID_BATCH = 500
+
+
+def stage_zip_member(zipf, info, target_path, job):
+    """Escribir un miembro del zip junto a target_path sin sustituirlo
+
+    Devuelve (temporal, destino, mtime) para backup_store.commit_staged().
+    """
+    target_path = Path(target_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = target_path.with_name(target_path.name + ".restore")
+    job.begin_file(info.filename)
+    try:
+        with zipf.open(info) as member, open(temp_path, 'wb') as f:
+            while True:
+                data = member.read(COPY_BLOCK_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                job.advance(len(data))
+    except BaseException:
+        backup_store.discard_staged([(temp_path, target_path, None)])
+        raise
+    job.end_file()
+    return temp_path, target_path, datetime(*info.date_time).timestamp()
+
+
+class StoreSource:
+    """Copia del almacén deduplicado"""
+
+    def __init__(self, store, backup_id):
+        self.store = store
+        self.entries = {entry["path"]: entry for entry in store.resolve_files(backup_id)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    def members(self):
+        """Archivos de la copia: ruta -> (tamaño, mtime)"""
+        return {path: (entry["size"], entry.get("mtime"))
+                for path, entry in self.entries.items()}
+
+    def read(self, path):
+        """Contenido de un archivo, bloque a bloque"""
+        return self.store.iter_file(self.entries[path])
+
+    def stage(self, path, target_path, job):
+        return self.store.stage_file(self.entries[path], target_path, job)
+
+
+class ZipSource:
+    """Archivo .cordiax.zip"""
+
+    def __init__(self, zip_path):
+        self.zipf = zipfile.ZipFile(str(zip_path), 'r')
+        self.infos = {info.filename: info for info in self.zipf.infolist() if not info.is_dir()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.zipf.close()
+
+    def members(self):
+        """Archivos de la copia: ruta -> (tamaño, mtime)"""
+        return {path: (info.file_size, datetime(*info.date_time).timestamp())
+                for path, info in self.infos.items()}
+
+    def read(self, path):
+        """Contenido de un miembro, bloque a bloque"""
+        with self.zipf.open(self.infos[path]) as member:
+            while True:
+                data = member.read(COPY_BLOCK_SIZE)
+                if not data:
+                    return
+                yield data
+
+    def stage(self, path, target_path, job):
+        return stage_zip_member(self.zipf, self.infos[path], target_path, job)
+
+
+def open_source(store, backup_dir, backup_id):
+    """Abrir una copia del almacén o un .cordiax.zip de backup_dir según su id"""
+    if backup_id.endswith(".cordiax.zip"):
+        return ZipSource(Path(backup_dir) / backup_id)
+    return StoreSource(store, backup_id)
+
+
+def _quote(name):
+    """Identificador SQL entre comillas"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _select_paths(members, paths):
+    """Archivos de la copia que se restauran: todos (paths None), o los
+    indicados por ruta exacta o por carpeta ("documentos/")"""
+    if paths is None:
+        return [path for path in members
+                if path == "cordiax.db" or path.startswith(DATA_FOLDERS)]
+    selected = []
+    for path in members:
+        if any(path == wanted or (wanted.endswith("/") and path.startswith(wanted))
+               for wanted in paths):
+            selected.append(path)
+    return selected
+
+
+def _target_for(path, data_dir, db_path):
+    """Destino de un archivo de la copia, sin salirse de data_dir"""
+    if path == "cordiax.db":
+        return db_path
+    target_path = (data_dir / path).resolve()
+    if data_dir not in target_path.parents:
+        raise ValueError(f"Ruta no válida en el backup: {path}")
+    return target_path
+
+
+def stage_files(source, paths, data_dir, job, db_path=None):
+    """Preparar junto a su destino los archivos elegidos (todos con paths None)
+
+    Devuelve la lista para backup_store.commit_staged(). Si algo falla o se
+    cancela, se descarta lo preparado y los datos actuales quedan intactos.
+    """
+    data_dir = Path(data_dir).resolve()
+    members = source.members()
+    selected = _select_paths(members, paths)
+    job.start(len(selected), sum(members[path][0] for path in selected))
+    staged = []
+    try:
+        for path in selected:
+            staged.append(source.stage(path, _target_for(path, data_dir, db_path), job))
+        job.check()
+    except BaseException:
+        backup_store.discard_staged(staged)
+        raise
+    return staged
+
+
+def diff_files(source, data_dir, paths=None):
+    """Comparar los documentos de la copia con los actuales por tamaño y fecha
+
+    Devuelve {"added", "changed", "unchanged"}: archivos que la restauración
+    crearía, que sustituiría por otra versión o que ya son iguales.
+    """
+    data_dir = Path(data_dir)
+    members = source.members()
+    result = {"added": 0, "changed": 0, "unchanged": 0}
+    for path in _select_paths(members, paths):
+        if path == "cordiax.db":
+            continue
+        size, mtime = members[path]
+        try:
+            stat = (data_dir / path).stat()
+        except FileNotFoundError:
+            result["added"] += 1
+            continue
+        # Los zip guardan la fecha con resolución de 2 segundos
+        if stat.st_size == size and mtime is not None and abs(stat.st_mtime - mtime) < 2:
+            result["unchanged"] += 1
+        else:
+            result["changed"] += 1
+    return result
+
+
+def load_database(source, secret=None):
+    """Abrir en memoria la base de datos de una copia
+
+    secret es la contraseña o la clave de sesión, necesaria si la copia está
+    encriptada. Los datos en claro no se escriben a disco.
+    """
+    if "cordiax.db" not in source.members():
+        raise ValueError("La copia no contiene cordiax.db")
+    data = bytearray()
+    for block in source.read("cordiax.db"):
+        data += block
+
+    if data[:len(encryption.SQLITE_MAGIC)] != encryption.SQLITE_MAGIC:
+        if secret is None:
+            raise ValueError("La base de datos de la copia está encriptada y no hay contraseña")
+        data = bytearray(encryption.decrypt_data(bytes(data), secret))
+    # Igual que en la sesión encriptada: una imagen en modo WAL no se abre en memoria
+    if len(data) >= 20 and data[18] == 2:
+        data[18] = data[19] = 1
+
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.deserialize(bytes(data))
+    return conn
+
+
+def _tables(conn):
+    """Tablas de usuario de una conexión"""
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                        "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+    return [row[0] for row in rows]
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall()]
+
+
+def live_tables():
+    """Tablas de la base de datos actual"""
+    rows = database.fetch_all("SELECT name FROM sqlite_master WHERE type = 'table' "
+                              "AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    return [row[0] for row in rows]
+
+
+def _plan(backup_conn, tables, date_from, date_to):
+    """Tablas que se comparan o restauran, con sus columnas comunes y su filtro
+
+    Con un intervalo de fechas solo entran las tablas con columna fecha.
+    Devuelve una lista de (tabla, columnas, WHERE, parámetros).
+    """
+    live = set(live_tables())
+    backup_tables = set(_tables(backup_conn))
+    names = tables if tables is not None else sorted(live & backup_tables)
+
+    plan = []
+    for table in names:
+        if table not in live or table not in backup_tables:
+            raise ValueError(f"La tabla {table} no está en la copia o en la base de datos actual")
+        live_columns = [row[1] for row in database.fetch_all(f"PRAGMA table_info({_quote(table)})")]
+        backup_columns = set(_columns(backup_conn, table))
+        # Una copia de una versión anterior puede no tener las columnas nuevas
+        columns = [column for column in live_columns if column in backup_columns]
+
+        conditions = []
+        params = []
+        if date_from or date_to:
+            if DATE_COLUMN not in columns:
+                if tables is None:
+                    continue
+                raise ValueError(f"La tabla {table} no tiene fechas")
+            if date_from:
+                conditions.append(f"date({DATE_COLUMN}) >= ?")
+                params.append(date_from)
+            if date_to:
+                conditions.append(f"date({DATE_COLUMN}) <= ?")
+                params.append(date_to)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        plan.append((table, columns, where, params))
+    return plan
+
+
+def _row_digests(rows):
+    """(rowid, resumen de la fila) para cada fila de rows"""
+    for row in rows:
+        row = tuple(row)
+        yield row[0], hashlib.blake2b(repr(row[1:]).encode(), digest_size=16).digest()
+
+
+def diff_database(backup_conn, job, tables=None, date_from=None, date_to=None):
+    """Comparar fila a fila las tablas de la copia con las de la base de datos actual
+
+    Se recorren las dos tablas a la vez ordenadas por rowid (sin cargarlas en
+    memoria) comparando el resumen de cada fila. Devuelve una lista de dicts
+    con table y los recuentos added (filas que la restauración añadiría),
+    removed (que eliminaría), changed (que cambiaría) y unchanged.
+    """
+    plan = _plan(backup_conn, tables, date_from, date_to)
+    job.start(len(plan), 0)
+    results = []
+    for table, columns, where, params in plan:
+        job.begin_file(table)
+        query = (f"SELECT rowid, {', '.join(_quote(column) for column in columns)} "
+                 f"FROM {_quote(table)}{where} ORDER BY rowid")
+        backup_rows = _row_digests(backup_conn.execute(query, params))
+        live_iter = database.fetch_iter(query, params)
+        live_rows = _row_digests(live_iter)
+
+        counts = {"table": table, "added": 0, "removed": 0, "changed": 0, "unchanged": 0}
+        done = object()
+        try:
+            backup_row = next(backup_rows, done)
+            live_row = next(live_rows, done)
+            seen = 0
+            while backup_row is not done or live_row is not done:
+                if live_row is done or (backup_row is not done and backup_row[0] < live_row[0]):
+                    counts["added"] += 1
+                    backup_row = next(backup_rows, done)
+                elif backup_row is done or live_row[0] < backup_row[0]:
+                    counts["removed"] += 1
+                    live_row = next(live_rows, done)
+                else:
+                    counts["changed" if backup_row[1] != live_row[1] else "unchanged"] += 1
+                    backup_row = next(backup_rows, done)
+                    live_row = next(live_rows, done)
+                seen += 1
+                if seen % ROW_BATCH == 0:
+                    job.check()
+        finally:
+            # Cerrar la lectura también al cancelar o fallar, en este mismo hilo
+            live_rows.close()
+            live_iter.close()
+        results.append(counts)
+        job.end_file()
+    return results
+
+
+def _identifier(name):
+    """Nombre de tabla o columna sin comillas, comprobado
+
+    Las escrituras de la restauración usan los nombres tal cual para que
+    database reconozca la tabla (aviso de cambios y caché de consultas).
+    """
+    if not database._IDENTIFIER.match(name):
+        raise ValueError(f"Identificador SQL no válido: {name}")
+    return name
+
+
+def _conflicting_ids(backup_conn, table, where, params, job):
+    """Ids de filas de la copia que ya usa una fila actual que no se va a sustituir
+
+    Se llama después de borrar las filas del intervalo de fechas: cualquier
+    fila actual que quede con uno de esos ids está fuera del intervalo y la
+    restauración la sobrescribiría.
+    """
+    conflicts = []
+    cursor = backup_conn.execute(f"SELECT id FROM {table}{where} ORDER BY id", params)
+    while True:
+        batch = [row[0] for row in cursor.fetchmany(ID_BATCH)]
+        if not batch:
+            break
+        job.check()
+        rows = database.fetch_all(
+            f"SELECT id FROM {table} WHERE id IN ({', '.join('?' for _ in batch)})", batch)
+        conflicts.extend(row[0] for row in rows)
+    return conflicts
+
+
+def restore_tables(backup_conn, job, tables, date_from=None, date_to=None):
+    """Sustituir las filas de las tablas elegidas por las de la copia
+
+    Con un intervalo de fechas solo se sustituyen las filas de ese intervalo;
+    si una fila de la copia tiene el mismo id que una fila actual fuera del
+    intervalo, se lanza ValueError en lugar de sobrescribirla. Todo va en una
+    transacción: si falla o se cancela, no cambia nada. Se ejecuta en el hilo
+    de escritura. Devuelve las filas copiadas por tabla.
+    """
+    plan = _plan(backup_conn, tables, date_from, date_to)
+    job.start(len(plan), 0)
+
+    def rows(cursor):
+        for count, row in enumerate(cursor, start=1):
+            if count % ROW_BATCH == 0:
+                job.check()
+            yield row
+
+    copied = {}
+    with database.transaction():
+        for table, columns, where, params in plan:
+            job.begin_file(table)
+            table = _identifier(table)
+            column_list = ", ".join(_identifier(column) for column in columns)
+            database.execute_query(f"DELETE FROM {table}{where}", params)
+            if where and "id" in columns:
+                conflicts = _conflicting_ids(backup_conn, table, where, params, job)
+                if conflicts:
+                    shown = ", ".join(str(row_id) for row_id in conflicts[:10])
+                    raise ValueError(
+                        f"La tabla {table} tiene {len(conflicts)} filas fuera del intervalo "
+                        f"con el mismo id que filas de la copia ({shown}); no se ha restaurado nada")
+            cursor = backup_conn.execute(f"SELECT {column_list} FROM {table}{where}", params)
+            # Sin OR REPLACE: un conflicto que quede hace fallar la transacción
+            copied[table] = database.execute_many(
+                f"INSERT INTO {table} ({column_list}) "
+                f"VALUES ({', '.join('?' for _ in columns)})", rows(cursor))
+            job.end_file()
+    return copied
@@ -0,0 +1,756 @@
+# -*- coding: utf-8 -*-
+"""
+Almacén de copias de seguridad deduplicado
+Guarda cada copia como un manifiesto que apunta a bloques direccionados por contenido
+
+Los archivos se dividen en bloques de tamaño variable con un hash rodante
+(gear hash): los cortes dependen del contenido, así que insertar o borrar
+datos en un archivo solo cambia los bloques de alrededor. Las bases de datos
+(SQLite o encriptadas) y los formatos ya comprimidos se dividen en bloques
+fijos: SQLite modifica páginas en su sitio sin desplazar el resto, y en un
+formato comprimido un cambio altera todo lo que va detrás, así que el hash
+rodante (lento en Python) no encontraría más coincidencias. Cada bloque se
+guarda una sola vez con su SHA-256 como nombre y cada copia es un manifiesto
+JSON con la lista de bloques de cada archivo (más su tamaño, fecha y
+SHA-256). Una copia incremental solo lista los archivos que han cambiado
+respecto a su base. Los bloques que ya no aparecen en ningún manifiesto se
+eliminan con gc().
+
+Estructura:
+    backup_store/
+    ├── chunks/ab/abcdef...   # bloque (marca de formato + datos)
+    ├── manifests/<id>.json   # una copia por manifiesto (completa o incremental)
+    ├── catalog.db            # índice de copias para listarlas (backup_catalog)
+    └── tmp/                  # escrituras a medias
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import random
+import threading
+import zipfile
+from pathlib import Path
+from modules import zip_packer, backup_catalog
+from modules.encryption import MAGIC, SQLITE_MAGIC
+from datetime import datetime, timedelta
+
+
+STORE_DIR = "backup_store"
+MANIFEST_VERSION = 1
+
+# Copias incrementales seguidas como mucho antes de escribir un manifiesto completo
+MAX_CHAIN = 30
+
+# Tamaños de bloque: mínimo, medio (2^16 = 64 KiB) y máximo
+CHUNK_MIN = 16 * 1024
+CHUNK_AVG_BITS = 16
+CHUNK_MAX = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+
+# Bloques fijos: múltiplo de cualquier tamaño de página de SQLite (512 a 64 KiB)
+CHUNK_FIXED = 64 * 1024
+
+# Bits altos del hash: dependen de los últimos 32 bytes, no solo de los 16 últimos
+_CUT_MASK = ((1 << CHUNK_AVG_BITS) - 1) << (32 - CHUNK_AVG_BITS)
+
+# Tabla del gear hash; semilla fija para que los cortes sean estables entre
+# ejecuciones (si cambiara, los bloques nuevos dejarían de coincidir con los viejos)
+_gear_random = random.Random(0x43445842)
+_GEAR = tuple(_gear_random.getrandbits(32) for _ in range(256))
+del _gear_random
+
+# Formato de cada bloque guardado: marca (1) | datos
+CHUNK_RAW = b"R"
+CHUNK_ZLIB = b"Z"
+COMPRESS_LEVEL = 6
+
+# Retención por tipo de copia: días que se conservan y copias mínimas
+RETENTION = {
+    "auto": {"days": 3, "keep_last": 1},
+}
+
+# Segundos que se conservan los archivos de tmp/ antes de darlos por abandonados
+TMP_MAX_AGE = 3600
+
+# Un solo bloqueo por proceso: gc() no puede borrar un bloque que una copia
+# en curso acaba de dar por existente
+_store_lock = threading.RLock()
+
+
+def chunk_boundaries(data, start=0, final=True):
+    """Posiciones de corte de los bloques de data a partir de start
+
+    Con final=False el resto sin cortar no se devuelve: se espera a tener
+    más datos para decidir dónde acaba.
+    """
+    gear = _GEAR
+    mask = _CUT_MASK
+    size = len(data)
+    cuts = []
+    while start < size:
+        end = min(start + CHUNK_MAX, size)
+        if end - start < CHUNK_MAX and not final:
+            break
+        cut = end
+        h = 0
+        position = start + CHUNK_MIN
+        # Recorrer una copia del tramo es bastante más rápido que indexar data
+        for byte in data[position:end]:
+            position += 1
+            h = ((h << 1) + gear[byte]) & 0xFFFFFFFF
+            if not h & mask:
+                cut = position
+                break
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def uses_fixed_chunks(name, head):
+    """Comprobar si un archivo se divide en bloques fijos en lugar de por contenido
+
+    head son los primeros bytes del archivo.
+    """
+    if head.startswith(SQLITE_MAGIC) or head.startswith(MAGIC):
+        return True
+    return Path(name).suffix.lower() in zip_packer.STORED_EXTENSIONS
+
+
+def iter_fixed_chunks(stream, buffer=b""):
+    """Dividir el contenido de un archivo abierto en bloques de CHUNK_FIXED
+
+    buffer son los bytes ya leídos del principio del archivo.
+    """
+    while True:
+        data = stream.read(READ_SIZE)
+        buffer += data
+        end = len(buffer) if not data else len(buffer) - len(buffer) % CHUNK_FIXED
+        for start in range(0, end, CHUNK_FIXED):
+            yield buffer[start:min(start + CHUNK_FIXED, end)]
+        buffer = buffer[end:]
+        if not data:
+            return
+
+
+def iter_chunks(stream, buffer=b""):
+    """Dividir el contenido de un archivo abierto en bloques por contenido
+
+    buffer son los bytes ya leídos del principio del archivo.
+    """
+    while True:
+        data = stream.read(READ_SIZE)
+        final = not data
+        buffer += data
+        start = 0
+        for cut in chunk_boundaries(buffer, final=final):
+            yield buffer[start:cut]
+            start = cut
+        buffer = buffer[start:]
+        if final:
+            return
+
+
+class _NoJob:
+    """Trabajo vacío para las operaciones sin seguimiento de progreso
+
+    Un trabajo real (backup_jobs.Job) recibe el total, el archivo en curso y
+    los bytes procesados, y su check() lanza una excepción para cancelar.
+    """
+
+    def start(self, files_total, bytes_total):
+        pass
+
+    def begin_file(self, path):
+        pass
+
+    def end_file(self):
+        pass
+
+    def advance(self, size):
+        pass
+
+    def check(self):
+        pass
+
+
+_NO_JOB = _NoJob()
+
+
+def created_at(manifest):
+    """Fecha de creación de un manifiesto"""
+    return datetime.fromisoformat(manifest["created"])
+
+
+class BackupStore:
+    """Repositorio de copias con bloques deduplicados
+
+    Las escrituras son atómicas (archivo temporal y renombrado): un corte a
+    mitad de una copia deja como mucho bloques sin referenciar, que gc()
+    recoge más adelante.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.chunks_dir = self.root / "chunks"
+        self.manifests_dir = self.root / "manifests"
+        self.tmp_dir = self.root / "tmp"
+        for directory in (self.chunks_dir, self.manifests_dir, self.tmp_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.catalog = backup_catalog.BackupCatalog(self.root / backup_catalog.CATALOG_FILE)
+
+    # Bloques
+
+    def _chunk_path(self, digest):
+        return self.chunks_dir / digest[:2] / digest[2:]
+
+    def has_chunk(self, digest):
+        return self._chunk_path(digest).exists()
+
+    def put_chunk(self, data, compress=True):
+        """Guardar un bloque si no existe; devuelve (hash, bytes escritos)
+
+        Con compress=False (formatos ya comprimidos) ni se intenta comprimir.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if path.exists():
+            return digest, 0
+
+        payload = CHUNK_RAW + data
+        if compress:
+            packed = zlib.compress(data, COMPRESS_LEVEL)
+            # Si no se gana nada se guarda tal cual
+            if len(packed) < len(data):
+                payload = CHUNK_ZLIB + packed
+
+        path.parent.mkdir(exist_ok=True)
+        temp_path = self.tmp_dir / f"{digest}.{threading.get_ident()}"
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, path)
+        return digest, len(payload)
+
+    def get_chunk(self, digest):
+        """Leer un bloque comprobando su hash"""
+        with open(self._chunk_path(digest), 'rb') as f:
+            payload = f.read()
+        kind, body = payload[:1], payload[1:]
+        if kind == CHUNK_ZLIB:
+            data = zlib.decompress(body)
+        elif kind == CHUNK_RAW:
+            data = body
+        else:
+            raise ValueError(f"Bloque {digest} con formato desconocido")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Bloque {digest} dañado")
+        return data
+
+    # Archivos
+
+    def iter_file(self, entry):
+        """Contenido de un archivo de un manifiesto, bloque a bloque"""
+        for digest in entry["chunks"]:
+            yield self.get_chunk(digest)
+
+    def restore_file(self, entry, target_path, job=_NO_JOB):
+        """Reconstruir un archivo de un manifiesto en target_path"""
+        commit_staged([self.stage_file(entry, target_path, job)])
+
+    def stage_file(self, entry, target_path, job=_NO_JOB):
+        """Escribir un archivo de un manifiesto junto a target_path sin sustituirlo
+
+        Devuelve (temporal, destino, mtime) para commit_staged().
+        """
+        target_path = Path(target_path)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = target_path.with_name(target_path.name + ".restore")
+        job.begin_file(entry["path"])
+        try:
+            with open(temp_path, 'wb') as f:
+                for data in self.iter_file(entry):
+                    f.write(data)
+                    job.advance(len(data))
+        except BaseException:
+            discard_staged([(temp_path, target_path, None)])
+            raise
+        job.end_file()
+        return temp_path, target_path, entry.get("mtime")
+
+    # Copias
+
+    def _manifest_path(self, backup_id):
+        return self.manifests_dir / f"{backup_id}.json"
+
+    def _new_id(self, name):
+        backup_id = name
+        counter = 1
+        while self._manifest_path(backup_id).exists():
+            backup_id = f"{name}_{counter}"
+            counter += 1
+        return backup_id
+
+    def _write_manifest(self, manifest):
+        path = self._manifest_path(manifest["id"])
+        temp_path = self.tmp_dir / path.name
+        temp_path.write_text(json.dumps(manifest, ensure_ascii=False), encoding='utf-8')
+        os.replace(temp_path, path)
+
+    def create_backup(self, name, files, kind="manual", meta=None, base=None, job=_NO_JOB):
+        """Crear una copia a partir de una lista de (nombre en la copia, ruta)
+
+        Con base (id de otra copia) la copia es incremental: los archivos con
+        el mismo tamaño y fecha de modificación que en la base ni siquiera se
+        leen, y el manifiesto guarda solo los nuevos o modificados, los
+        borrados y el id de la base. Cada MAX_CHAIN copias se escribe un
+        manifiesto completo (sin volver a leer nada) para que la cadena no
+        crezca sin límite.
+
+        Devuelve el manifiesto; manifest["stored"] son los bytes que la copia
+        ha añadido realmente al almacén y manifest["read"] los que ha leído.
+        Si el trabajo se cancela o falla, se eliminan los bloques nuevos.
+        """
+        with _store_lock:
+            base_files = {}
+            full = True
+            if base is not None:
+                chain = self.get_chain(base)
+                base_files = self._compose(chain)[0]
+                full = len(chain) >= MAX_CHAIN
+
+            entries = []
+            paths = set()
+            pending = []
+            for arcname, path in files:
+                path = Path(path)
+                stat = path.stat()
+                paths.add(arcname)
+                previous = base_files.get(arcname)
+                if (previous is not None and previous["size"] == stat.st_size
+                        and previous.get("mtime_ns") == stat.st_mtime_ns):
+                    if full:
+                        entries.append(previous)
+                    continue
+                pending.append((arcname, path, stat))
+
+            job.start(len(pending), sum(stat.st_size for _, _, stat in pending))
+            stored = 0
+            read = 0
+            new_chunks = []
+            try:
+                for arcname, path, stat in pending:
+                    with open(path, 'rb') as f:
+                        entry, written = self._put_file(f, arcname, job, new_chunks)
+                    entry["mtime"] = stat.st_mtime
+                    entry["mtime_ns"] = stat.st_mtime_ns
+                    entries.append(entry)
+                    stored += written
+                    read += entry["size"]
+            except BaseException:
+                self._discard_chunks(new_chunks)
+                raise
+
+            total = sum(entry["size"] for entry in entries)
+            deleted = []
+            if not full:
+                changed = {entry["path"] for entry in entries}
+                total += sum(entry["size"] for path, entry in base_files.items()
+                             if path in paths and path not in changed)
+                deleted = sorted(path for path in base_files if path not in paths)
+            return self._save_backup(name, entries, stored, kind, meta, total=total,
+                                     read=read, base=None if full else base,
+                                     deleted=deleted)
+
+    def _put_file(self, stream, arcname, job, new_chunks):
+        """Guardar un archivo calculando también su SHA-256 completo
+
+        Los bloques que no existían se anotan en new_chunks para poder
+        deshacer una copia cancelada o fallida.
+        """
+        job.begin_file(arcname)
+        file_hash = hashlib.sha256()
+        chunks = []
+        size = 0
+        stored = 0
+        head = stream.read(READ_SIZE)
+        # Misma decisión que al exportar: extensión y prueba del principio del archivo
+        compress = zip_packer.choose_compression(arcname, head) == zipfile.ZIP_DEFLATED
+        chunker = iter_fixed_chunks if uses_fixed_chunks(arcname, head) else iter_chunks
+        for data in chunker(stream, head):
+            file_hash.update(data)
+            digest, written = self.put_chunk(data, compress)
+            chunks.append(digest)
+            if written:
+                new_chunks.append(digest)
+            size += len(data)
+            stored += written
+            job.advance(len(data))
+        job.end_file()
+        entry = {"path": arcname, "size": size, "hash": file_hash.hexdigest(),
+                 "chunks": chunks}
+        return entry, stored
+
+    def _discard_chunks(self, digests):
+        """Eliminar los bloques nuevos de una copia que no ha llegado a guardarse"""
+        for digest in digests:
+            try:
+                self._chunk_path(digest).unlink()
+            except OSError:
+                pass
+
+    def import_zip(self, zip_path, name, kind="imported", meta=None, job=_NO_JOB):
+        """Importar un archivo .cordiax.zip como una copia del almacén"""
+        with _store_lock:
+            entries = []
+            stored = 0
+            new_chunks = []
+            try:
+                with zipfile.ZipFile(str(zip_path), 'r') as zipf:
+                    members = [info for info in zipf.infolist() if not info.is_dir()]
+                    job.start(len(members), sum(info.file_size for info in members))
+                    for info in members:
+                        with zipf.open(info) as member:
+                            entry, written = self._put_file(member, info.filename,
+                                                            job, new_chunks)
+                        entry["mtime"] = datetime(*info.date_time).timestamp()
+                        entries.append(entry)
+                        stored += written
+            except BaseException:
+                self._discard_chunks(new_chunks)
+                raise
+            return self._save_backup(name, entries, stored, kind, meta,
+                                     read=sum(entry["size"] for entry in entries))
+
+    def _save_backup(self, name, entries, stored, kind, meta, total=None, read=0,
+                     base=None, deleted=()):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "id": self._new_id(name),
+            "kind": kind,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "size": sum(entry["size"] for entry in entries) if total is None else total,
+            "stored": stored,
+            "read": read,
+            "base": base,
+            "files": entries,
+            "deleted": list(deleted),
+            "meta": meta or {},
+        }
+        self._write_manifest(manifest)
+        self.index_backup(manifest)
+        return manifest
+
+    def get_chain(self, backup_id):
+        """Manifiestos de una copia y sus bases, de la más antigua a ella"""
+        chain = []
+        current = backup_id
+        while current is not None:
+            if any(manifest["id"] == current for manifest in chain):
+                raise ValueError(f"Cadena de copias circular en {backup_id}")
+            manifest = self.get_backup(current)
+            chain.append(manifest)
+            current = manifest.get("base")
+        return chain[::-1]
+
+    @staticmethod
+    def _compose(chain):
+        """Aplicar en orden las capas de una cadena: (archivos por ruta, borrados)"""
+        files = {}
+        deleted = set()
+        for manifest in chain:
+            for path in manifest.get("deleted", ()):
+                files.pop(path, None)
+                deleted.add(path)
+            for entry in manifest["files"]:
+                files[entry["path"]] = entry
+                deleted.discard(entry["path"])
+        return files, deleted
+
+    def resolve_files(self, backup_id):
+        """Lista completa de archivos de una copia siguiendo la cadena de bases"""
+        return list(self._compose(self.get_chain(backup_id))[0].values())
+
+    def get_backup(self, backup_id):
+        """Leer el manifiesto de una copia"""
+        return json.loads(self._manifest_path(backup_id).read_text(encoding='utf-8'))
+
+    def list_backups(self, kind=None):
+        """Manifiestos de las copias, de la más reciente a la más antigua"""
+        manifests = []
+        for path in self.manifests_dir.glob("*.json"):
+            try:
+                manifest = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                print(f"Error al leer manifiesto {path.name}: {e}")
+                continue
+            if kind is None or manifest.get("kind") == kind:
+                manifests.append(manifest)
+        manifests.sort(key=lambda m: (m["created"], m["id"]), reverse=True)
+        return manifests
+
+    def delete_backup(self, backup_id):
+        """Eliminar una copia; sus bloques se liberan en el siguiente gc()
+
+        Las copias incrementales que la usaban como base absorben su capa y
+        pasan a apuntar a la base de ella: solo se reescriben manifiestos. Las
+        dependientes se buscan en los propios manifiestos, no en el catálogo,
+        que puede no estar al día; si alguno no se puede leer no se borra
+        nada, porque podría depender de esta copia.
+        """
+        with _store_lock:
+            try:
+                manifest = self.get_backup(backup_id)
+            except ValueError:
+                # Manifiesto dañado: no hay capa que pasar a las dependientes
+                manifest = None
+            dependents = []
+            for path in self.manifests_dir.glob("*.json"):
+                if path.stem == backup_id:
+                    continue
+                try:
+                    other = json.loads(path.read_text(encoding='utf-8'))
+                except (OSError, ValueError) as e:
+                    raise ValueError(f"No se puede eliminar {backup_id}: el manifiesto "
+                                     f"{path.name} no se puede leer ({e})")
+                if other.get("base") == backup_id:
+                    dependents.append(other)
+            if manifest is None and dependents:
+                raise ValueError(f"No se puede eliminar {backup_id}: su manifiesto está "
+                                 f"dañado y otras copias dependen de ella")
+            for dependent in dependents:
+                files, deleted = self._compose([manifest, dependent])
+                dependent["files"] = list(files.values())
+                dependent["deleted"] = sorted(deleted)
+                dependent["base"] = manifest.get("base")
+                self._write_manifest(dependent)
+                self.index_backup(dependent)
+            self._manifest_path(backup_id).unlink()
+            self.catalog.remove(backup_id)
+
+    def restore_backup(self, backup_id, target_dir, rename=None, job=_NO_JOB,
+                       before_commit=None):
+        """Reconstruir todos los archivos de una copia bajo target_dir
+
+        rename permite llevar un archivo a otra ruta (p. ej. la base de datos).
+        Primero se escriben todos los archivos junto a su destino y solo al
+        final se sustituyen (tras llamar a before_commit), así que cancelar
+        no deja una restauración a medias.
+        """
+        target_dir = Path(target_dir).resolve()
+        entries = self.resolve_files(backup_id)
+        targets = []
+        for entry in entries:
+            target_path = (target_dir / entry["path"]).resolve()
+            if rename and entry["path"] in rename:
+                target_path = Path(rename[entry["path"]])
+            elif target_dir not in target_path.parents:
+                # Igual que zipfile: nada de escribir fuera del directorio
+                raise ValueError(f"Ruta no válida en la copia: {entry['path']}")
+            targets.append((entry, target_path))
+
+        job.start(len(entries), sum(entry["size"] for entry in entries))
+        staged = []
+        try:
+            for entry, target_path in targets:
+                staged.append(self.stage_file(entry, target_path, job))
+            job.check()
+        except BaseException:
+            discard_staged(staged)
+            raise
+        try:
+            if before_commit:
+                before_commit()
+        except BaseException:
+            discard_staged(staged)
+            raise
+        commit_staged(staged)
+
+    def export_zip(self, backup_id, zip_path, job=_NO_JOB):
+        """Exportar una copia como un archivo .cordiax.zip normal
+
+        Si el trabajo se cancela o falla, se elimina el archivo a medias.
+        """
+        entries = self.resolve_files(backup_id)
+        job.start(len(entries), sum(entry["size"] for entry in entries))
+        try:
+            with zip_packer.ZipPacker(zip_path) as packer:
+                for entry in entries:
+                    job.begin_file(entry["path"])
+                    packer.add(entry["path"], self.iter_file(entry), entry["size"],
+                               entry["mtime"], progress=job.advance)
+                    job.end_file()
+        except BaseException:
+            Path(zip_path).unlink(missing_ok=True)
+            raise
+
+    # Catálogo
+
+    def index_backup(self, manifest):
+        """Anotar una copia en el catálogo con sus datos de resumen"""
+        path = self._manifest_path(manifest["id"])
+        stat = path.stat()
+        files = self.resolve_files(manifest["id"])
+        encrypted = None
+        for entry in files:
+            if entry["path"] == "cordiax.db" and entry["chunks"]:
+                header = self.get_chunk(entry["chunks"][0])[:len(SQLITE_MAGIC)]
+                encrypted = header != SQLITE_MAGIC
+        self.catalog.record({
+            "id": manifest["id"],
+            "source": backup_catalog.SOURCE_STORE,
+            "kind": manifest["kind"],
+            "created": manifest["created"],
+            "size": manifest["size"],
+            "stored": manifest["stored"],
+            "files": len(files),
+            "documents": sum(1 for entry in files if entry["path"].startswith("documentos/")),
+            "tables": manifest["meta"].get("tables"),
+            "hash": self.manifest_hash(manifest["id"]),
+            "encrypted": encrypted,
+            "base": manifest.get("base"),
+            "file_size": stat.st_size,
+            "file_mtime_ns": stat.st_mtime_ns,
+        })
+
+    def manifest_hash(self, backup_id):
+        """SHA-256 del manifiesto tal como está guardado"""
+        return hashlib.sha256(self._manifest_path(backup_id).read_bytes()).hexdigest()
+
+    def latest_backup(self, kind):
+        """Manifiesto de la copia más reciente de un tipo (según el catálogo) o None"""
+        for entry in self.catalog.list(backup_catalog.SOURCE_STORE, kind):
+            if entry["status"] == backup_catalog.STATUS_OK:
+                return self.get_backup(entry["id"])
+        return None
+
+    def sync_catalog(self, backup_dir=None):
+        """Poner el catálogo al día con los manifiestos (y los .cordiax.zip de backup_dir)
+
+        Solo se leen los manifiestos nuevos o modificados; uno que no se
+        puede leer queda marcado como dañado.
+        """
+        known = {entry["id"]: entry for entry in self.catalog.list(backup_catalog.SOURCE_STORE)}
+        seen = set()
+        for path in self.manifests_dir.glob("*.json"):
+            backup_id = path.stem
+            seen.add(backup_id)
+            stat = path.stat()
+            entry = known.get(backup_id)
+            if (entry is not None and entry["file_size"] == stat.st_size
+                    and entry["file_mtime_ns"] == stat.st_mtime_ns):
+                continue
+            try:
+                self.index_backup(self.get_backup(backup_id))
+            except Exception as e:
+                print(f"Error al indexar copia {backup_id}: {e}")
+                self.catalog.record({
+                    "id": backup_id,
+                    "source": backup_catalog.SOURCE_STORE,
+                    "created": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+                    "status": backup_catalog.STATUS_CORRUPT,
+                    "detail": f"Manifiesto ilegible: {e}",
+                    "file_size": stat.st_size,
+                    "file_mtime_ns": stat.st_mtime_ns,
+                })
+        for backup_id in known:
+            if backup_id not in seen:
+                self.catalog.remove(backup_id)
+        if backup_dir is not None:
+            self.catalog.sync_zips(backup_dir)
+
+    # Retención y limpieza
+
+    def prune(self, kind, days=None, keep_last=0):
+        """Eliminar las copias de un tipo más antiguas que days (dejando keep_last)"""
+        if days is None:
+            return []
+        cutoff = datetime.now() - timedelta(days=days)
+        removed = []
+        with _store_lock:
+            for manifest in self.list_backups(kind)[keep_last:]:
+                if created_at(manifest) < cutoff:
+                    try:
+                        self.delete_backup(manifest["id"])
+                    except ValueError as e:
+                        print(f"Error al eliminar copia {manifest['id']}: {e}")
+                        continue
+                    removed.append(manifest["id"])
+        return removed
+
+    def apply_retention(self, policy=None):
+        """Aplicar la política de retención y liberar los bloques sin uso"""
+        for kind, rule in (policy or RETENTION).items():
+            self.prune(kind, rule.get("days"), rule.get("keep_last", 0))
+        return self.gc()
+
+    def gc(self):
+        """Eliminar los bloques que no usa ningún manifiesto
+
+        Devuelve (bloques eliminados, bytes liberados).
+        """
+        with _store_lock:
+            referenced = set()
+            for manifest in self.list_backups():
+                for entry in manifest["files"]:
+                    referenced.update(entry["chunks"])
+
+            removed = 0
+            freed = 0
+            for path in self.chunks_dir.glob("*/*"):
+                if path.parent.name + path.name in referenced:
+                    continue
+                try:
+                    freed += path.stat().st_size
+                    path.unlink()
+                    removed += 1
+                except OSError as e:
+                    print(f"Error al eliminar bloque {path.name}: {e}")
+
+            # Restos de escrituras interrumpidas (los recientes pueden ser de
+            # una copia que todavía no ha empezado a trocear)
+            cutoff = datetime.now().timestamp() - TMP_MAX_AGE
+            for path in self.tmp_dir.iterdir():
+                try:
+                    if path.stat().st_mtime < cutoff:
+                        path.unlink()
+                except OSError:
+                    pass
+        return removed, freed
+
+    def stats(self):
+        """Tamaño lógico de todas las copias y espacio ocupado realmente"""
+        chunks = 0
+        disk = 0
+        for path in self.chunks_dir.glob("*/*"):
+            chunks += 1
+            disk += path.stat().st_size
+        backups = self.list_backups()
+        return {
+            "backups": len(backups),
+            "logical": sum(m["size"] for m in backups),
+            "chunks": chunks,
+            "disk": disk,
+        }
+
+
+def commit_staged(staged):
+    """Sustituir los destinos por los archivos preparados con stage_file()"""
+    for temp_path, target_path, mtime in staged:
+        os.replace(temp_path, target_path)
+        if mtime:
+            os.utime(target_path, (mtime, mtime))
+
+
+def discard_staged(staged):
+    """Eliminar los archivos preparados que no se van a usar"""
+    for temp_path, _, _ in staged:
+        try:
+            Path(temp_path).unlink()
+        except OSError:
+            pass
+
+
+def open_store(data_dir):
+    """Abrir (o crear) el almacén de copias de un directorio de datos"""
+    return BackupStore(Path(data_dir) / STORE_DIR)
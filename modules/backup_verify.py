@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Verificación de copias de seguridad
+Comprueba que cada copia se puede leer entera antes de necesitar restaurarla
+
+De cada .cordiax.zip se leen todos los miembros (zipfile comprueba el CRC
+de cada uno al llegar al final) y de cada copia del almacén todos sus
+bloques, comparando el SHA-256 de cada archivo con el del manifiesto. La
+cordiax.db incluida se abre con PRAGMA integrity_check; si está encriptada,
+se desencripta en memoria, lo que comprueba la etiqueta de autenticación de
+cada bloque, y se revisa igual. Sin la clave solo se comprueban CRC y hashes.
+
+Las copias se verifican en paralelo en un grupo de procesos (leer, descomprimir
+y calcular hashes en Python no libera el GIL) y cada resultado se anota en el
+catálogo en cuanto llega. Este módulo no importa tkinter ni database: los
+procesos del grupo lo importan por separado.
+"""
+
+import os
+import hashlib
+import sqlite3
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from modules import encryption, backup_store, backup_catalog
+
+
+VERIFY_WORKERS = min(4, os.cpu_count() or 1)
+READ_BLOCK_SIZE = 1024 * 1024
+# Cada cuánto (segundos) se atiende una cancelación mientras se espera
+POLL_INTERVAL = 0.2
+
+
+def check_database(db_path, secret=None):
+    """Comprobar la base de datos de una copia
+
+    Devuelve un texto con lo comprobado o lanza ValueError si está dañada.
+    """
+    if not encryption.is_encrypted(db_path):
+        # immutable: no se crea diario ni se toca el archivo
+        conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?immutable=1", uri=True)
+        label = "base de datos correcta"
+    else:
+        if secret is None:
+            return "base de datos encriptada sin comprobar (no hay clave)"
+        header = encryption.read_header(db_path)
+        if (isinstance(secret, encryption.SessionKey)
+                and not secret.matches(header.salt, header.iterations)):
+            return "base de datos encriptada con otra clave, sin comprobar"
+        try:
+            data = encryption.decrypt_bytes(db_path, secret)
+        except Exception as e:
+            raise ValueError(f"La base de datos encriptada no se autentica: "
+                             f"{str(e) or type(e).__name__}")
+        # Los datos en claro no se escriben a disco. Una imagen en modo WAL
+        # no se abre en memoria: se marca como de diario normal (bytes 18-19)
+        data = bytearray(data)
+        if data[18:20] == b"\x02\x02":
+            data[18:20] = b"\x01\x01"
+        conn = sqlite3.connect(":memory:")
+        conn.deserialize(bytes(data))
+        label = "base de datos encriptada correcta"
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"La base de datos no se puede abrir: {e}")
+    finally:
+        conn.close()
+    if rows != ["ok"]:
+        raise ValueError("integrity_check: " + "; ".join(rows[:3]))
+    return label
+
+
+def _result(status, detail, file_hash=None):
+    return {"status": status, "detail": detail, "hash": file_hash}
+
+
+def verify_zip(zip_path, tmp_dir, secret=None):
+    """Verificar un .cordiax.zip (se ejecuta en un proceso del grupo)"""
+    zip_path = Path(zip_path)
+    db_temp = Path(tmp_dir) / f"verify_{os.getpid()}_{zip_path.name}.db"
+    try:
+        file_hash = hashlib.sha256()
+        with open(zip_path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                file_hash.update(block)
+
+        with zipfile.ZipFile(str(zip_path), 'r') as zipf:
+            members = [info for info in zipf.infolist() if not info.is_dir()]
+            if "cordiax.db" not in zipf.namelist():
+                return _result(backup_catalog.STATUS_CORRUPT, "No contiene cordiax.db",
+                               file_hash.hexdigest())
+            for info in members:
+                out = open(db_temp, 'wb') if info.filename == "cordiax.db" else None
+                try:
+                    with zipf.open(info) as member:
+                        for block in iter(lambda: member.read(READ_BLOCK_SIZE), b""):
+                            if out:
+                                out.write(block)
+                except (zipfile.BadZipFile, OSError, EOFError, ValueError) as e:
+                    return _result(backup_catalog.STATUS_CORRUPT, f"{info.filename}: {e}",
+                                   file_hash.hexdigest())
+                finally:
+                    if out:
+                        out.close()
+
+        checked = check_database(db_temp, secret)
+        return _result(backup_catalog.STATUS_OK,
+                       f"Verificado: {len(members)} archivos con CRC correcto, {checked}",
+                       file_hash.hexdigest())
+    except Exception as e:
+        return _result(backup_catalog.STATUS_CORRUPT, str(e))
+    finally:
+        db_temp.unlink(missing_ok=True)
+
+
+def verify_store_backup(store_root, backup_id, secret=None):
+    """Verificar una copia del almacén (se ejecuta en un proceso del grupo)"""
+    store = backup_store.BackupStore(store_root)
+    db_temp = store.tmp_dir / f"verify_{os.getpid()}_{backup_id}.db"
+    try:
+        manifest_hash = store.manifest_hash(backup_id)
+        files = store.resolve_files(backup_id)
+        if not any(entry["path"] == "cordiax.db" for entry in files):
+            return _result(backup_catalog.STATUS_CORRUPT, "No contiene cordiax.db",
+                           manifest_hash)
+        for entry in files:
+            file_hash = hashlib.sha256()
+            size = 0
+            out = open(db_temp, 'wb') if entry["path"] == "cordiax.db" else None
+            try:
+                for data in store.iter_file(entry):
+                    file_hash.update(data)
+                    size += len(data)
+                    if out:
+                        out.write(data)
+            except Exception as e:
+                # Bloque que falta, que no se descomprime o con otro hash
+                return _result(backup_catalog.STATUS_CORRUPT, f"{entry['path']}: {e}",
+                               manifest_hash)
+            finally:
+                if out:
+                    out.close()
+            if file_hash.hexdigest() != entry["hash"] or size != entry["size"]:
+                return _result(backup_catalog.STATUS_CORRUPT,
+                               f"{entry['path']}: el contenido no coincide con el manifiesto",
+                               manifest_hash)
+
+        checked = check_database(db_temp, secret)
+        return _result(backup_catalog.STATUS_OK,
+                       f"Verificado: {len(files)} archivos con hash correcto, {checked}",
+                       manifest_hash)
+    except Exception as e:
+        return _result(backup_catalog.STATUS_CORRUPT, str(e))
+    finally:
+        db_temp.unlink(missing_ok=True)
+
+
+def verify_backups(job, store, backup_dir, entries, secret=None, workers=VERIFY_WORKERS):
+    """Verificar en paralelo las copias de entries (fichas del catálogo)
+
+    Cada resultado se anota en el catálogo según llega; devuelve un dict
+    id -> resultado. Al cancelar se descartan las copias aún no empezadas.
+    """
+    job.start(len(entries), sum(entry["size"] or 0 for entry in entries))
+    if not entries:
+        return {}
+
+    results = {}
+    pool = ProcessPoolExecutor(max_workers=max(1, min(workers, len(entries))))
+    try:
+        futures = {}
+        for entry in entries:
+            if entry["source"] == backup_catalog.SOURCE_ZIP:
+                future = pool.submit(verify_zip, str(Path(backup_dir) / entry["id"]),
+                                     str(store.tmp_dir), secret)
+            else:
+                future = pool.submit(verify_store_backup, str(store.root), entry["id"], secret)
+            futures[future] = entry
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry = futures[future]
+                job.begin_file(entry["id"])
+                result = future.result()
+                store.catalog.set_verification(entry["id"], result["status"],
+                                               result["detail"], result["hash"])
+                results[entry["id"]] = result
+                job.advance(entry["size"] or 0)
+                job.end_file()
+            job.check()
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+    return results
@@ -6,7 +6,8 @@ Gestión CRUD del menú diario de la cafetería
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from modules import database
+from modules import db_executor
+from modules.virtual_table import VirtualTable
 from datetime import date, timedelta
 import json
 import os
@@ -69,8 +70,8 @@ class CafeteriaModule:
         
         # Treeview
         columns = ("ID", "Fecha", "Tipo", "Plato", "Descripción", "Alérgenos")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -88,28 +89,33 @@ class CafeteriaModule:
         
     def load_menus(self):
         """Cargar menús del rango de fechas"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        # Solo se pinta el resultado de la última carga solicitada
+        self._load_request = getattr(self, "_load_request", 0) + 1
+        request = self._load_request
+        
+        def show(menus):
+            if request != self._load_request:
+                return
+            # Actualizar la tabla con solo las diferencias
+            db_executor.reconcile(self.tree, [
+                (menu['id'], (
+                    menu['id'],
+                    menu['fecha'],
+                    menu['tipo_comida'],
+                    menu['plato'],
+                    menu['descripcion'] or "",
+                    menu['alergenos'] or ""
+                ), ())
+                for menu in menus
+            ])
         
         # Obtener menús
-        menus = database.fetch_all("""
+        db_executor.deliver(self.tree, db_executor.fetch_all("""
             SELECT id, fecha, tipo_comida, plato, descripcion, alergenos
             FROM menu_cafeteria
             WHERE fecha BETWEEN ? AND ?
             ORDER BY fecha, tipo_comida
-        """, (self.date_from_var.get(), self.date_to_var.get()))
-        
-        # Agregar a tabla
-        for menu in menus:
-            self.tree.insert("", tk.END, values=(
-                menu['id'],
-                menu['fecha'],
-                menu['tipo_comida'],
-                menu['plato'],
-                menu['descripcion'] or "",
-                menu['alergenos'] or ""
-            ))
+        """, (self.date_from_var.get(), self.date_to_var.get())), show)
     
     def new_menu(self):
         """Crear nuevo menú"""
@@ -138,9 +144,15 @@ class CafeteriaModule:
         menu_id = item['values'][0]
         
         if messagebox.askyesno("Confirmar", "¿Está seguro de eliminar este plato?"):
-            database.execute_query("DELETE FROM menu_cafeteria WHERE id = ?", (menu_id,))
-            self.load_menus()
-            messagebox.showinfo("Éxito", "Plato eliminado correctamente")
+            def deleted(_):
+                self.load_menus()
+                messagebox.showinfo("Éxito", "Plato eliminado correctamente")
+            
+            db_executor.deliver(
+                self.tree,
+                db_executor.execute_query("DELETE FROM menu_cafeteria WHERE id = ?", (menu_id,)),
+                deleted,
+                lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
     
     def import_from_json(self):
         """Importar menús desde archivo JSON"""
@@ -163,8 +175,8 @@ class CafeteriaModule:
                 messagebox.showerror("Error", "El archivo JSON debe contener una lista de menús")
                 return
             
-            # Importar cada menú
-            imported_count = 0
+            # Validar cada menú
+            rows = []
             for menu_data in menus:
                 # Validar campos requeridos
                 if not all(key in menu_data for key in ['menu', 'platos', 'fecha']):
@@ -172,28 +184,36 @@ class CafeteriaModule:
                         f"Menú omitido: faltan campos requeridos (menu, platos, fecha)")
                     continue
                 
-                # Insertar en la base de datos
-                database.execute_query("""
-                    INSERT INTO menu_cafeteria 
-                    (fecha, tipo_comida, plato, alergenos)
-                    VALUES (?, ?, ?, ?)
-                """, (
+                rows.append((
                     menu_data['fecha'],
                     menu_data['menu'],
                     menu_data['platos'],
                     menu_data.get('alergenos', None)
                 ))
-                imported_count += 1
-            
-            # Actualizar vista
-            self.load_menus()
-            messagebox.showinfo("Éxito", 
-                f"{imported_count} menú(s) importado(s) correctamente")
             
         except json.JSONDecodeError:
             messagebox.showerror("Error", "El archivo no es un JSON válido")
+            return
         except Exception as e:
             messagebox.showerror("Error", f"Error al importar: {str(e)}")
+            return
+        
+        def imported(imported_count):
+            # Actualizar vista
+            self.load_menus()
+            messagebox.showinfo("Éxito", 
+                f"{imported_count} menú(s) importado(s) correctamente")
+        
+        # Insertar todos los menús en una sola transacción
+        db_executor.deliver(
+            self.tree,
+            db_executor.bulk_insert(
+                "menu_cafeteria",
+                ["fecha", "tipo_comida", "plato", "alergenos"],
+                rows
+            ),
+            imported,
+            lambda e: messagebox.showerror("Error", f"Error al importar: {str(e)}"))
 
 
 class MenuDialog:
@@ -278,10 +298,12 @@ class MenuDialog:
     
     def load_menu_data(self):
         """Cargar datos del menú"""
-        menu = database.fetch_one(
+        db_executor.deliver(self.dialog, db_executor.fetch_one(
             "SELECT * FROM menu_cafeteria WHERE id = ?", (self.menu_id,)
-        )
-        
+        ), self.show_menu_data)
+    
+    def show_menu_data(self, menu):
+        """Mostrar los datos del menú en el formulario"""
         if menu:
             self.fecha_var.set(menu['fecha'])
             self.tipo_var.set(menu['tipo_comida'])
@@ -295,29 +317,30 @@ class MenuDialog:
             messagebox.showerror("Error", "Tipo de comida y plato son obligatorios")
             return
         
-        try:
-            if self.menu_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE menu_cafeteria 
-                    SET fecha=?, tipo_comida=?, plato=?, descripcion=?, alergenos=?
-                    WHERE id=?
-                """, (self.fecha_var.get(), self.tipo_var.get(), self.plato_var.get(),
-                     self.descripcion_text.get("1.0", tk.END).strip() or None,
-                     self.alergenos_var.get() or None, self.menu_id))
-            else:
-                # Crear nuevo
-                database.execute_query("""
-                    INSERT INTO menu_cafeteria 
-                    (fecha, tipo_comida, plato, descripcion, alergenos)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (self.fecha_var.get(), self.tipo_var.get(), self.plato_var.get(),
-                     self.descripcion_text.get("1.0", tk.END).strip() or None,
-                     self.alergenos_var.get() or None))
-            
-            messagebox.showinfo("Éxito", "Menú guardado correctamente")
-            self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        if self.menu_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE menu_cafeteria 
+                SET fecha=?, tipo_comida=?, plato=?, descripcion=?, alergenos=?
+                WHERE id=?
+            """, (self.fecha_var.get(), self.tipo_var.get(), self.plato_var.get(),
+                 self.descripcion_text.get("1.0", tk.END).strip() or None,
+                 self.alergenos_var.get() or None, self.menu_id))
+        else:
+            # Crear nuevo
+            future = db_executor.execute_query("""
+                INSERT INTO menu_cafeteria 
+                (fecha, tipo_comida, plato, descripcion, alergenos)
+                VALUES (?, ?, ?, ?, ?)
+            """, (self.fecha_var.get(), self.tipo_var.get(), self.plato_var.get(),
+                 self.descripcion_text.get("1.0", tk.END).strip() or None,
+                 self.alergenos_var.get() or None))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardado el menú"""
+        messagebox.showinfo("Éxito", "Menú guardado correctamente")
+        self.callback()
+        self.dialog.destroy()
@@ -6,7 +6,8 @@ Gestión CRUD de centros escolares
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from modules import database
+from modules import db_executor
+from modules.virtual_table import VirtualTable
 import os
 import sys
 
@@ -49,8 +50,8 @@ class CentrosModule:
         
         # Treeview
         columns = ("ID", "Nombre", "Dirección", "Teléfono", "Email")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -70,24 +71,23 @@ class CentrosModule:
         
     def load_centros(self):
         """Cargar centros desde la base de datos"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        def show(centros):
+            # Actualizar la tabla con solo las diferencias
+            db_executor.reconcile(self.tree, [
+                (centro['id'], (
+                    centro['id'],
+                    centro['nombre'],
+                    centro['direccion'] or "",
+                    centro['telefono'] or "",
+                    centro['email'] or ""
+                ), ())
+                for centro in centros
+            ])
         
         # Obtener centros
-        centros = database.fetch_all(
+        db_executor.deliver(self.tree, db_executor.fetch_all(
             "SELECT id, nombre, direccion, telefono, email FROM centros ORDER BY nombre"
-        )
-        
-        # Agregar a tabla
-        for centro in centros:
-            self.tree.insert("", tk.END, values=(
-                centro['id'],
-                centro['nombre'],
-                centro['direccion'] or "",
-                centro['telefono'] or "",
-                centro['email'] or ""
-            ))
+        ), show)
     
     def new_centro(self):
         """Crear nuevo centro"""
@@ -116,25 +116,35 @@ class CentrosModule:
         centro_id = item['values'][0]
         centro_name = item['values'][1]
         
-        # Verificar si hay aulas asociadas
-        aulas = database.fetch_all("SELECT COUNT(*) as count FROM aulas WHERE centro_id = ?", (centro_id,))
-        if aulas and aulas[0]['count'] > 0:
-            messagebox.showwarning("Advertencia", 
-                                 f"No se puede eliminar el centro '{centro_name}' porque tiene aulas asociadas.")
-            return
-        
-        # Verificar si hay estudiantes asociados
-        estudiantes = database.fetch_all("SELECT COUNT(*) as count FROM estudiantes WHERE centro_id = ?", (centro_id,))
-        if estudiantes and estudiantes[0]['count'] > 0:
-            messagebox.showwarning("Advertencia", 
-                                 f"No se puede eliminar el centro '{centro_name}' porque tiene estudiantes asociados.")
-            return
-        
-        if messagebox.askyesno("Confirmar", 
-                              f"¿Está seguro de eliminar el centro '{centro_name}'?"):
-            database.execute_query("DELETE FROM centros WHERE id = ?", (centro_id,))
+        def deleted(_):
             self.load_centros()
             messagebox.showinfo("Éxito", "Centro eliminado correctamente")
+        
+        def check(counts):
+            # Verificar si hay aulas asociadas
+            if counts['aulas'] > 0:
+                messagebox.showwarning("Advertencia", 
+                                     f"No se puede eliminar el centro '{centro_name}' porque tiene aulas asociadas.")
+                return
+            
+            # Verificar si hay estudiantes asociados
+            if counts['estudiantes'] > 0:
+                messagebox.showwarning("Advertencia", 
+                                     f"No se puede eliminar el centro '{centro_name}' porque tiene estudiantes asociados.")
+                return
+            
+            if messagebox.askyesno("Confirmar", 
+                                  f"¿Está seguro de eliminar el centro '{centro_name}'?"):
+                db_executor.deliver(
+                    self.tree,
+                    db_executor.execute_query("DELETE FROM centros WHERE id = ?", (centro_id,)),
+                    deleted,
+                    lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
+        
+        db_executor.deliver(self.tree, db_executor.fetch_one("""
+            SELECT (SELECT COUNT(*) FROM aulas WHERE centro_id = ?) as aulas,
+                   (SELECT COUNT(*) FROM estudiantes WHERE centro_id = ?) as estudiantes
+        """, (centro_id, centro_id)), check)
 
 
 class CentroDialog:
@@ -219,10 +229,12 @@ class CentroDialog:
     
     def load_centro_data(self):
         """Cargar datos del centro"""
-        centro = database.fetch_one(
+        db_executor.deliver(self.dialog, db_executor.fetch_one(
             "SELECT * FROM centros WHERE id = ?", (self.centro_id,)
-        )
-        
+        ), self.show_centro_data)
+    
+    def show_centro_data(self, centro):
+        """Mostrar los datos del centro en el formulario"""
         if centro:
             self.nombre_var.set(centro['nombre'])
             self.direccion_var.set(centro['direccion'] or "")
@@ -246,27 +258,28 @@ class CentroDialog:
             'notas': self.notas_text.get("1.0", tk.END).strip() or None
         }
         
-        try:
-            if self.centro_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE centros 
-                    SET nombre=?, direccion=?, telefono=?, email=?, notas=?
-                    WHERE id=?
-                """, (data['nombre'], data['direccion'], data['telefono'],
-                     data['email'], data['notas'], self.centro_id))
-            else:
-                # Crear nuevo
-                database.execute_query("""
-                    INSERT INTO centros 
-                    (nombre, direccion, telefono, email, notas)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (data['nombre'], data['direccion'], data['telefono'],
-                     data['email'], data['notas']))
-            
-            messagebox.showinfo("Éxito", "Centro guardado correctamente")
-            self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        if self.centro_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE centros 
+                SET nombre=?, direccion=?, telefono=?, email=?, notas=?
+                WHERE id=?
+            """, (data['nombre'], data['direccion'], data['telefono'],
+                 data['email'], data['notas'], self.centro_id))
+        else:
+            # Crear nuevo
+            future = db_executor.execute_query("""
+                INSERT INTO centros 
+                (nombre, direccion, telefono, email, notas)
+                VALUES (?, ?, ?, ?, ?)
+            """, (data['nombre'], data['direccion'], data['telefono'],
+                 data['email'], data['notas']))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardado el centro"""
+        messagebox.showinfo("Éxito", "Centro guardado correctamente")
+        self.callback()
+        self.dialog.destroy()
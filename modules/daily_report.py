@@ -6,7 +6,7 @@ Muestra materiales bajo mínimo y menú del día
 
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
-from modules import database
+from modules import database, db_executor
 from datetime import date
 
 
@@ -68,25 +68,41 @@ class DailyReportModule:
         
     def load_filters(self):
         """Cargar opciones de filtro"""
-        # Cargar centros
-        centros = database.fetch_all("SELECT id, nombre FROM centros ORDER BY nombre")
-        centro_names = ["Todos"] + [c['nombre'] for c in centros]
-        self.centro_filter_combo['values'] = centro_names
         if not self.centro_filter_var.get():
             self.centro_filter_var.set("Todos")
-        
-        # Cargar aulas
-        aulas = database.fetch_all("SELECT id, nombre FROM aulas ORDER BY nombre")
-        aula_names = ["Todas"] + [a['nombre'] for a in aulas]
-        self.aula_filter_combo['values'] = aula_names
         if not self.aula_filter_var.get():
             self.aula_filter_var.set("Todas")
         
+        # Cargar centros
+        def show_centros(centros):
+            self.centro_filter_combo['values'] = ["Todos"] + [c['nombre'] for c in centros]
+        
+        db_executor.deliver(self.centro_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM centros ORDER BY nombre"), show_centros)
+        
+        # Cargar aulas
+        def show_aulas(aulas):
+            self.aula_filter_combo['values'] = ["Todas"] + [a['nombre'] for a in aulas]
+        
+        db_executor.deliver(self.aula_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM aulas ORDER BY nombre"), show_aulas)
+        
     def generate_report(self):
         """Generar informe diario"""
         self.report_text.delete("1.0", tk.END)
         
-        fecha = self.date_var.get()
+        def show(report):
+            self.report_text.delete("1.0", tk.END)
+            self.report_text.insert("1.0", report)
+        
+        # Las consultas se hacen fuera del hilo de Tk
+        db_executor.run_in_background(
+            self.report_text, self._build_report, self.date_var.get(),
+            self.centro_filter_var.get(), self.aula_filter_var.get(), on_success=show,
+            on_error=lambda e: messagebox.showerror("Error", f"Error al generar el informe: {str(e)}"))
+    
+    def _build_report(self, fecha, centro, aula):
+        """Texto del informe diario (fuera del hilo de Tk)"""
         COLS = 70
         HAS_DATA = False
         # Encabezado
@@ -94,10 +110,10 @@ class DailyReportModule:
         report += f"INFORME DIARIO - {fecha}\n"
         
         # Agregar información de filtros
-        if self.centro_filter_var.get() and self.centro_filter_var.get() != "Todos":
-            report += f"Centro: {self.centro_filter_var.get()}\n"
-        if self.aula_filter_var.get() and self.aula_filter_var.get() != "Todas":
-            report += f"Aula: {self.aula_filter_var.get()}\n"
+        if centro and centro != "Todos":
+            report += f"Centro: {centro}\n"
+        if aula and aula != "Todas":
+            report += f"Aula: {aula}\n"
         
         report += "=" * COLS + "\n"
         
@@ -161,14 +177,14 @@ class DailyReportModule:
         params = [fecha]
         
         # Filtro por centro
-        if self.centro_filter_var.get() and self.centro_filter_var.get() != "Todos":
+        if centro and centro != "Todos":
             query += " AND c.nombre = ?"
-            params.append(self.centro_filter_var.get())
+            params.append(centro)
         
         # Filtro por aula
-        if self.aula_filter_var.get() and self.aula_filter_var.get() != "Todas":
+        if aula and aula != "Todas":
             query += " AND au.nombre = ?"
-            params.append(self.aula_filter_var.get())
+            params.append(aula)
         
         query += " GROUP BY a.estado"
         
@@ -191,7 +207,7 @@ class DailyReportModule:
         report += "Fin del informe\n"
         report += "=" * COLS + "\n"
         
-        self.report_text.insert("1.0", report)
+        return report
     
     def print_report(self):
         """Imprimir informe (copiar al portapapeles)"""
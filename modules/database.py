@@ -6,14 +6,106 @@ Maneja la conexión SQLite y las operaciones de base de datos
 
 import sqlite3
 import os
+import json
+import struct
 import shutil
+import threading
+import atexit
+import time
+import re
+import sys
+import logging
+from logging.handlers import RotatingFileHandler
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime, timedelta
-from modules import encryption
+from modules import encryption, backup_store
 
 USER_DATA_DIR = None
 DB_PATH = None
 DB_PASSWORD = None
+DB_KEY = None
+
+# Tiempo máximo de espera (segundos) cuando otra conexión tiene el bloqueo
+BUSY_TIMEOUT = 5.0
+
+# Perfil de rendimiento aplicado a cada conexión nueva. Con WAL los informes
+# pueden seguir leyendo mientras otra conexión escribe. journal_mode y
+# mmap_size solo se aplican a la base de datos en disco, no a la sesión
+# encriptada en memoria. Un valor None deja el valor por defecto de SQLite.
+PERFORMANCE_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,  # negativo: en KiB (64 MB)
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+}
+_FILE_ONLY_PRAGMAS = ("journal_mode", "mmap_size")
+
+# Instrumentación de consultas (desactivada por defecto): latencia, filas y
+# módulo llamante de cada sentencia; las que superan SLOW_QUERY_THRESHOLD_MS
+# se escriben con su plan en logs/slow_queries.log. Se activa con
+# enable_instrumentation() o con la variable de entorno CORDIAX_QUERY_STATS=1.
+SLOW_QUERY_THRESHOLD_MS = 100
+_instrumentation_enabled = os.environ.get("CORDIAX_QUERY_STATS") == "1"
+_query_stats = {}
+_span_stats = {}
+_stats_lock = threading.Lock()
+_slow_log = None
+
+# Caché de consultas de lectura (fetch_all_cached): cada entrada guarda las
+# tablas que lee y se descarta cuando una escritura toca alguna de ellas
+QUERY_CACHE_SIZE = 256
+_query_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_version = 0
+_cache_hits = 0
+_cache_misses = 0
+_TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)",
+                              re.IGNORECASE)
+
+# Avisos de cambios: cada escritura confirmada se publica a los suscriptores
+# como (tabla, operación, ids de fila); los ids son None si no se conocen
+_subscribers = []
+_subscribers_lock = threading.Lock()
+_WRITE_OPERATION = re.compile(r"^\s*(INSERT|REPLACE|UPDATE|DELETE)\b", re.IGNORECASE)
+_WHERE_ID = re.compile(r"\bWHERE\s+(?:\w+\.)?id\s*=\s*\?\s*$", re.IGNORECASE)
+
+# Copias automáticas al iniciar (backup_store): se hacen con la API de backup
+# de SQLite por pasos de BACKUP_STEP_PAGES páginas y se omiten si la base de
+# datos no ha cambiado desde la última
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_SLEEP = 0.005
+
+# Segundos que se espera a que los hilos cierren sus conexiones en uso antes
+# de sustituir el archivo de la base de datos
+CLOSE_TIMEOUT = 5.0
+
+# Cada cuánto se ejecuta PRAGMA optimize como mucho tras una escritura
+OPTIMIZE_INTERVAL_SECONDS = 3600
+_last_optimize = time.monotonic()
+
+# Conexiones persistentes: una por hilo, reutilizadas entre consultas. Cada
+# una se registra con el bloqueo de su hilo, que este retiene mientras la usa,
+# y con la generación en que se abrió
+_local = threading.local()
+_connections = {}
+_connections_lock = threading.Lock()
+_generation = 0
+
+# Sesión encriptada: la base de datos desencriptada vive solo en memoria y se
+# vuelve a encriptar a disco en cada punto de control (checkpoint): tras
+# CHECKPOINT_IDLE_SECONDS sin escrituras, como mucho cada CHECKPOINT_MAX_SECONDS
+# con cambios pendientes, al llamar a checkpoint() y al cerrar la aplicación.
+CHECKPOINT_IDLE_SECONDS = 30
+CHECKPOINT_MAX_SECONDS = 300
+_SESSION_SUPPORTED = hasattr(sqlite3.Connection, 'deserialize')
+_session_conn = None
+_session_store = None
+_session_lock = threading.RLock()
+_session_dirty_since = None
+_checkpoint_timer = None
 
 
 def get_db_path():
@@ -24,51 +116,389 @@ def get_db_path():
     return DB_PATH
 
 
+def _configure_connection(conn, in_memory=False):
+    """Aplicar la configuración común a una conexión recién abierta"""
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+    
+    for name, value in PERFORMANCE_PROFILE.items():
+        if value is None or (in_memory and name in _FILE_ONLY_PRAGMAS):
+            continue
+        conn.execute(f"PRAGMA {name} = {value}").fetchall()
+
+
+def optimize():
+    """Ejecutar PRAGMA optimize para mantener al día las estadísticas de los índices"""
+    global _last_optimize
+    _last_optimize = time.monotonic()
+    with _connection() as conn:
+        conn.execute("PRAGMA optimize").fetchall()
+
+
+def _maybe_optimize():
+    """Ejecutar PRAGMA optimize si ha pasado el intervalo configurado"""
+    if time.monotonic() - _last_optimize < OPTIMIZE_INTERVAL_SECONDS:
+        return
+    try:
+        optimize()
+    except sqlite3.Error as e:
+        print(f"Error al optimizar la base de datos: {e}")
+
+
 def get_connection():
-    """Obtener conexión a la base de datos"""
+    """Obtener la conexión persistente del hilo actual
+    
+    La conexión se abre la primera vez que el hilo la necesita y se reutiliza
+    en las consultas siguientes. No debe cerrarse desde el código que la usa;
+    para liberarla se usa close_connection() o close_all_connections().
+    """
+    if _use_encrypted_session():
+        return _get_session_connection()
+    
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        if getattr(_local, 'generation', None) == _generation:
+            return conn
+        # De una generación anterior: el hilo cierra su propia conexión
+        close_connection()
+    
     db_path = get_db_path()
     
     # Si la base de datos está encriptada, desencriptarla temporalmente
     if encryption.is_encryption_enabled(USER_DATA_DIR) and encryption.is_encrypted(db_path):
         if DB_PASSWORD:
-            encryption.decrypt_file(db_path, DB_PASSWORD)
+            with _span("desencriptar archivo", db_path.stat().st_size):
+                encryption.decrypt_file(db_path, get_session_key())
     
-    conn = sqlite3.connect(str(db_path))
-    conn.row_factory = sqlite3.Row
+    conn = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT, check_same_thread=False)
+    _configure_connection(conn)
+    
+    with _connections_lock:
+        _connections[conn] = (_thread_lock(), _generation)
+    _local.conn = conn
+    _local.generation = _generation
     return conn
 
 
-def migrate_database():
-    """Migrar la base de datos a la nueva estructura con centros y aulas"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _thread_lock():
+    """Bloqueo que el hilo actual retiene mientras usa su conexión"""
+    lock = getattr(_local, 'lock', None)
+    if lock is None:
+        lock = _local.lock = threading.RLock()
+    return lock
+
+
+def _close(conn, wal_checkpoint=False):
+    """Quitar una conexión del registro y cerrarla"""
+    with _connections_lock:
+        _connections.pop(conn, None)
+    try:
+        conn.execute("PRAGMA optimize").fetchall()
+        if wal_checkpoint:
+            # Volcar el WAL al archivo principal para que quede completo en cordiax.db
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    except sqlite3.Error:
+        pass
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def close_connection():
+    """Cerrar la conexión persistente del hilo actual"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None:
+        _close(conn)
+
+
+def close_all_connections(timeout=CLOSE_TIMEOUT):
+    """Cerrar las conexiones persistentes de todos los hilos
     
-    # Verificar si las columnas centro_id y aula_id existen en estudiantes
-    cursor.execute("PRAGMA table_info(estudiantes)")
-    columns = [column[1] for column in cursor.fetchall()]
+    Se usa antes de reescribir el archivo de la base de datos (encriptación,
+    restauración) y como gancho de cierre de la aplicación. Las conexiones
+    que ningún hilo está usando se cierran aquí; las que están en uso las
+    cierra su propio hilo al terminar, al ver que su generación ha quedado
+    atrás. Se espera hasta timeout segundos a que se cierren todas (si no,
+    el WAL podría quedar sin volcar en el archivo). Devuelve True si no
+    queda ninguna de antes de la llamada.
+    """
+    global _generation
+    with _connections_lock:
+        # Los hilos con una conexión de una generación anterior la reabren
+        _generation += 1
+        generation = _generation
+        connections = list(_connections.items())
     
-    if 'centro_id' not in columns:
+    wal_checkpoint = True
+    for conn, (lock, _) in connections:
+        if not lock.acquire(blocking=False):
+            continue
         try:
-            cursor.execute("ALTER TABLE estudiantes ADD COLUMN centro_id INTEGER")
-            conn.commit()
-        except Exception:
-            pass  # La columna ya existe
+            if conn is getattr(_local, 'conn', None):
+                if getattr(_local, 'depth', 0):
+                    # El propio hilo la está usando: se cierra al salir
+                    continue
+                _local.conn = None
+            _close(conn, wal_checkpoint)
+            wal_checkpoint = False
+        finally:
+            lock.release()
     
-    if 'aula_id' not in columns:
+    _close_session()
+    
+    # El archivo puede cambiar por completo (restauración, encriptación)
+    invalidate_cache()
+    
+    deadline = time.monotonic() + (timeout or 0)
+    while True:
+        with _connections_lock:
+            if all(opened >= generation for _, opened in _connections.values()):
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+
+
+def _close_at_exit():
+    """Cerrar las conexiones al salir sin dejar la base de datos en claro en disco
+    
+    Sin sesión en memoria (Python sin Connection.deserialize) el archivo se
+    desencripta a disco mientras se usa: aquí se vuelve a encriptar.
+    """
+    close_all_connections()
+    if USER_DATA_DIR is not None and get_db_path().exists():
+        _encrypt_if_enabled()
+
+
+atexit.register(_close_at_exit)
+
+
+@contextmanager
+def _connection():
+    """Obtener la conexión adecuada, con acceso exclusivo si es la sesión compartida"""
+    if _use_encrypted_session():
+        with _session_lock:
+            # La encriptación puede haberse deshabilitado mientras se esperaba
+            if _use_encrypted_session():
+                yield _get_session_connection()
+                return
+    
+    # Mientras el hilo retiene su bloqueo, close_all_connections() no cierra
+    # su conexión; si la generación cambia entretanto, la cierra él al salir
+    with _thread_lock():
+        depth = getattr(_local, 'depth', 0)
+        _local.depth = depth + 1
         try:
-            cursor.execute("ALTER TABLE estudiantes ADD COLUMN aula_id INTEGER")
-            conn.commit()
-        except Exception:
-            pass  # La columna ya existe
+            yield get_connection()
+        finally:
+            _local.depth = depth
+            if (not depth and getattr(_local, 'conn', None) is not None
+                    and _local.generation != _generation):
+                close_connection()
+
+
+def _use_encrypted_session():
+    """Comprobar si la base de datos debe abrirse como sesión encriptada en memoria"""
+    return (_SESSION_SUPPORTED and bool(DB_PASSWORD)
+            and encryption.is_encryption_enabled(USER_DATA_DIR))
+
+
+def _get_session_connection():
+    """Obtener la conexión en memoria de la sesión encriptada, abriéndola si hace falta"""
+    global _session_conn
+    with _session_lock:
+        if _session_conn is None:
+            _session_conn = _open_session()
+        return _session_conn
+
+
+def _open_session():
+    """Cargar la base de datos en memoria, desencriptándola sin pasar por disco"""
+    global _session_store
+    db_path = get_db_path()
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    store = encryption.EncryptedPageStore(db_path, get_session_key())
+    rewrite = False
     
-    conn.close()
+    if db_path.exists():
+        if encryption.is_encrypted(db_path):
+            rewrite = encryption.needs_migration(db_path)
+            with _span("desencriptar sesión", db_path.stat().st_size):
+                data = store.load()
+        else:
+            data = db_path.read_bytes()
+            rewrite = True
+        if data:
+            data = bytearray(data)
+            # Una imagen en modo WAL no se puede abrir en memoria: se marca
+            # como diario clásico (bytes 18 y 19 de la cabecera de SQLite)
+            if len(data) >= 20 and data[18] == 2:
+                data[18] = data[19] = 1
+            conn.deserialize(data)
+    
+    _configure_connection(conn, in_memory=True)
+    _session_store = store
+    
+    # Un archivo en claro o en un formato anterior se reescribe en el
+    # primer punto de control
+    if rewrite:
+        _schedule_checkpoint()
+    return conn
 
 
-def initialize_database():
-    """Inicializar la base de datos y crear tablas"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _schedule_checkpoint():
+    """Marcar la sesión como modificada y programar el próximo punto de control"""
+    global _session_dirty_since, _checkpoint_timer
+    with _session_lock:
+        now = time.monotonic()
+        if _session_dirty_since is None:
+            _session_dirty_since = now
+        
+        _cancel_checkpoint_timer()
+        delay = min(CHECKPOINT_IDLE_SECONDS,
+                    _session_dirty_since + CHECKPOINT_MAX_SECONDS - now)
+        _checkpoint_timer = threading.Timer(max(delay, 0), _checkpoint_in_background)
+        _checkpoint_timer.daemon = True
+        _checkpoint_timer.start()
+
+
+def _cancel_checkpoint_timer():
+    """Cancelar el punto de control programado, si lo hay"""
+    global _checkpoint_timer
+    if _checkpoint_timer is not None:
+        _checkpoint_timer.cancel()
+        _checkpoint_timer = None
+
+
+def _checkpoint_in_background():
+    """Ejecutar el punto de control programado desde el temporizador"""
+    try:
+        checkpoint()
+    except Exception as e:
+        print(f"Error al guardar la base de datos encriptada: {e}")
+
+
+def checkpoint():
+    """Llevar a cordiax.db todos los cambios confirmados
+    
+    En una sesión encriptada, encripta y guarda la imagen en memoria si tiene
+    cambios. Con la base de datos en disco, vuelca el WAL al archivo
+    principal. Se usa antes de copiar o encriptar el archivo. Devuelve True
+    si se ha escrito la sesión o el WAL se ha volcado por completo.
+    """
+    global _session_dirty_since
+    with _session_lock:
+        _cancel_checkpoint_timer()
+        if _session_conn is not None:
+            if _session_dirty_since is None:
+                return False
+            
+            # Solo se re-encriptan los bloques que han cambiado desde el último guardado
+            with _span("encriptar sesión (bloques modificados)") as span:
+                _session_store.save(_session_conn.serialize())
+                span["bytes"] = _session_store.last_written_bytes
+            _session_dirty_since = None
+            return True
     
+    if USER_DATA_DIR is None or _use_encrypted_session() or not get_db_path().exists():
+        return False
+    
+    with _connection() as conn:
+        busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return busy == 0
+
+
+def _close_session(save=True):
+    """Cerrar la sesión encriptada, guardándola antes si se indica"""
+    global _session_conn, _session_store, _session_dirty_since
+    with _session_lock:
+        if _session_conn is None:
+            return
+        try:
+            if save:
+                checkpoint()
+        except Exception as e:
+            print(f"Error al guardar la base de datos encriptada: {e}")
+        finally:
+            _cancel_checkpoint_timer()
+            _session_conn.close()
+            _session_conn = None
+            _session_store = None
+            _session_dirty_since = None
+
+
+def encrypt_database(password):
+    """Habilitar la encriptación y encriptar la base de datos con la contraseña
+    
+    Todo ocurre con el bloqueo de la sesión: se cierran antes las conexiones
+    (lo que vuelca el WAL al archivo) y se vuelve a comprobar si el archivo
+    ya está encriptado, para no encriptarlo dos veces.
+    """
+    db_path = get_db_path()
+    with _session_lock:
+        if not close_all_connections():
+            raise RuntimeError("La base de datos está en uso; inténtelo de nuevo")
+        encryption.enable_encryption(USER_DATA_DIR)
+        set_password(password)
+        if db_path.exists() and not encryption.is_encrypted(db_path):
+            with _span("encriptar archivo", db_path.stat().st_size):
+                encryption.encrypt_file(db_path, get_session_key())
+
+
+def decrypt_database():
+    """Guardar la base de datos en claro en disco y deshabilitar la encriptación
+    
+    Todo ocurre con el bloqueo de la sesión, de modo que ningún otro hilo
+    pueda volver a abrir una sesión encriptada (y encriptar de nuevo el
+    archivo en su punto de control) entre la desencriptación y el momento en
+    que se olvida la contraseña.
+    """
+    db_path = get_db_path()
+    with _session_lock:
+        _cancel_checkpoint_timer()
+        if _session_conn is not None:
+            data = _session_conn.serialize()
+            plain_path = Path(str(db_path) + '.decrypted')
+            plain_path.write_bytes(data)
+            plain_path.replace(db_path)
+            _close_session(save=False)
+        else:
+            if not close_all_connections():
+                raise RuntimeError("La base de datos está en uso; inténtelo de nuevo")
+            if encryption.is_encrypted(db_path):
+                encryption.decrypt_file(db_path, get_session_key())
+        
+        encryption.disable_encryption(USER_DATA_DIR)
+        set_password(None)
+
+
+def unlock(password):
+    """Desbloquear la base de datos encriptada con la contraseña indicada
+    
+    Deriva la clave de sesión y carga la base de datos. Devuelve False si la
+    contraseña no permite leerla.
+    """
+    set_password(password)
+    try:
+        db_path = get_db_path()
+        with _session_lock:
+            # Un archivo de un formato anterior se pasa al actual en memoria,
+            # antes de abrirlo por cualquier camino
+            if encryption.needs_migration(db_path):
+                close_all_connections()
+                encryption.migrate_file(db_path, get_session_key())
+        with _connection() as conn:
+            conn.execute("SELECT name FROM sqlite_master LIMIT 1").fetchall()
+        return True
+    except Exception:
+        set_password(None)
+        return False
+
+
+def _migration_base_schema(cursor):
+    """Crear las tablas base y las columnas de centro y aula de estudiantes"""
     # Tabla de centros
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS centros (
@@ -181,40 +611,271 @@ def initialize_database():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    # Bases de datos anteriores a centros y aulas: añadir las columnas
+    cursor.execute("PRAGMA table_info(estudiantes)")
+    columns = [column[1] for column in cursor.fetchall()]
+    
+    if 'centro_id' not in columns:
+        cursor.execute("ALTER TABLE estudiantes ADD COLUMN centro_id INTEGER")
+    
+    if 'aula_id' not in columns:
+        cursor.execute("ALTER TABLE estudiantes ADD COLUMN aula_id INTEGER")
+
+
+def _migration_indexes(cursor):
+    """Crear los índices que usan las consultas de los módulos"""
+    # Asistencia por fecha (y check-in rápido: estudiantes ya registrados ese día)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_asistencia_fecha_estudiante "
+                   "ON asistencia(fecha, estudiante_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_asistencia_estudiante "
+                   "ON asistencia(estudiante_id)")
+    
+    # Estudiantes ordenados por apellidos, activos y por centro/aula
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_estudiantes_apellidos_nombre "
+                   "ON estudiantes(apellidos, nombre)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_estudiantes_activo "
+                   "ON estudiantes(activo, apellidos, nombre)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_estudiantes_centro ON estudiantes(centro_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_estudiantes_aula ON estudiantes(aula_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_aulas_centro ON aulas(centro_id)")
+    
+    # Mensajes y permisos, listados por fecha y consultados por estudiante
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_fecha ON mensajes(fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_estudiante ON mensajes(estudiante_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_permisos_estudiante ON permisos(estudiante_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_permisos_fecha ON permisos(fecha)")
+    
+    # Menú de cafetería por fecha
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_menu_cafeteria_fecha "
+                   "ON menu_cafeteria(fecha, tipo_comida)")
+
+
+def _migration_documents(cursor):
+    """Crear el índice de documentos (metadatos de los archivos de documentos/)"""
+    # Un documento por archivo; ruta es relativa a documentos/ y carpeta, su directorio
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ruta TEXT NOT NULL UNIQUE,
+            carpeta TEXT NOT NULL DEFAULT '',
+            nombre TEXT NOT NULL,
+            tipo TEXT,
+            tamano INTEGER,
+            mtime_ns INTEGER,
+            hash TEXT,
+            centro_id INTEGER,
+            aula_id INTEGER,
+            estudiante_id INTEGER,
+            fecha_indexado TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (centro_id) REFERENCES centros(id),
+            FOREIGN KEY (aula_id) REFERENCES aulas(id),
+            FOREIGN KEY (estudiante_id) REFERENCES estudiantes(id)
+        )
+    """)
     
-    # Ejecutar migraciones
+    # Fecha de modificación de cada carpeta en el último escaneo
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS documentos_carpetas (
+            ruta TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        )
+    """)
+    
+    # Listado ordenado por cualquier columna y filtrado por tipo o propietario
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_carpeta ON documentos(carpeta)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_tipo ON documentos(tipo, ruta)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_tamano ON documentos(tamano)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_mtime ON documentos(mtime_ns)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_centro ON documentos(centro_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_aula ON documentos(aula_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_estudiante "
+                   "ON documentos(estudiante_id)")
+
+
+# Migraciones del esquema, en orden. Cada una se ejecuta una sola vez, dentro
+# de una transacción, y deja PRAGMA user_version con su número. Para cambiar
+# el esquema se añade una migración nueva al final; nunca se modifican las
+# que ya se han publicado.
+MIGRATIONS = [
+    (1, "Esquema base con centros y aulas", _migration_base_schema),
+    (2, "Índices para las consultas de los módulos", _migration_indexes),
+    (3, "Índice de documentos", _migration_documents),
+]
+
+
+def get_schema_version():
+    """Obtener la versión del esquema de la base de datos (PRAGMA user_version)"""
+    return fetch_one("PRAGMA user_version")[0]
+
+
+def migrate_database():
+    """Aplicar las migraciones pendientes según PRAGMA user_version"""
+    current = get_schema_version()
+    
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        with transaction():
+            with _connection() as conn:
+                cursor = conn.cursor()
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+                cursor.close()
+        invalidate_cache()
+        current = version
+
+
+def initialize_database():
+    """Inicializar la base de datos y actualizar su esquema"""
     migrate_database()
+    optimize()
+    
+    # Realizar backup automático (en segundo plano)
+    backup_database_in_background()
+
+
+def backup_database_in_background():
+    """Hacer la copia automática en un hilo aparte para no retrasar el arranque"""
+    thread = threading.Thread(target=backup_database, name="cordiax-db-backup")
+    thread.start()
+    return thread
+
+
+def _change_marker(db_path):
+    """Marca de cambios del archivo de la base de datos
+    
+    Contador de cambios de la cabecera de SQLite (bytes 24-27), tamaño y
+    fecha de modificación. En modo WAL SQLite no incrementa el contador en
+    cada transacción, por eso se acompaña del tamaño y la fecha del archivo
+    ya volcado; en un archivo encriptado solo cuentan estos dos.
+    """
+    stat = db_path.stat()
+    counter = None
+    with open(db_path, 'rb') as f:
+        header = f.read(28)
+    if header.startswith(encryption.SQLITE_MAGIC) and len(header) == 28:
+        counter = struct.unpack(">I", header[24:28])[0]
+    return [counter, stat.st_size, stat.st_mtime_ns]
+
+
+def _online_backup(source_path, target_path, compact=False):
+    """Copiar una base de datos SQLite de forma consistente
     
-    # Realizar backup automático
-    backup_database()
+    Con compact se usa VACUUM INTO, que además compacta la copia; si no, la
+    API de backup copia BACKUP_STEP_PAGES páginas por paso y cede el
+    bloqueo entre pasos, de modo que la aplicación puede seguir escribiendo.
+    """
+    source = sqlite3.connect(str(source_path), timeout=BUSY_TIMEOUT)
+    try:
+        if compact:
+            source.execute("VACUUM INTO ?", (str(target_path),))
+            return
+        target = sqlite3.connect(str(target_path))
+        try:
+            source.backup(target, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
 
+def _table_counts(conn):
+    """Número de filas de cada tabla de una conexión"""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY name")]
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            for table in tables}
 
-def backup_database():
-    """Realizar copia de seguridad de la base de datos (últimos 3 días)"""
+
+def snapshot_database(target_path, compact=False, skip_marker=None):
+    """Copia consistente de la base de datos en target_path
+    
+    Si la encriptación está habilitada, la copia también queda encriptada.
+    Devuelve (marca de cambios del archivo copiado, filas por tabla de la
+    copia), o None sin copiar nada si la marca coincide con skip_marker.
+    """
+    db_path = get_db_path()
+    
+    # Llevar al archivo los cambios pendientes (WAL o sesión encriptada)
+    checkpoint()
+    
+    # Con la sesión encriptada bloqueada, ningún punto de control
+    # reescribe el archivo mientras se copia
+    with _session_lock:
+        marker = _change_marker(db_path)
+        if marker == skip_marker:
+            return None
+        
+        with _span("copia de la base de datos", marker[1]):
+            if encryption.is_encrypted(db_path):
+                shutil.copyfile(str(db_path), str(target_path))
+                # Tras el punto de control la sesión coincide con el archivo
+                counts = _table_counts(_session_conn) if _session_conn is not None else None
+            else:
+                _online_backup(db_path, target_path, compact)
+                copy = sqlite3.connect(str(target_path))
+                try:
+                    counts = _table_counts(copy)
+                finally:
+                    copy.close()
+                if encryption.is_encryption_enabled(USER_DATA_DIR) and DB_PASSWORD:
+                    encryption.encrypt_file(target_path, get_session_key())
+    return marker, counts
+
+
+def backup_database(compact=False, force=False):
+    """Realizar copia de seguridad de la base de datos (últimos 3 días)
+    
+    La copia es consistente aunque la aplicación esté escribiendo y se guarda
+    en el almacén deduplicado (backup_store), así que solo ocupan espacio los
+    bloques que han cambiado desde la copia anterior. Si la encriptación está
+    habilitada, la copia también queda encriptada. Se omite si el archivo no
+    ha cambiado desde la última copia, salvo con force. Devuelve el id de la
+    copia, o None si no se ha hecho.
+    """
     if USER_DATA_DIR is None:
-        return
+        return None
         
     db_path = get_db_path()
     if not db_path.exists():
-        return
+        return None
     
-    # Crear directorio de backups si no existe
-    backup_dir = USER_DATA_DIR / "db_backups"
-    backup_dir.mkdir(exist_ok=True)
-    
-    # Crear backup con timestamp
+    store = backup_store.open_store(USER_DATA_DIR)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_path = backup_dir / f"cordiax_backup_{timestamp}.db"
+    temp_path = store.tmp_dir / f"cordiax_backup_{timestamp}.db"
     
     try:
-        shutil.copy2(str(db_path), str(backup_path))
+        latest = store.latest_backup("auto")
+        previous = latest["meta"].get("marker") if latest else None
+        snapshot = snapshot_database(temp_path, compact, skip_marker=None if force else previous)
+        if snapshot is None:
+            return None
+        marker, counts = snapshot
+        
+        # Trocear y guardar fuera del bloqueo: la copia temporal ya es fija
+        with _span("almacén de copias", marker[1]):
+            manifest = store.create_backup(f"cordiax_backup_{timestamp}",
+                                           [("cordiax.db", temp_path)], kind="auto",
+                                           meta={"marker": marker, "tables": counts})
+        
+        # Eliminar copias antiguas (mantener solo 3 días) y sus bloques
+        store.apply_retention()
         
-        # Eliminar backups antiguos (mantener solo 3 días)
-        cleanup_old_backups(backup_dir)
+        # Copias completas de versiones anteriores
+        legacy_dir = USER_DATA_DIR / "db_backups"
+        if legacy_dir.exists():
+            cleanup_old_backups(legacy_dir)
+        return manifest["id"]
     except Exception as e:
         print(f"Error al hacer backup: {e}")
+        return None
+    finally:
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
 
 
 def cleanup_old_backups(backup_dir):
@@ -233,70 +894,688 @@ def cleanup_old_backups(backup_dir):
             print(f"Error al limpiar backup {backup_file}: {e}")
 
 
+def enable_instrumentation(threshold_ms=None):
+    """Activar la instrumentación de consultas
+    
+    threshold_ms cambia el umbral a partir del cual una consulta se
+    considera lenta y se escribe en el registro de consultas lentas.
+    """
+    global _instrumentation_enabled, SLOW_QUERY_THRESHOLD_MS
+    if threshold_ms is not None:
+        SLOW_QUERY_THRESHOLD_MS = threshold_ms
+    _instrumentation_enabled = True
+
+
+def disable_instrumentation():
+    """Desactivar la instrumentación de consultas"""
+    global _instrumentation_enabled
+    _instrumentation_enabled = False
+
+
+def reset_query_stats():
+    """Borrar las estadísticas acumuladas"""
+    with _stats_lock:
+        _query_stats.clear()
+        _span_stats.clear()
+
+
+def _get_slow_log():
+    """Obtener el registro rotativo de consultas lentas, creándolo la primera vez"""
+    global _slow_log
+    if _slow_log is None:
+        log_dir = USER_DATA_DIR / "logs"
+        log_dir.mkdir(exist_ok=True)
+        handler = RotatingFileHandler(str(log_dir / "slow_queries.log"),
+                                      maxBytes=1024 * 1024, backupCount=3,
+                                      encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _slow_log = logging.getLogger("cordiax.slow_queries")
+        _slow_log.setLevel(logging.INFO)
+        _slow_log.propagate = False
+        _slow_log.addHandler(handler)
+    return _slow_log
+
+
+def _caller():
+    """Identificar el módulo y la función fuera de database que lanzó la consulta"""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get("__name__") == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def _normalize_sql(query):
+    """Normalizar espacios para agrupar las estadísticas por sentencia"""
+    return " ".join(query.split())
+
+
+def _record_query(query, params, elapsed, rows):
+    """Acumular la latencia de una sentencia y registrarla si es lenta"""
+    sql = _normalize_sql(query)
+    elapsed_ms = elapsed * 1000
+    caller = _caller()
+    
+    with _stats_lock:
+        stats = _query_stats.setdefault(sql, {
+            "sql": sql, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+            "rows": 0, "callers": set()
+        })
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["rows"] += max(rows, 0)
+        stats["callers"].add(caller)
+    
+    if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS and USER_DATA_DIR is not None:
+        _log_slow_query(sql, params, elapsed_ms, rows, caller)
+
+
+def _log_slow_query(sql, params, elapsed_ms, rows, caller):
+    """Escribir una consulta lenta y su plan en el registro de consultas lentas"""
+    plan = []
+    if sql.split(" ", 1)[0].upper() in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"):
+        # Sin parámetros (execute_many) basta con valores nulos para obtener el plan
+        if not params:
+            params = (None,) * sql.count("?")
+        try:
+            with _connection() as conn:
+                plan = [row[3] for row in
+                        conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        except sqlite3.Error as e:
+            plan = [f"(sin plan: {e})"]
+    
+    lines = [f"{elapsed_ms:.1f} ms, {rows} filas, {caller}", f"    {sql}"]
+    lines += [f"    PLAN {step}" for step in plan]
+    _get_slow_log().info("\n".join(lines))
+
+
+@contextmanager
+def _span(name, size=0):
+    """Medir una operación que no es SQL (desencriptar, encriptar) como tramo aparte
+    
+    Devuelve un diccionario en el que se puede corregir "bytes" si el tamaño
+    procesado solo se conoce al terminar.
+    """
+    span = {"bytes": size}
+    if not _instrumentation_enabled:
+        yield span
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with _stats_lock:
+            stats = _span_stats.setdefault(name, {
+                "name": name, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes": 0
+            })
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["bytes"] += span["bytes"]
+
+
+def get_query_stats(top_n=20, order_by="total_ms"):
+    """Obtener las sentencias con más tiempo acumulado (o por count, max_ms, rows)"""
+    with _stats_lock:
+        stats = [dict(s, callers=sorted(s["callers"])) for s in _query_stats.values()]
+    stats.sort(key=lambda s: s[order_by], reverse=True)
+    return stats[:top_n]
+
+
+def get_span_stats():
+    """Obtener los tiempos de encriptar y desencriptar medidos aparte de SQL"""
+    with _stats_lock:
+        return [dict(s) for s in _span_stats.values()]
+
+
+def format_query_stats(top_n=20):
+    """Resumen en texto de las sentencias más costosas y de los tramos de encriptación"""
+    lines = [f"{'Total ms':>10} {'Veces':>7} {'Media ms':>9} {'Máx ms':>9} {'Filas':>8}  Sentencia"]
+    for s in get_query_stats(top_n):
+        lines.append(f"{s['total_ms']:10.1f} {s['count']:7d} {s['total_ms'] / s['count']:9.2f} "
+                     f"{s['max_ms']:9.1f} {s['rows']:8d}  {s['sql'][:120]}")
+        lines.append(f"{'':48}desde: {', '.join(s['callers'])}")
+    
+    spans = get_span_stats()
+    if spans:
+        lines.append("")
+        lines.append(f"{'Total ms':>10} {'Veces':>7} {'Máx ms':>9} {'MB':>9}  Tramo")
+        for s in spans:
+            lines.append(f"{s['total_ms']:10.1f} {s['count']:7d} {s['max_ms']:9.1f} "
+                         f"{s['bytes'] / (1024 * 1024):9.1f}  {s['name']}")
+    return "\n".join(lines)
+
+
+def dump_query_stats(top_n=20):
+    """Guardar el resumen de estadísticas en logs/query_stats.txt y devolver la ruta"""
+    if USER_DATA_DIR is None or not (_query_stats or _span_stats):
+        return None
+    
+    log_dir = USER_DATA_DIR / "logs"
+    log_dir.mkdir(exist_ok=True)
+    path = log_dir / "query_stats.txt"
+    path.write_text(format_query_stats(top_n), encoding="utf-8")
+    return path
+
+
+def _dump_query_stats_at_exit():
+    """Guardar el resumen al salir si la instrumentación está activa"""
+    if _instrumentation_enabled:
+        try:
+            dump_query_stats()
+        except OSError as e:
+            print(f"Error al guardar estadísticas de consultas: {e}")
+
+
+atexit.register(_dump_query_stats_at_exit)
+
+
+def _referenced_tables(query):
+    """Obtener las tablas que menciona una sentencia SQL (en minúsculas)"""
+    return frozenset(name.lower() for name in _TABLE_REFERENCE.findall(query))
+
+
+def fetch_all_cached(query, params=None):
+    """Como fetch_all, pero guardando el resultado en la caché de consultas
+    
+    Pensado para consultas de catálogo que se repiten mucho (centros, aulas,
+    estudiantes activos). El resultado se reutiliza hasta que una escritura
+    toque alguna de las tablas que lee la consulta.
+    """
+    global _cache_hits, _cache_misses
+    key = (query, tuple(params) if params else ())
+    with _cache_lock:
+        entry = _query_cache.get(key)
+        if entry is not None:
+            _query_cache.move_to_end(key)
+            _cache_hits += 1
+            return list(entry[1])
+        _cache_misses += 1
+        version = _cache_version
+    
+    results = fetch_all(query, params)
+    
+    with _cache_lock:
+        # Si hubo una escritura mientras se leía, el resultado puede estar
+        # obsoleto y no se guarda
+        if version == _cache_version:
+            _query_cache[key] = (_referenced_tables(query), results)
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    
+    return list(results)
+
+
+def invalidate_cache(tables=None):
+    """Descartar las entradas de la caché que leen alguna de las tablas
+    
+    Sin tablas (o si no se reconocen) se vacía la caché completa.
+    """
+    global _cache_version
+    tables = frozenset(t.lower() for t in tables) if tables else None
+    with _cache_lock:
+        _cache_version += 1
+        if tables is None:
+            _query_cache.clear()
+            return
+        for key in [k for k, (read, _) in _query_cache.items() if read & tables]:
+            del _query_cache[key]
+
+
+def get_cache_stats():
+    """Obtener aciertos, fallos, tasa de aciertos y tamaño de la caché de consultas"""
+    with _cache_lock:
+        total = _cache_hits + _cache_misses
+        return {
+            "hits": _cache_hits,
+            "misses": _cache_misses,
+            "hit_rate": _cache_hits / total if total else 0.0,
+            "size": len(_query_cache),
+            "max_size": QUERY_CACHE_SIZE,
+        }
+
+
+def _invalidate_for_write(query):
+    """Descartar de la caché lo que pueda cambiar una escritura
+    
+    Dentro de una transacción se vuelve a invalidar al terminarla, para no
+    conservar lecturas hechas antes de confirmar (o de deshacer) los cambios.
+    """
+    tables = _referenced_tables(query) or None
+    invalidate_cache(tables)
+    if _in_transaction():
+        pending = _local.tx_tables
+        if tables is None or pending is None:
+            _local.tx_tables = None
+        else:
+            pending.update(tables)
+
+
+def subscribe(callback, tables=None):
+    """Recibir un aviso tras cada escritura confirmada
+    
+    callback(tabla, operación, ids) se llama desde el hilo que escribió, con
+    operación "insert", "update" o "delete" e ids una tupla con los id de
+    las filas afectadas, o None si no se pueden saber (escrituras masivas o
+    con otra condición). tables limita los avisos a esas tablas.
+    """
+    tables = frozenset(t.lower() for t in tables) if tables else None
+    with _subscribers_lock:
+        _subscribers.append((callback, tables))
+    return callback
+
+
+def unsubscribe(callback):
+    """Dejar de recibir avisos de cambios"""
+    with _subscribers_lock:
+        _subscribers[:] = [(cb, t) for cb, t in _subscribers if cb is not callback]
+
+
+def _describe_write(query, params, last_id):
+    """Obtener (tabla, operación, ids) de una escritura, o None si no modifica filas"""
+    match = _WRITE_OPERATION.match(query)
+    tables = _TABLE_REFERENCE.findall(query)
+    if not match or not tables:
+        return None
+    
+    operation = match.group(1).lower()
+    if operation == "replace":
+        operation = "insert"
+    
+    row_ids = None
+    if operation == "insert" and last_id:
+        row_ids = (last_id,)
+    elif operation != "insert" and params and _WHERE_ID.search(query):
+        row_ids = (params[-1],)
+    return tables[0].lower(), operation, row_ids
+
+
+def _notify_write(query, params=None, last_id=None):
+    """Publicar una escritura, o guardarla hasta que se confirme la transacción"""
+    change = _describe_write(query, params, last_id)
+    if change is None:
+        return
+    if _in_transaction():
+        _local.tx_changes.append(change)
+    else:
+        _publish(*change)
+
+
+def _publish(table, operation, row_ids):
+    """Avisar a los suscriptores interesados en la tabla"""
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    
+    for callback, tables in subscribers:
+        if tables is not None and table not in tables:
+            continue
+        try:
+            callback(table, operation, row_ids)
+        except Exception as e:
+            print(f"Error al notificar cambio en {table}: {e}")
+
+
+def _in_transaction():
+    """Comprobar si el hilo actual está dentro de un bloque transaction()"""
+    return getattr(_local, 'tx_depth', 0) > 0
+
+
+@contextmanager
+def transaction():
+    """Agrupar varias escrituras en una única transacción
+    
+    Dentro del bloque, execute_query, execute_many y bulk_insert no confirman
+    por separado: se confirma una sola vez al salir (o se deshace todo si hay
+    una excepción) y la base de datos se re-encripta una sola vez. Los
+    bloques anidados forman parte de la transacción exterior.
+    
+        with database.transaction():
+            database.execute_query(...)
+            database.execute_many(...)
+    """
+    if _in_transaction():
+        _local.tx_depth += 1
+        try:
+            yield
+        finally:
+            _local.tx_depth -= 1
+        return
+    
+    with _connection() as conn:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        _local.tx_depth = 1
+        _local.tx_tables = set()
+        _local.tx_changes = []
+        try:
+            yield
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _local.tx_depth = 0
+            if _local.tx_tables is None or _local.tx_tables:
+                invalidate_cache(_local.tx_tables)
+            changes = _local.tx_changes
+            _local.tx_changes = []
+    
+    # Re-encriptar si es necesario
+    _after_write()
+    
+    # Los cambios se publican solo si la transacción se ha confirmado
+    for change in changes:
+        _publish(*change)
+
+
 def execute_query(query, params=None):
     """Ejecutar consulta SQL"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    in_transaction = _in_transaction()
+    start = time.perf_counter() if _instrumentation_enabled else None
     
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
+    with _connection() as conn:
+        cursor = conn.cursor()
+        
+        try:
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            if not in_transaction:
+                conn.commit()
+        except Exception:
+            if not in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            _invalidate_for_write(query)
+        
+        last_id = cursor.lastrowid
     
-    conn.commit()
-    last_id = cursor.lastrowid
-    conn.close()
+    if start is not None:
+        _record_query(query, params, time.perf_counter() - start, cursor.rowcount)
     
     # Re-encriptar si es necesario
-    _encrypt_if_enabled()
+    if not in_transaction:
+        _after_write()
+    
+    _notify_write(query, params, last_id)
     
     return last_id
 
 
+def execute_many(query, params_seq):
+    """Ejecutar la misma consulta para cada conjunto de parámetros
+    
+    Todas las filas se escriben en una sola transacción y con un único
+    re-encriptado. Devuelve el número de filas afectadas.
+    """
+    start = time.perf_counter() if _instrumentation_enabled else None
+    
+    with transaction():
+        with _connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.executemany(query, params_seq)
+                rowcount = max(cursor.rowcount, 0)
+            finally:
+                cursor.close()
+                _invalidate_for_write(query)
+            if rowcount:
+                _notify_write(query)
+    
+    if start is not None:
+        _record_query(query, None, time.perf_counter() - start, rowcount)
+    
+    return rowcount
+
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def bulk_insert(table, columns, rows):
+    """Insertar muchas filas en una tabla en una sola transacción
+    
+    columns es la lista de columnas y rows un iterable de tuplas con los
+    valores en el mismo orden. Devuelve el número de filas insertadas.
+    """
+    for name in [table, *columns]:
+        if not _IDENTIFIER.match(name):
+            raise ValueError(f"Identificador SQL no válido: {name}")
+    
+    placeholders = ", ".join("?" for _ in columns)
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    return execute_many(query, rows)
+
+
 def fetch_all(query, params=None):
     """Obtener todos los resultados de una consulta"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    start = time.perf_counter() if _instrumentation_enabled else None
     
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
+    with _connection() as conn:
+        cursor = conn.cursor()
+        
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        
+        results = cursor.fetchall()
+        cursor.close()
     
-    results = cursor.fetchall()
-    conn.close()
+    if start is not None:
+        _record_query(query, params, time.perf_counter() - start, len(results))
     
     return results
 
 
 def fetch_one(query, params=None):
     """Obtener un resultado de una consulta"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    start = time.perf_counter() if _instrumentation_enabled else None
     
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
+    with _connection() as conn:
+        cursor = conn.cursor()
+        
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        
+        result = cursor.fetchone()
+        cursor.close()
     
-    result = cursor.fetchone()
-    conn.close()
-    
-    # Re-encriptar si es necesario
-    _encrypt_if_enabled()
+    if start is not None:
+        _record_query(query, params, time.perf_counter() - start, 0 if result is None else 1)
     
     return result
 
 
+def fetch_iter(query, params=None, batch_size=500):
+    """Recorrer los resultados de una consulta sin cargarlos todos en memoria
+    
+    Las filas se leen de batch_size en batch_size. En una sesión encriptada
+    cada lote se lee con el bloqueo de la sesión, que se suelta antes de
+    entregar las filas: un generador abandonado a medias no deja bloqueados
+    a los demás hilos. Si la base de datos cambia de modo entre dos lotes
+    (se activa o se quita la encriptación) se lanza OperationalError.
+    """
+    start = time.perf_counter() if _instrumentation_enabled else None
+    count = 0
+    cursor = None
+    
+    try:
+        while True:
+            with _connection() as conn:
+                if cursor is None:
+                    cursor = conn.cursor()
+                    if params:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+                elif cursor.connection is not conn:
+                    raise sqlite3.OperationalError(
+                        "La base de datos ha cambiado durante la lectura")
+                rows = cursor.fetchmany(batch_size)
+            
+            if not rows:
+                break
+            count += len(rows)
+            yield from rows
+    finally:
+        if cursor is not None:
+            with _session_lock:
+                try:
+                    cursor.close()
+                except sqlite3.ProgrammingError:
+                    # La conexión ya se había cerrado
+                    pass
+    
+    if start is not None:
+        _record_query(query, params, time.perf_counter() - start, count)
+
+
+PAGE_SIZE = 200
+
+
+def _keyset_condition(order_by, after):
+    """Condición SQL para las filas que van detrás de la clave after
+    
+    Si todas las columnas se ordenan en la misma dirección se compara como
+    tupla, (a, b) < (?, ?), que SQLite resuelve con una búsqueda por rango en
+    el índice. Si no, se desarrolla columna a columna. Las filas con NULL en
+    la primera columna de un orden DESC (que SQLite pone al final) no entran
+    aquí: fetch_page las pide aparte.
+    """
+    directions = {direction for _, direction in order_by}
+    if len(directions) == 1 and None not in after:
+        operator = "<" if "DESC" in directions else ">"
+        columns = ", ".join(column for column, _ in order_by)
+        placeholders = ", ".join("?" for _ in order_by)
+        return f"({columns}) {operator} ({placeholders})", list(after)
+    
+    alternatives = []
+    values = []
+    for index, (column, direction) in enumerate(order_by):
+        value = after[index]
+        if direction == "DESC":
+            if value is None:
+                continue
+            term = f"{column} < ?" if index == 0 else f"({column} < ? OR {column} IS NULL)"
+            term_values = [value]
+        else:
+            term = f"{column} > ?" if value is not None else f"{column} IS NOT NULL"
+            term_values = [value] if value is not None else []
+        
+        equal = [f"{c} IS ?" for c, _ in order_by[:index]]
+        alternatives.append(" AND ".join(equal + [term]))
+        values.extend(after[:index])
+        values.extend(term_values)
+    
+    if not alternatives:
+        return "0", []
+    return " OR ".join(f"({a})" for a in alternatives), values
+
+
+def _page_query(query, params, order_by, condition, condition_values, limit):
+    """Ejecutar la consulta de una página"""
+    sql = f"SELECT * FROM ({query})"
+    values = list(params or ())
+    if condition:
+        sql += f" WHERE {condition}"
+        values.extend(condition_values)
+    sql += " ORDER BY " + ", ".join(f"{column} {direction}" for column, direction in order_by)
+    sql += " LIMIT ?"
+    values.append(limit)
+    return fetch_all(sql, tuple(values))
+
+
+def fetch_page(query, params=None, order_by=(("id", "ASC"),), after=None, limit=PAGE_SIZE):
+    """Obtener una página de resultados con paginación por clave (keyset)
+    
+    query es una consulta sin ORDER BY ni LIMIT; order_by indica las columnas
+    del resultado por las que se ordena, con "ASC" o "DESC", y debe terminar
+    en una columna única y sin NULL (normalmente id). after es la clave
+    devuelta por la página anterior. A diferencia de OFFSET, el coste de cada
+    página no crece con las páginas ya leídas si el orden coincide con un
+    índice.
+    
+    Devuelve (filas, clave de la siguiente página o None si no hay más).
+    """
+    order_by = [(column, direction.upper()) for column, direction in order_by]
+    for column, direction in order_by:
+        if not _IDENTIFIER.match(column) or direction not in ("ASC", "DESC"):
+            raise ValueError(f"Orden no válido: {column} {direction}")
+    
+    if after is None:
+        rows = _page_query(query, params, order_by, None, None, limit)
+    else:
+        condition, values = _keyset_condition(order_by, after)
+        rows = _page_query(query, params, order_by, condition, values, limit)
+        
+        first, direction = order_by[0]
+        if direction == "DESC" and after[0] is not None and len(rows) < limit:
+            # Terminados los valores, siguen las filas con NULL en la primera columna
+            rows += _page_query(query, params, order_by, f"{first} IS NULL", [],
+                                limit - len(rows))
+    
+    next_after = None
+    if len(rows) == limit:
+        next_after = tuple(rows[-1][column] for column, _ in order_by)
+    return rows, next_after
+
+
+def _after_write():
+    """Persistir una escritura: programar el punto de control o re-encriptar el archivo"""
+    if _session_conn is not None:
+        _schedule_checkpoint()
+    else:
+        _encrypt_if_enabled()
+    _maybe_optimize()
+
+
 def _encrypt_if_enabled():
     """Encriptar la base de datos si la encriptación está habilitada"""
+    if _session_conn is not None or _in_transaction():
+        # En una sesión encriptada el archivo se actualiza en los puntos de
+        # control; dentro de una transacción, al confirmarla
+        return
     if encryption.is_encryption_enabled(USER_DATA_DIR) and DB_PASSWORD:
         db_path = get_db_path()
         if not encryption.is_encrypted(db_path):
-            encryption.encrypt_file(db_path, DB_PASSWORD)
+            # El archivo se reemplaza: ninguna conexión puede quedar abierta
+            # sobre él (si alguna sigue en uso, se intenta en la próxima escritura)
+            if not close_all_connections():
+                return
+            with _span("encriptar archivo", db_path.stat().st_size):
+                encryption.encrypt_file(db_path, get_session_key())
 
 
 def set_password(password):
-    """Establecer la contraseña de la base de datos"""
-    global DB_PASSWORD
+    """Establecer la contraseña de la base de datos
+    
+    La clave se deriva aquí una sola vez y se guarda en memoria durante la
+    sesión; las operaciones de encriptación posteriores no repiten PBKDF2.
+    """
+    global DB_PASSWORD, DB_KEY
+    if password and password == DB_PASSWORD and DB_KEY is not None:
+        return
+    
     DB_PASSWORD = password
+    DB_KEY = None
+    invalidate_cache()
+    if password:
+        DB_KEY = encryption.create_session_key(password, get_db_path())
+
+
+def get_session_key():
+    """Obtener la clave de sesión derivada de la contraseña actual"""
+    global DB_KEY
+    if DB_KEY is None and DB_PASSWORD:
+        DB_KEY = encryption.create_session_key(DB_PASSWORD, get_db_path())
+    return DB_KEY
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Ejecutor de base de datos en segundo plano
+Saca las consultas, escrituras y operaciones de encriptación del hilo de Tk
+
+Las escrituras pasan por un único hilo (en orden, sin competir por el bloqueo
+de SQLite) y las lecturas por un grupo de hilos. Cada envío devuelve un
+Future; run_in_background() entrega el resultado al bucle principal de Tk
+mediante after(), ya que los widgets solo se pueden tocar desde ese hilo.
+"""
+
+import bisect
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from modules import database, encryption
+
+
+READER_WORKERS = 4
+POLL_INTERVAL_MS = 25
+CHANGE_POLL_MS = 50
+LOAD_MORE_AT = 0.9
+LOADING_IID = "__cargando__"
+LOADING_TEXT = "Cargando..."
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cordiax-db-writer")
+_readers = ThreadPoolExecutor(max_workers=READER_WORKERS, thread_name_prefix="cordiax-db-reader")
+
+# Avisos de cambios pendientes de entregar en el hilo de Tk
+_changes = queue.Queue()
+_watchers = 0
+_pump_running = False
+
+
+def _reader_executor():
+    """Elegir el ejecutor de lecturas
+
+    Sin sesión en memoria, la encriptación cierra todas las conexiones tras
+    cada escritura; en ese caso las lecturas van también por el hilo de
+    escritura para no cruzarse con ella.
+    """
+    if (not database._SESSION_SUPPORTED and database.USER_DATA_DIR is not None
+            and encryption.is_encryption_enabled(database.USER_DATA_DIR)):
+        return _writer
+    return _readers
+
+
+def submit_read(func, *args, **kwargs):
+    """Ejecutar una lectura en el grupo de lectores y devolver su Future"""
+    return _reader_executor().submit(func, *args, **kwargs)
+
+
+def submit_write(func, *args, **kwargs):
+    """Ejecutar una escritura en el hilo de escritura y devolver su Future"""
+    return _writer.submit(func, *args, **kwargs)
+
+
+def fetch_all(query, params=None):
+    """database.fetch_all en segundo plano"""
+    return submit_read(database.fetch_all, query, params)
+
+
+def fetch_one(query, params=None):
+    """database.fetch_one en segundo plano"""
+    return submit_read(database.fetch_one, query, params)
+
+
+def fetch_all_cached(query, params=None):
+    """database.fetch_all_cached en segundo plano"""
+    return submit_read(database.fetch_all_cached, query, params)
+
+
+def execute_query(query, params=None):
+    """database.execute_query en el hilo de escritura"""
+    return submit_write(database.execute_query, query, params)
+
+
+def bulk_insert(table, columns, rows):
+    """database.bulk_insert en el hilo de escritura"""
+    return submit_write(database.bulk_insert, table, columns, rows)
+
+
+def deliver(widget, future, on_success=None, on_error=None):
+    """Llamar a on_success/on_error en el hilo de Tk cuando termine el Future
+
+    Se consulta el Future con after() en lugar de usar add_done_callback,
+    que se ejecutaría en el hilo de trabajo.
+    """
+    def poll():
+        try:
+            if not widget.winfo_exists():
+                return
+        except Exception:
+            # La ventana ya se ha destruido
+            return
+
+        if not future.done():
+            widget.after(POLL_INTERVAL_MS, poll)
+            return
+
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                print(f"Error en operación de base de datos: {error}")
+        elif on_success:
+            on_success(future.result())
+
+    widget.after(POLL_INTERVAL_MS, poll)
+    return future
+
+
+def run_in_background(widget, func, *args, on_success=None, on_error=None,
+                      write=False, **kwargs):
+    """Ejecutar func fuera del hilo de Tk y entregar el resultado con after()"""
+    submit = submit_write if write else submit_read
+    return deliver(widget, submit(func, *args, **kwargs), on_success, on_error)
+
+
+def watch(widget, callback, tables=None):
+    """Suscribir una vista a los cambios de la base de datos
+
+    callback(tabla, operación, ids) se llama en el hilo de Tk (ver
+    database.subscribe). La suscripción termina al destruirse el widget.
+    """
+    global _watchers
+
+    def on_change(table, operation, row_ids):
+        _changes.put((widget, callback, table, operation, row_ids))
+
+    def on_destroy(event):
+        global _watchers
+        # Se compara la ruta de Tk: widget puede envolver al Treeview real
+        if str(event.widget) == str(widget):
+            database.unsubscribe(on_change)
+            _watchers -= 1
+
+    database.subscribe(on_change, tables)
+    widget.bind("<Destroy>", on_destroy, add="+")
+    _watchers += 1
+    _start_pump(widget)
+    return on_change
+
+
+def _start_pump(widget):
+    """Empezar a repartir los avisos de cambios desde el bucle de Tk"""
+    global _pump_running
+    if _pump_running:
+        return
+    _pump_running = True
+    root = widget._root()
+
+    def pump():
+        global _pump_running
+        while True:
+            try:
+                target, callback, table, operation, row_ids = _changes.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if target.winfo_exists():
+                    callback(table, operation, row_ids)
+            except Exception as e:
+                print(f"Error al aplicar cambio en {table}: {e}")
+
+        if _watchers > 0:
+            root.after(CHANGE_POLL_MS, pump)
+        else:
+            _pump_running = False
+
+    root.after(CHANGE_POLL_MS, pump)
+
+
+def patch_rows(tree, row_ids, rows, to_values, index="end", to_tags=None):
+    """Actualizar en un Treeview solo las filas indicadas
+
+    Las filas se identifican por su id (iid del Treeview). Las de row_ids que
+    no aparecen en rows se eliminan; las nuevas se insertan en index.
+    to_tags(fila), si se indica, da las etiquetas de cada fila.
+    """
+    shown = _shown_rows(tree)
+    found = set()
+    for row in rows:
+        iid = str(row['id'])
+        found.add(iid)
+        options = {"values": to_values(row)}
+        if to_tags is not None:
+            options["tags"] = to_tags(row)
+        if tree.exists(iid):
+            tree.item(iid, **options)
+            # Sin etiquetas nuevas no se sabe cómo ha quedado la fila
+            shown.pop(iid, None)
+        else:
+            tree.insert("", index, iid=iid, **options)
+            shown.pop(iid, None)
+
+    for row_id in row_ids:
+        iid = str(row_id)
+        if iid not in found and tree.exists(iid):
+            tree.delete(iid)
+            shown.pop(iid, None)
+
+
+class PagedLoader:
+    """Carga un Treeview por páginas (database.fetch_page) al hacer scroll
+
+    La primera página se pinta en cuanto llega; las siguientes se piden en
+    segundo plano cuando el scroll se acerca al final. to_item(fila) devuelve
+    (iid, values, tags) para cada fila.
+    """
+
+    def __init__(self, tree, scrollbar, to_item, order_by, page_size=database.PAGE_SIZE):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.to_item = to_item
+        self.order_by = order_by
+        self.page_size = page_size
+        self.query = None
+        self.params = None
+        self.after = None
+        self.loading = False
+        self.request = 0
+        tree.configure(yscrollcommand=self.on_scroll)
+
+    def load(self, query, params=None):
+        """Empezar de nuevo desde la primera página"""
+        self.query = query
+        self.params = params
+        self.after = None
+        self.loading = False
+        self.request += 1
+        show_loading(self.tree)
+        self.fetch_next(first=True)
+
+    def on_scroll(self, first, last):
+        """Mover la barra de scroll y pedir la siguiente página si hace falta"""
+        self.scrollbar.set(first, last)
+        if float(last) >= LOAD_MORE_AT and self.after is not None and not self.loading:
+            self.fetch_next()
+
+    def fetch_next(self, first=False):
+        """Pedir la siguiente página en segundo plano"""
+        self.loading = True
+        request = self.request
+        future = submit_read(database.fetch_page, self.query, self.params,
+                             self.order_by, self.after, self.page_size)
+
+        def show(result):
+            if request != self.request:
+                return
+            rows, self.after = result
+            self.loading = False
+            if first:
+                self.tree.delete(*self.tree.get_children())
+            for row in rows:
+                iid, values, tags = self.to_item(row)
+                if self.tree.exists(iid):
+                    self.tree.item(iid, values=values, tags=tags)
+                else:
+                    self.tree.insert("", "end", iid=iid, values=values, tags=tags)
+            # Si la página no llena la vista, Tk llama a on_scroll con el
+            # final visible y se pide la siguiente
+
+        def failed(error):
+            if request == self.request:
+                self.loading = False
+                hide_loading(self.tree)
+            print(f"Error al cargar página: {error}")
+
+        deliver(self.tree, future, show, failed)
+
+
+def _longest_increasing(sequence):
+    """Índices de una subsecuencia creciente más larga de sequence"""
+    tails = []
+    tail_index = []
+    previous = [None] * len(sequence)
+    for index, value in enumerate(sequence):
+        position = bisect.bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_index.append(index)
+        else:
+            tails[position] = value
+            tail_index[position] = index
+        previous[index] = tail_index[position - 1] if position else None
+
+    result = []
+    index = tail_index[-1] if tail_index else None
+    while index is not None:
+        result.append(index)
+        index = previous[index]
+    return result[::-1]
+
+
+def _shown_rows(tree):
+    """Valores y etiquetas (como texto) con que reconcile pintó cada fila de tree
+
+    Evita leer cada fila de Tk para saber si ha cambiado. patch_rows descarta
+    las filas que toca, que se vuelven a leer del Treeview.
+    """
+    shown = getattr(tree, "_reconciled_rows", None)
+    if shown is None:
+        shown = {}
+        tree._reconciled_rows = shown
+    return shown
+
+
+def _as_text(values, tags):
+    """Valores y etiquetas como texto (Tk devuelve números y textos convertidos)"""
+    return tuple(str(v) for v in values), tuple(str(t) for t in tags)
+
+
+def reconcile(tree, rows):
+    """Llevar un Treeview al contenido de rows aplicando solo las diferencias
+
+    rows es la lista de (iid, valores, etiquetas) en el orden deseado; las
+    filas se emparejan por iid (la clave primaria). Se borran las que sobran,
+    se insertan las nuevas, se actualizan las que han cambiado y se mueven
+    solo las que no forman parte de la secuencia más larga que ya está en
+    orden. La selección y el scroll se conservan.
+
+    Las posiciones se siguen en una lista local (sin preguntar a Tk por cada
+    fila) y los valores se comparan con los que se pintaron en la llamada
+    anterior; solo las filas que no se conocen se leen del Treeview.
+
+    Devuelve el número de operaciones de Tk aplicadas por tipo y en total.
+    """
+    counts = {"inserted": 0, "updated": 0, "deleted": 0, "moved": 0}
+    rows = [(str(iid), tuple(values), tuple(tags)) for iid, values, tags in rows]
+    wanted = {iid for iid, _, _ in rows}
+
+    children = tree.get_children()
+    stale = [iid for iid in children if iid not in wanted]
+    if stale:
+        tree.delete(*stale)
+        counts["deleted"] = len(stale)
+
+    # Orden actual del Treeview, que se mantiene al insertar y mover
+    order = [iid for iid in children if iid in wanted]
+    current = {iid: index for index, iid in enumerate(order)}
+    kept = [iid for iid, _, _ in rows if iid in current]
+    stable = {kept[i] for i in _longest_increasing([current[iid] for iid in kept])}
+
+    previous_shown = _shown_rows(tree)
+    shown = {}
+    position = -1  # Posición en order de la fila anterior del orden deseado
+    for iid, values, tags in rows:
+        text = _as_text(values, tags)
+        shown[iid] = text
+
+        # Cada fila se coloca justo detrás de la anterior del orden deseado
+        if iid not in current:
+            position += 1
+            tree.insert("", position, iid=iid, values=values, tags=tags)
+            order.insert(position, iid)
+            counts["inserted"] += 1
+            continue
+
+        if iid in stable:
+            # Las filas estables ya están en orden, más adelante en la lista
+            position = order.index(iid, position + 1)
+        else:
+            # Como en Tk, la fila queda detrás de la que ocupa target - 1
+            target = position + 1
+            tree.move(iid, "", target)
+            old = order.index(iid)
+            del order[old]
+            if old < target:
+                target -= 1
+            order.insert(target, iid)
+            position = target
+            counts["moved"] += 1
+
+        before = previous_shown.get(iid)
+        if before is None:
+            item = tree.item(iid)
+            before = _as_text(item['values'], item['tags'])
+        if before != text:
+            tree.item(iid, values=values, tags=tags)
+            counts["updated"] += 1
+
+    tree._reconciled_rows = shown
+    counts["total"] = sum(counts.values())
+    return counts
+
+
+def show_loading(tree, text=LOADING_TEXT):
+    """Vaciar un Treeview y mostrar una fila de "Cargando..." """
+    tree.delete(*tree.get_children())
+    columns = list(tree['columns'])
+    values = [""] * len(columns)
+    if values:
+        # Texto en la primera columna de datos (la de ID es demasiado estrecha)
+        first = 1 if len(columns) > 1 and columns[0] == "ID" else 0
+        values[first] = text
+    tree.insert("", "end", iid=LOADING_IID, values=values)
+
+
+def hide_loading(tree):
+    """Quitar la fila de "Cargando..." de un Treeview"""
+    if tree.exists(LOADING_IID):
+        tree.delete(LOADING_IID)
+
+
+def set_busy(widget, busy):
+    """Mostrar el cursor de espera en la ventana mientras dura una operación"""
+    try:
+        widget.winfo_toplevel().config(cursor="watch" if busy else "")
+    except Exception:
+        pass
+
+
+def shutdown(wait=True):
+    """Detener los hilos del ejecutor"""
+    _readers.shutdown(wait=wait)
+    _writer.shutdown(wait=wait)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de documentos
+Mantiene la tabla documentos al día con los archivos de la carpeta documentos/
+
+El listado de documentos se sirve desde la tabla (ordenado y filtrado con
+índices) en lugar de recorrer la carpeta y hacer stat() de cada archivo.
+reconcile() pone la tabla al día: una carpeta solo se vuelve a listar si su
+fecha de modificación ha cambiado (al crear, borrar o renombrar un archivo
+dentro), y de sus archivos solo se vuelve a calcular el hash de los nuevos o
+modificados. Un archivo renombrado o movido conserva su ficha (y su
+propietario) si su hash coincide con el de uno que ha desaparecido.
+
+Editar un archivo sin crear ni borrar otros no cambia la fecha de su
+carpeta: la aplicación indexa los archivos que importa con index_file() y
+reconcile(full=True) revisa todos los archivos.
+
+Recorrer la carpeta y calcular los hashes es lo lento y solo lee, así que
+se puede hacer en un hilo lector: plan_reconcile() y describe_file()
+preparan los cambios, y apply_reconcile() y store_file() los escriben
+(en el hilo de escritura) en una sola transacción o sentencia.
+"""
+
+import os
+import hashlib
+from collections import defaultdict
+from pathlib import Path
+from modules import database
+
+
+DOCUMENT_TYPES = {
+    '.docx': 'Word', '.doc': 'Word',
+    '.xlsx': 'Excel', '.xls': 'Excel',
+    '.pptx': 'PowerPoint', '.ppt': 'PowerPoint',
+    '.pdf': 'PDF',
+}
+
+HASH_BLOCK_SIZE = 1024 * 1024
+# Parámetros por consulta (SQLite admite al menos 999)
+QUERY_BATCH = 500
+
+
+def file_hash(path):
+    """SHA-256 de un archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parent(ruta):
+    """Carpeta (relativa) de una ruta relativa a documentos/"""
+    return ruta.rpartition("/")[0]
+
+
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), QUERY_BATCH):
+        yield items[start:start + QUERY_BATCH]
+
+
+def _scan(root, known_dirs, full):
+    """Recorrer las carpetas, listando solo las que han cambiado
+
+    Devuelve (carpetas vistas, carpetas listadas con su mtime, archivos
+    encontrados en las carpetas listadas con su stat).
+    """
+    children = defaultdict(list)
+    for ruta in known_dirs:
+        if ruta:
+            children[_parent(ruta)].append(ruta)
+
+    seen = set()
+    scanned = {}
+    found = {}
+    pending = [""]
+    while pending:
+        ruta = pending.pop()
+        path = root / ruta if ruta else root
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        seen.add(ruta)
+        if not full and known_dirs.get(ruta) == mtime_ns:
+            # Sin cambios: solo se baja a sus subcarpetas conocidas
+            pending.extend(children[ruta])
+            continue
+
+        scanned[ruta] = mtime_ns
+        with os.scandir(path) as entries:
+            for entry in entries:
+                child = f"{ruta}/{entry.name}" if ruta else entry.name
+                if entry.is_dir():
+                    pending.append(child)
+                elif entry.is_file() and Path(entry.name).suffix.lower() in DOCUMENT_TYPES:
+                    found[child] = entry.stat()
+    return seen, scanned, found
+
+
+def _values(ruta, stat, digest):
+    """Columnas de la ficha de un archivo"""
+    return (_parent(ruta), ruta.rpartition("/")[2],
+            DOCUMENT_TYPES.get(Path(ruta).suffix.lower()), stat.st_size, stat.st_mtime_ns, digest)
+
+
+_INSERT_DOCUMENT = (
+    "INSERT INTO documentos (ruta, carpeta, nombre, tipo, tamano, mtime_ns, hash) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(ruta) DO UPDATE SET "
+    "tamano = excluded.tamano, mtime_ns = excluded.mtime_ns, hash = excluded.hash, "
+    "fecha_indexado = CURRENT_TIMESTAMP")
+
+
+def plan_reconcile(documents_dir, full=False):
+    """Preparar los cambios que pondrían la tabla documentos al día con la carpeta
+
+    Solo lee (la carpeta, los archivos nuevos o modificados y la tabla), así
+    que puede ejecutarse fuera del hilo de escritura. Con full se listan
+    todas las carpetas y se comparan todos los archivos. Devuelve el plan
+    que escribe apply_reconcile().
+    """
+    root = Path(documents_dir)
+    known_dirs = {row["ruta"]: row["mtime_ns"]
+                  for row in database.fetch_all("SELECT ruta, mtime_ns FROM documentos_carpetas")}
+    seen, scanned, found = _scan(root, known_dirs, full)
+    gone_dirs = [ruta for ruta in known_dirs if ruta not in seen]
+
+    # Fichas de las carpetas listadas o desaparecidas
+    indexed = {}
+    for batch in _batches([*scanned, *gone_dirs]):
+        rows = database.fetch_all(
+            "SELECT id, ruta, tamano, mtime_ns, hash FROM documentos "
+            f"WHERE carpeta IN ({', '.join('?' for _ in batch)})", batch)
+        indexed.update((row["ruta"], row) for row in rows)
+
+    added = [ruta for ruta in found if ruta not in indexed]
+    modified = [ruta for ruta in found if ruta in indexed
+                and (indexed[ruta]["tamano"] != found[ruta].st_size
+                     or indexed[ruta]["mtime_ns"] != found[ruta].st_mtime_ns)]
+    removed = {ruta: row for ruta, row in indexed.items() if ruta not in found}
+
+    # El hash se calcula fuera de la transacción: leer los archivos es lo lento
+    hashes = {}
+    for ruta in [*added, *modified]:
+        try:
+            hashes[ruta] = file_hash(root / ruta)
+        except OSError as e:
+            print(f"Error al indexar documento {ruta}: {e}")
+            hashes[ruta] = None
+
+    # Renombrados o movidos: mismo contenido que un archivo desaparecido
+    moved_from = defaultdict(list)
+    for ruta in sorted(removed):
+        if removed[ruta]["hash"]:
+            moved_from[removed[ruta]["hash"]].append(removed[ruta])
+    inserts = []
+    moves = []
+    for ruta in sorted(added):
+        previous = _pair_moved(ruta, moved_from.get(hashes[ruta])) if hashes[ruta] else None
+        if previous is not None:
+            del removed[previous["ruta"]]
+            moves.append((ruta, *_values(ruta, found[ruta], hashes[ruta]), previous["id"]))
+        else:
+            inserts.append((ruta, *_values(ruta, found[ruta], hashes[ruta])))
+    updates = [(ruta, *_values(ruta, found[ruta], hashes[ruta]), indexed[ruta]["id"])
+               for ruta in modified]
+
+    return {"inserts": inserts, "moves": moves, "updates": updates,
+            "removed": [row["id"] for row in removed.values()],
+            "scanned": list(scanned.items()), "gone_dirs": gone_dirs}
+
+
+def _pair_moved(ruta, candidates):
+    """Elegir, entre las fichas desaparecidas con el mismo hash, la que se movió a ruta
+
+    Con varios archivos iguales se prefiere el del mismo nombre y después
+    el de la misma carpeta; si no, el primero por ruta. La ficha elegida se
+    quita de candidates.
+    """
+    if not candidates:
+        return None
+    name = ruta.rpartition("/")[2]
+    folder = _parent(ruta)
+    best = min(candidates, key=lambda row: (row["ruta"].rpartition("/")[2] != name,
+                                            _parent(row["ruta"]) != folder, row["ruta"]))
+    candidates.remove(best)
+    return best
+
+
+def apply_reconcile(plan):
+    """Escribir en una transacción los cambios de plan_reconcile()
+
+    Entre el plan y la escritura puede haberse indexado alguno de los
+    archivos nuevos (index_file): se insertan actualizando la ficha si ya
+    existe, y antes de mover una ficha a su nueva ruta se borra la que otro
+    haya creado allí. Si la ficha movida ya no existe, el archivo se inserta.
+    Devuelve el número de documentos añadidos, modificados o eliminados.
+    """
+    update = ("UPDATE documentos SET ruta = ?, carpeta = ?, nombre = ?, tipo = ?, tamano = ?, "
+              "mtime_ns = ?, hash = ?, fecha_indexado = CURRENT_TIMESTAMP WHERE id = ?")
+    with database.transaction():
+        if plan["inserts"]:
+            database.execute_many(_INSERT_DOCUMENT, plan["inserts"])
+        if plan["moves"]:
+            # La ficha movida conserva su id y su propietario
+            database.execute_many("DELETE FROM documentos WHERE ruta = ? AND id != ?",
+                                  [(move[0], move[-1]) for move in plan["moves"]])
+            database.execute_many(update, plan["moves"])
+            database.execute_many(_INSERT_DOCUMENT, [move[:-1] for move in plan["moves"]])
+        if plan["updates"]:
+            database.execute_many(update, plan["updates"])
+        if plan["removed"]:
+            database.execute_many("DELETE FROM documentos WHERE id = ?",
+                                  [(row_id,) for row_id in plan["removed"]])
+        if plan["scanned"]:
+            database.execute_many(
+                "INSERT OR REPLACE INTO documentos_carpetas (ruta, mtime_ns) VALUES (?, ?)",
+                plan["scanned"])
+        if plan["gone_dirs"]:
+            database.execute_many("DELETE FROM documentos_carpetas WHERE ruta = ?",
+                                  [(ruta,) for ruta in plan["gone_dirs"]])
+    return (len(plan["inserts"]) + len(plan["moves"]) + len(plan["updates"])
+            + len(plan["removed"]))
+
+
+def reconcile(documents_dir, full=False):
+    """Poner la tabla documentos al día con la carpeta (plan y escritura en este hilo)
+
+    Devuelve el número de documentos añadidos, modificados o eliminados.
+    """
+    return apply_reconcile(plan_reconcile(documents_dir, full))
+
+
+def describe_file(documents_dir, ruta):
+    """Ficha de un archivo concreto (lee el archivo para calcular su hash)"""
+    path = Path(documents_dir) / ruta
+    stat = path.stat()
+    return (ruta, *_values(ruta, stat, file_hash(path)))
+
+
+def store_file(entry):
+    """Guardar la ficha de describe_file(), sustituyendo la que tuviera la ruta"""
+    database.execute_query(_INSERT_DOCUMENT, entry)
+
+
+def index_file(documents_dir, ruta):
+    """Indexar (o volver a indexar) un archivo concreto, p. ej. recién importado"""
+    store_file(describe_file(documents_dir, ruta))
+
+
+def forget_file(ruta):
+    """Quitar del índice un archivo eliminado"""
+    database.execute_query("DELETE FROM documentos WHERE ruta = ?", (ruta,))
+
+
+def set_owner(document_id, centro_id=None, aula_id=None, estudiante_id=None):
+    """Asignar un documento a un centro, un aula o un estudiante"""
+    database.execute_query(
+        "UPDATE documentos SET centro_id = ?, aula_id = ?, estudiante_id = ? WHERE id = ?",
+        (centro_id, aula_id, estudiante_id, document_id))
@@ -6,9 +6,12 @@ Gestión de archivos Word, Excel, PowerPoint
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from modules import database
+from modules import database, db_executor, document_index
+from modules.virtual_table import VirtualTable
+from datetime import datetime
 import shutil
 import os
+import sys
 from pathlib import Path
 
 
@@ -18,9 +21,17 @@ class DocumentsModule:
     def __init__(self, parent):
         self.parent = parent
         self.documents_dir = database.USER_DATA_DIR / "documentos"
+        self.documents_dir.mkdir(exist_ok=True)
         self.setup_ui()
         self.load_documents()
         
+        # Actualizar solo las filas afectadas cuando cambian los datos
+        db_executor.watch(self.tree, self.on_data_changed,
+                          ("documentos", "centros", "aulas", "estudiantes"))
+        
+        # Poner el índice al día con la carpeta (solo las carpetas modificadas)
+        self.refresh_index()
+        
     def setup_ui(self):
         """Configurar la interfaz"""
         # Título
@@ -28,6 +39,35 @@ class DocumentsModule:
                          font=("Arial", 16, "bold"))
         title.pack(pady=(0, 10))
         
+        # Frame de filtros
+        filter_frame = ttk.Frame(self.parent)
+        filter_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(filter_frame, text="Tipo:").pack(side=tk.LEFT, padx=5)
+        self.tipo_filter_var = tk.StringVar(value="Todos")
+        tipo_combo = ttk.Combobox(filter_frame, textvariable=self.tipo_filter_var,
+                                  width=15, state="readonly")
+        tipo_combo['values'] = ["Todos"] + sorted(set(document_index.DOCUMENT_TYPES.values()))
+        tipo_combo.pack(side=tk.LEFT, padx=5)
+        tipo_combo.bind("<<ComboboxSelected>>", lambda e: self.load_documents())
+        
+        ttk.Label(filter_frame, text="Centro:").pack(side=tk.LEFT, padx=5)
+        self.centro_filter_var = tk.StringVar(value="")
+        self.centro_filter_combo = ttk.Combobox(filter_frame, textvariable=self.centro_filter_var, 
+                                                width=20, state="readonly")
+        self.centro_filter_combo.pack(side=tk.LEFT, padx=5)
+        self.centro_filter_combo.bind("<<ComboboxSelected>>", lambda e: self.load_documents())
+        
+        ttk.Label(filter_frame, text="Aula:").pack(side=tk.LEFT, padx=5)
+        self.aula_filter_var = tk.StringVar(value="")
+        self.aula_filter_combo = ttk.Combobox(filter_frame, textvariable=self.aula_filter_var, 
+                                              width=20, state="readonly")
+        self.aula_filter_combo.pack(side=tk.LEFT, padx=5)
+        self.aula_filter_combo.bind("<<ComboboxSelected>>", lambda e: self.load_documents())
+        
+        # Cargar filtros
+        self.load_filters()
+        
         # Frame de botones
         button_frame = ttk.Frame(self.parent)
         button_frame.pack(fill=tk.X, pady=(0, 10))
@@ -36,10 +76,12 @@ class DocumentsModule:
                   command=self.import_document).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Abrir", 
                   command=self.open_document).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Asignar", 
+                  command=self.assign_owner).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Eliminar", 
                   command=self.delete_document).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Actualizar", 
-                  command=self.load_documents).pack(side=tk.LEFT, padx=5)
+                  command=lambda: self.refresh_index(full=True)).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Abrir Carpeta", 
                   command=self.open_folder).pack(side=tk.LEFT, padx=5)
         
@@ -52,9 +94,9 @@ class DocumentsModule:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # Treeview
-        columns = ("Nombre", "Tipo", "Tamaño", "Fecha Modificación")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        columns = ("Nombre", "Tipo", "Tamaño", "Fecha Modificación", "Propietario")
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -65,6 +107,7 @@ class DocumentsModule:
         self.tree.column("Tipo", width=120)
         self.tree.column("Tamaño", width=100)
         self.tree.column("Fecha Modificación", width=150)
+        self.tree.column("Propietario", width=200)
         
         self.tree.pack(fill=tk.BOTH, expand=True)
         
@@ -77,48 +120,152 @@ class DocumentsModule:
                               font=("Arial", 9, "italic"))
         info_label.pack(anchor=tk.W)
         
+    def load_filters(self):
+        """Cargar opciones de filtro"""
+        if not self.centro_filter_var.get():
+            self.centro_filter_var.set("Todos")
+        if not self.aula_filter_var.get():
+            self.aula_filter_var.set("Todas")
+        
+        def show_centros(centros):
+            self.centro_filter_combo['values'] = ["Todos"] + [c['nombre'] for c in centros]
+        
+        db_executor.deliver(self.centro_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM centros ORDER BY nombre"), show_centros)
+        
+        def show_aulas(aulas):
+            self.aula_filter_combo['values'] = ["Todas"] + [a['nombre'] for a in aulas]
+        
+        db_executor.deliver(self.aula_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM aulas ORDER BY nombre"), show_aulas)
+    
+    def build_query(self, row_ids=None):
+        """Construir la consulta del índice de documentos con los filtros actuales"""
+        query = """
+            SELECT d.id, d.ruta, d.tipo, d.tamano, d.mtime_ns,
+                   c.nombre as centro_nombre, a.nombre as aula_nombre,
+                   e.nombre as estudiante_nombre, e.apellidos as estudiante_apellidos
+            FROM documentos d
+            LEFT JOIN centros c ON d.centro_id = c.id
+            LEFT JOIN aulas a ON d.aula_id = a.id
+            LEFT JOIN estudiantes e ON d.estudiante_id = e.id
+            WHERE 1=1
+        """
+        params = []
+        
+        # Solo algunas filas
+        if row_ids:
+            query += f" AND d.id IN ({', '.join('?' for _ in row_ids)})"
+            params.extend(row_ids)
+        
+        # Filtro por tipo
+        if self.tipo_filter_var.get() != "Todos":
+            query += " AND d.tipo = ?"
+            params.append(self.tipo_filter_var.get())
+        
+        # Filtro por centro
+        if self.centro_filter_var.get() and self.centro_filter_var.get() != "Todos":
+            query += " AND c.nombre = ?"
+            params.append(self.centro_filter_var.get())
+        
+        # Filtro por aula
+        if self.aula_filter_var.get() and self.aula_filter_var.get() != "Todas":
+            query += " AND a.nombre = ?"
+            params.append(self.aula_filter_var.get())
+        
+        query += " ORDER BY d.ruta"
+        return query, tuple(params) if params else None
+    
+    def document_values(self, document):
+        """Valores de la fila de un documento en la tabla"""
+        size_kb = (document['tamano'] or 0) / 1024
+        if size_kb < 1024:
+            size_str = f"{size_kb:.1f} KB"
+        else:
+            size_str = f"{size_kb/1024:.1f} MB"
+        
+        mod_time = ""
+        if document['mtime_ns'] is not None:
+            mod_time = datetime.fromtimestamp(document['mtime_ns'] / 1e9).strftime("%Y-%m-%d %H:%M")
+        
+        # Propietario: el estudiante, si hay, y si no el aula o el centro
+        if document['estudiante_nombre']:
+            owner = f"{document['estudiante_nombre']} {document['estudiante_apellidos']}"
+        else:
+            owner = document['aula_nombre'] or document['centro_nombre'] or ""
+        
+        return (
+            document['ruta'],
+            document['tipo'] or "Otro",
+            size_str,
+            mod_time,
+            owner
+        )
+    
     def load_documents(self):
-        """Cargar documentos desde la carpeta"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        """Cargar documentos desde el índice"""
+        query, params = self.build_query()
+        
+        # Solo se pinta el resultado de la última carga solicitada
+        self._load_request = getattr(self, "_load_request", 0) + 1
+        request = self._load_request
+        
+        def show(documents):
+            if request != self._load_request:
+                return
+            # Actualizar la tabla con solo las diferencias
+            db_executor.reconcile(self.tree, [
+                (document['id'], self.document_values(document), ()) for document in documents
+            ])
         
-        # Listar archivos en el directorio de documentos
-        if not self.documents_dir.exists():
+        db_executor.deliver(self.tree, db_executor.fetch_all(query, params), show)
+    
+    def on_data_changed(self, table, operation, row_ids):
+        """Aplicar un cambio de la base de datos a la tabla"""
+        if table != "documentos":
+            # Un centro, aula o estudiante renombrado afecta a filtros y a muchas filas
+            self.load_filters()
+            self.load_documents()
             return
         
-        supported_extensions = ['.docx', '.xlsx', '.pptx', '.doc', '.xls', '.ppt', '.pdf']
+        if row_ids is None:
+            self.load_documents()
+            return
         
-        for file_path in sorted(self.documents_dir.iterdir()):
-            if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
-                # Obtener información del archivo
-                stat = file_path.stat()
-                size_kb = stat.st_size / 1024
-                
-                if size_kb < 1024:
-                    size_str = f"{size_kb:.1f} KB"
-                else:
-                    size_str = f"{size_kb/1024:.1f} MB"
-                
-                # Tipo de archivo
-                tipo_dict = {
-                    '.docx': 'Word', '.doc': 'Word',
-                    '.xlsx': 'Excel', '.xls': 'Excel',
-                    '.pptx': 'PowerPoint', '.ppt': 'PowerPoint',
-                    '.pdf': 'PDF'
-                }
-                tipo = tipo_dict.get(file_path.suffix.lower(), 'Otro')
-                
-                # Fecha de modificación
-                from datetime import datetime
-                mod_time = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M")
-                
-                self.tree.insert("", tk.END, values=(
-                    file_path.name,
-                    tipo,
-                    size_str,
-                    mod_time
-                ))
+        if operation == "delete":
+            db_executor.patch_rows(self.tree, row_ids, [], self.document_values)
+            return
+        
+        query, params = self.build_query(row_ids)
+        db_executor.deliver(
+            self.tree, db_executor.fetch_all(query, params),
+            lambda rows: db_executor.patch_rows(self.tree, row_ids, rows, self.document_values))
+    
+    def refresh_index(self, full=False):
+        """Poner al día el índice de documentos en segundo plano
+        
+        La carpeta se recorre y los hashes se calculan en un hilo lector; al
+        hilo de escritura solo llega la transacción final. Los cambios
+        llegan a la tabla por on_data_changed.
+        """
+        def failed(e):
+            print(f"Error al indexar documentos: {e}")
+        
+        def apply(plan):
+            db_executor.run_in_background(self.parent, document_index.apply_reconcile, plan,
+                                          write=True, on_error=failed)
+        
+        db_executor.run_in_background(self.parent, document_index.plan_reconcile,
+                                      self.documents_dir, full, on_success=apply, on_error=failed)
+    
+    def get_selected_document(self):
+        """Ruta (relativa a documentos/) e id del documento seleccionado"""
+        selection = self.tree.selection()
+        if not selection:
+            messagebox.showwarning("Advertencia", "Por favor, seleccione un documento")
+            return None, None
+        item = self.tree.item(selection[0])
+        return item['values'][0], selection[0]
     
     def import_document(self):
         """Importar un documento"""
@@ -150,7 +297,16 @@ class DocumentsModule:
                     return
             
             shutil.copy2(filename, destination)
-            self.load_documents()
+            # Indexar el archivo (su hash se calcula en un hilo lector); si
+            # sustituye a otro, la fecha de la carpeta no cambia
+            def failed(e):
+                print(f"Error al indexar documento: {e}")
+            
+            db_executor.run_in_background(
+                self.parent, document_index.describe_file, self.documents_dir, destination.name,
+                on_error=failed,
+                on_success=lambda entry: db_executor.run_in_background(
+                    self.parent, document_index.store_file, entry, write=True, on_error=failed))
             messagebox.showinfo("Éxito", "Documento importado correctamente")
             
         except Exception as e:
@@ -158,13 +314,9 @@ class DocumentsModule:
     
     def open_document(self):
         """Abrir documento seleccionado"""
-        selection = self.tree.selection()
-        if not selection:
-            messagebox.showwarning("Advertencia", "Por favor, seleccione un documento")
+        filename, _ = self.get_selected_document()
+        if filename is None:
             return
-        
-        item = self.tree.item(selection[0])
-        filename = item['values'][0]
         file_path = self.documents_dir / filename
         
         try:
@@ -182,23 +334,31 @@ class DocumentsModule:
     
     def delete_document(self):
         """Eliminar documento seleccionado"""
-        selection = self.tree.selection()
-        if not selection:
-            messagebox.showwarning("Advertencia", "Por favor, seleccione un documento")
+        filename, _ = self.get_selected_document()
+        if filename is None:
             return
         
-        item = self.tree.item(selection[0])
-        filename = item['values'][0]
-        
         if messagebox.askyesno("Confirmar", 
                               f"¿Está seguro de eliminar {filename}?"):
             file_path = self.documents_dir / filename
             try:
-                file_path.unlink()
-                self.load_documents()
-                messagebox.showinfo("Éxito", "Documento eliminado correctamente")
+                file_path.unlink(missing_ok=True)
             except Exception as e:
                 messagebox.showerror("Error", f"Error al eliminar: {str(e)}")
+                return
+            
+            # Quitar la ficha del índice en el hilo de escritura
+            db_executor.run_in_background(
+                self.tree, document_index.forget_file, filename, write=True,
+                on_success=lambda _: messagebox.showinfo("Éxito", "Documento eliminado correctamente"),
+                on_error=lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
+    
+    def assign_owner(self):
+        """Asignar el documento seleccionado a un centro, aula o estudiante"""
+        filename, document_id = self.get_selected_document()
+        if filename is None:
+            return
+        DocumentOwnerDialog(self.parent, document_id, filename)
     
     def open_folder(self):
         """Abrir carpeta de documentos"""
@@ -212,3 +372,123 @@ class DocumentsModule:
                 os.system(f'xdg-open "{self.documents_dir}"')
         except Exception as e:
             messagebox.showerror("Error", f"Error al abrir carpeta: {str(e)}")
+
+
+class DocumentOwnerDialog:
+    """Diálogo para asignar un documento a un centro, aula o estudiante"""
+    
+    def __init__(self, parent, document_id, filename):
+        self.document_id = document_id
+        
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title(f"Asignar - {filename}")
+        self.dialog.geometry("450x230")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        
+        # Set icon
+        self._set_icon()
+        
+        self.setup_ui()
+        self.load_owner()
+    
+    def _set_icon(self):
+        """Set window icon"""
+        try:
+            if getattr(sys, 'frozen', False):
+                icon_path = os.path.join(sys._MEIPASS, 'logo.ico')
+            else:
+                icon_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logo.ico')
+            if os.path.exists(icon_path):
+                self.dialog.iconbitmap(icon_path)
+        except Exception:
+            pass
+    
+    def setup_ui(self):
+        """Configurar la interfaz del diálogo"""
+        main_frame = ttk.Frame(self.dialog, padding="20")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        row = 0
+        
+        ttk.Label(main_frame, text="Centro:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        self.centro_var = tk.StringVar()
+        centro_combo = ttk.Combobox(main_frame, textvariable=self.centro_var,
+                                    width=38, state="readonly")
+        centro_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
+        row += 1
+        
+        ttk.Label(main_frame, text="Aula:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        self.aula_var = tk.StringVar()
+        aula_combo = ttk.Combobox(main_frame, textvariable=self.aula_var,
+                                  width=38, state="readonly")
+        aula_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
+        row += 1
+        
+        ttk.Label(main_frame, text="Estudiante:").grid(row=row, column=0, sticky=tk.W, pady=5)
+        self.estudiante_var = tk.StringVar()
+        estudiante_combo = ttk.Combobox(main_frame, textvariable=self.estudiante_var,
+                                        width=38, state="readonly")
+        estudiante_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
+        row += 1
+        
+        self.combos = (centro_combo, aula_combo, estudiante_combo)
+        self.centros_dict = {}
+        self.aulas_dict = {}
+        self.estudiantes_dict = {}
+        
+        # Botones
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=row, column=0, columnspan=2, pady=20)
+        
+        ttk.Button(button_frame, text="Guardar", command=self.save).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Cancelar", command=self.dialog.destroy).pack(side=tk.LEFT, padx=5)
+        
+        main_frame.columnconfigure(1, weight=1)
+    
+    def load_owner(self):
+        """Cargar las opciones y el propietario actual del documento"""
+        db_executor.run_in_background(self.dialog, self._read_owner, on_success=self.show_owner)
+    
+    def _read_owner(self):
+        """Leer centros, aulas, estudiantes y el documento (fuera del hilo de Tk)"""
+        return (
+            database.fetch_all_cached("SELECT id, nombre FROM centros ORDER BY nombre"),
+            database.fetch_all_cached("SELECT id, nombre FROM aulas ORDER BY nombre"),
+            database.fetch_all_cached(
+                "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 "
+                "ORDER BY apellidos, nombre"),
+            database.fetch_one(
+                "SELECT centro_id, aula_id, estudiante_id FROM documentos WHERE id = ?",
+                (self.document_id,)),
+        )
+    
+    def show_owner(self, result):
+        """Rellenar las listas y seleccionar el propietario actual"""
+        centros, aulas, estudiantes, document = result
+        self.centros_dict = {c['nombre']: c['id'] for c in centros}
+        self.aulas_dict = {a['nombre']: a['id'] for a in aulas}
+        self.estudiantes_dict = {f"{e['apellidos']}, {e['nombre']}": e['id'] for e in estudiantes}
+        for combo, names in zip(self.combos,
+                                (self.centros_dict, self.aulas_dict, self.estudiantes_dict)):
+            combo['values'] = [""] + list(names.keys())
+        
+        if not document:
+            return
+        for var, names, owner_id in ((self.centro_var, self.centros_dict, document['centro_id']),
+                                     (self.aula_var, self.aulas_dict, document['aula_id']),
+                                     (self.estudiante_var, self.estudiantes_dict,
+                                      document['estudiante_id'])):
+            for name, item_id in names.items():
+                if item_id == owner_id:
+                    var.set(name)
+    
+    def save(self):
+        """Guardar el propietario"""
+        db_executor.run_in_background(
+            self.dialog, document_index.set_owner, self.document_id,
+            self.centros_dict.get(self.centro_var.get()),
+            self.aulas_dict.get(self.aula_var.get()),
+            self.estudiantes_dict.get(self.estudiante_var.get()),
+            write=True, on_success=lambda _: self.dialog.destroy(),
+            on_error=lambda e: messagebox.showerror("Error", f"Error al asignar documento: {str(e)}"))
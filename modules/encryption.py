@@ -4,104 +4,655 @@ Módulo de encriptación para Cordiax
 Maneja la encriptación de la base de datos
 """
 
+import io
 import os
+import hmac
+import hashlib
+import struct
 from pathlib import Path
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 from cryptography.fernet import Fernet
 import base64
 
+# Formatos de archivo encriptado:
+#   v0: salt (16) | token Fernet                      (sin cabecera, se migra al escribir)
+#   v1: cabecera | token Fernet                       (se migra al escribir)
+#   v2: cabecera | tamaño de bloque (4) | bloques     (se migra al escribir)
+#   v3: cabecera | tamaño de bloque (4) | registro de guardado | bloques (actual)
+#
+# Cabecera: magic (6) | versión (1) | KDF (1) | iteraciones (4) | longitud del salt (1) | salt
+#
+# Desde v2 los datos se dividen en bloques de tamaño fijo (el último puede ser
+# menor) y cada uno se guarda como nonce (12) | datos AES-256-GCM | etiqueta (16).
+# Los datos autenticados de cada bloque son la cabecera, su índice y si es el
+# último, así que no se pueden reordenar ni cambiar de sitio. Eso no basta
+# para detectar un bloque sustituido por el mismo bloque de un guardado
+# anterior (o de una copia con el mismo salt): en v3 el registro de guardado
+# -- generación (8) | nº de bloques (8) | nonce (12) | SHA-256 de las
+# etiquetas de todos los bloques, encriptado (32 + 16) -- fija qué bloques
+# forman el archivo, y cada guardado lo vuelve a sellar con la generación
+# siguiente. Sustituir el archivo completo por una versión anterior no se
+# puede detectar desde el propio archivo. Se encripta y desencripta bloque a
+# bloque, con memoria constante.
+MAGIC = b"CDXENC"
+SQLITE_MAGIC = b"SQLite format 3\x00"
+# Inicio de todo token Fernet: versión 0x80 y marca de tiempo, en base64
+FERNET_TOKEN_PREFIX = b"gAAAAA"
+FORMAT_FERNET_LEGACY = 0
+FORMAT_FERNET = 1
+FORMAT_CHUNKED = 2
+FORMAT_COMMITTED = 3
+FORMAT_VERSION = FORMAT_COMMITTED
+KDF_PBKDF2_SHA256 = 1
+KDF_ITERATIONS = 100000
+SALT_SIZE = 16
+CHUNK_SIZE = 1024 * 1024
+# Bloques pequeños (4 páginas de SQLite) para el almacén que se actualiza por partes
+PAGE_CHUNK_SIZE = 16 * 1024
+NONCE_SIZE = 12
+TAG_SIZE = 16
+_HEADER = struct.Struct(">6sBBIB")
+_CHUNK_SIZE_FIELD = struct.Struct(">I")
+_CHUNK_AAD = struct.Struct(">QB")
+_COMMIT_FIELDS = struct.Struct(">QQ")
+COMMIT_SIZE = _COMMIT_FIELDS.size + NONCE_SIZE + hashlib.sha256().digest_size + TAG_SIZE
 
-def derive_key(password: str, salt: bytes) -> bytes:
+# Diario de EncryptedPageStore: magic | longitud final (8) | nº de bloques (4)
+# | registro de guardado anterior | registro nuevo | por bloque: índice (8) |
+# longitud (4) | bloque encriptado | SHA-256 del total. Solo se aplica sobre
+# el archivo cuyo registro es uno de los dos.
+JOURNAL_MAGIC = b"CDXJNL2"
+_JOURNAL_HEADER = struct.Struct(">7sQI")
+_JOURNAL_ENTRY = struct.Struct(">QI")
+# Diario de los archivos v2, sin registro de guardado
+JOURNAL_MAGIC_V2 = b"CDXJNL1"
+
+# Estado de la marca de encriptación por directorio de datos
+_encryption_enabled = {}
+
+
+class SessionKey:
+    """Clave derivada de una contraseña, reutilizable durante la sesión
+    
+    Guarda el salt y los parámetros del KDF con los que se derivó, de modo
+    que se puede encriptar y desencriptar sin volver a ejecutar PBKDF2.
+    """
+    
+    def __init__(self, key: bytes, salt: bytes, iterations: int = KDF_ITERATIONS):
+        self.key = key
+        self.salt = salt
+        self.iterations = iterations
+    
+    def matches(self, salt: bytes, iterations: int) -> bool:
+        """Comprobar si la clave sirve para un archivo con estos parámetros"""
+        return self.salt == salt and self.iterations == iterations
+
+
+class EncryptionHeader:
+    """Parámetros leídos de la cabecera de un archivo encriptado"""
+    
+    def __init__(self, version, salt, iterations, data_offset, chunk_size=None, raw=b"",
+                 commit=b""):
+        self.version = version
+        self.salt = salt
+        self.iterations = iterations
+        self.data_offset = data_offset
+        self.chunk_size = chunk_size
+        self.raw = raw
+        self.commit = commit
+    
+    @property
+    def generation(self) -> int:
+        """Número de guardado del registro (0 en los formatos sin registro)"""
+        return _COMMIT_FIELDS.unpack_from(self.commit)[0] if self.commit else 0
+
+
+def derive_key(password: str, salt: bytes, iterations: int = KDF_ITERATIONS) -> bytes:
     """Derivar clave de encriptación desde contraseña"""
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
         salt=salt,
-        iterations=100000,
+        iterations=iterations,
         backend=default_backend()
     )
     key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
     return key
 
 
-def encrypt_file(file_path: Path, password: str) -> bool:
-    """Encriptar archivo de base de datos"""
+def _aead(key: bytes) -> AESGCM:
+    """Obtener el cifrador AES-GCM para una clave derivada
+    
+    Se deriva una subclave propia para no usar el mismo material que Fernet.
+    """
+    raw_key = base64.urlsafe_b64decode(key)
+    return AESGCM(hmac.new(raw_key, b"cordiax-aes-256-gcm", hashlib.sha256).digest())
+
+
+def _read_header_from(f) -> EncryptionHeader:
+    """Leer la cabecera desde un archivo abierto, dejándolo al inicio de los datos
+    
+    Lanza ValueError si el archivo no es un archivo encriptado de Cordiax, si
+    la cabecera está truncada o si usa un formato no soportado.
+    """
+    prefix = f.read(_HEADER.size)
+    if prefix.startswith(MAGIC):
+        if len(prefix) < _HEADER.size:
+            raise ValueError("Cabecera de encriptación truncada")
+        _, version, kdf, iterations, salt_len = _HEADER.unpack(prefix)
+        if (version not in (FORMAT_FERNET, FORMAT_CHUNKED, FORMAT_COMMITTED)
+                or kdf != KDF_PBKDF2_SHA256):
+            raise ValueError(f"Formato de encriptación no soportado: v{version}, KDF {kdf}")
+        salt = f.read(salt_len)
+        raw = prefix + salt
+        chunk_size = None
+        commit = b""
+        if version != FORMAT_FERNET:
+            field = f.read(_CHUNK_SIZE_FIELD.size)
+            raw += field
+            if len(field) == _CHUNK_SIZE_FIELD.size:
+                chunk_size = _CHUNK_SIZE_FIELD.unpack(field)[0]
+        if version == FORMAT_COMMITTED:
+            commit = f.read(COMMIT_SIZE)
+        if not salt_len or len(salt) < salt_len or chunk_size == 0 or (
+                version != FORMAT_FERNET and chunk_size is None) or (
+                version == FORMAT_COMMITTED and len(commit) < COMMIT_SIZE):
+            raise ValueError("Cabecera de encriptación truncada o no válida")
+        return EncryptionHeader(version, salt, iterations, len(raw) + len(commit),
+                                chunk_size, raw, commit)
+    
+    # Formato original: el archivo empieza directamente por el salt, seguido
+    # del token Fernet
+    f.seek(0)
+    salt = f.read(SALT_SIZE)
+    if f.read(len(FERNET_TOKEN_PREFIX)) != FERNET_TOKEN_PREFIX:
+        raise ValueError("El archivo no está encriptado con Cordiax")
+    f.seek(SALT_SIZE)
+    return EncryptionHeader(FORMAT_FERNET_LEGACY, salt, KDF_ITERATIONS, SALT_SIZE)
+
+
+def read_header(file_path: Path) -> EncryptionHeader:
+    """Leer los parámetros de encriptación de un archivo encriptado"""
+    with open(file_path, 'rb') as f:
+        return _read_header_from(f)
+
+
+def _build_header(salt: bytes, iterations: int, chunk_size: int = CHUNK_SIZE) -> bytes:
+    """Construir la cabecera de un archivo encriptado en el formato actual
+    
+    No incluye el registro de guardado, que va a continuación.
+    """
+    return (_HEADER.pack(MAGIC, FORMAT_COMMITTED, KDF_PBKDF2_SHA256, iterations, len(salt))
+            + salt + _CHUNK_SIZE_FIELD.pack(chunk_size))
+
+
+def get_format_version(file_path: Path) -> int:
+    """Obtener la versión del formato de un archivo encriptado"""
+    return read_header(file_path).version
+
+
+def needs_migration(file_path: Path) -> bool:
+    """Comprobar si un archivo encriptado usa un formato anterior al actual"""
+    return is_encrypted(file_path) and get_format_version(file_path) < FORMAT_VERSION
+
+
+def create_session_key(password: str, file_path: Path = None) -> SessionKey:
+    """Derivar una sola vez la clave de sesión a partir de la contraseña
+    
+    Si file_path ya está encriptado se reutilizan su salt y sus parámetros,
+    para que la clave sirva directamente para desencriptarlo.
+    """
+    if file_path is not None and is_encrypted(file_path):
+        header = read_header(file_path)
+        salt, iterations = header.salt, header.iterations
+    else:
+        salt, iterations = os.urandom(SALT_SIZE), KDF_ITERATIONS
+    
+    return SessionKey(derive_key(password, salt, iterations), salt, iterations)
+
+
+def _resolve_key(secret, salt: bytes, iterations: int) -> bytes:
+    """Obtener la clave para un salt dado a partir de una contraseña o clave de sesión"""
+    if isinstance(secret, SessionKey):
+        if not secret.matches(salt, iterations):
+            raise ValueError("La clave de sesión no corresponde a este archivo")
+        return secret.key
+    return derive_key(secret, salt, iterations)
+
+
+def _key_material(secret):
+    """Obtener salt, iteraciones y clave con los que encriptar"""
+    if isinstance(secret, SessionKey):
+        return secret.salt, secret.iterations, secret.key
+    # Generar salt aleatorio y derivar clave
+    salt = os.urandom(SALT_SIZE)
+    return salt, KDF_ITERATIONS, derive_key(secret, salt, KDF_ITERATIONS)
+
+
+def _seal_chunk(aead, header_raw, index, chunk, final) -> bytes:
+    """Encriptar un bloque con un nonce nuevo"""
+    nonce = os.urandom(NONCE_SIZE)
+    aad = header_raw + _CHUNK_AAD.pack(index, final)
+    return nonce + aead.encrypt(nonce, chunk, aad)
+
+
+def _open_chunk(aead, header_raw, index, record, final) -> bytes:
+    """Desencriptar y autenticar un bloque"""
+    if len(record) < NONCE_SIZE + TAG_SIZE:
+        raise ValueError("Archivo encriptado truncado")
+    aad = header_raw + _CHUNK_AAD.pack(index, final)
+    return aead.decrypt(record[:NONCE_SIZE], record[NONCE_SIZE:], aad)
+
+
+def _seal_commit(aead, header_raw, generation, tags) -> bytes:
+    """Sellar el registro de guardado: generación, nº de bloques y sus etiquetas"""
+    fields = _COMMIT_FIELDS.pack(generation, len(tags))
+    nonce = os.urandom(NONCE_SIZE)
+    digest = hashlib.sha256(b"".join(tags)).digest()
+    return fields + nonce + aead.encrypt(nonce, digest, header_raw + fields)
+
+
+def _open_commit(aead, header):
+    """Autenticar el registro de guardado; devuelve (nº de bloques, resumen de etiquetas)"""
+    commit = header.commit
+    fields = commit[:_COMMIT_FIELDS.size]
+    nonce = commit[_COMMIT_FIELDS.size:_COMMIT_FIELDS.size + NONCE_SIZE]
+    digest = aead.decrypt(nonce, commit[_COMMIT_FIELDS.size + NONCE_SIZE:],
+                          header.raw + fields)
+    return _COMMIT_FIELDS.unpack(fields)[1], digest
+
+
+def _iter_file_chunks(f, chunk_size):
+    """Leer un archivo en bloques de chunk_size bytes"""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_memory_chunks(data, chunk_size):
+    """Recorrer datos en memoria en bloques, sin copiarlos"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def _write_encrypted(chunks, out, secret, chunk_size=CHUNK_SIZE, generation=1):
+    """Escribir en out la cabecera y los bloques encriptados de chunks
+    
+    El registro de guardado se escribe al final, en su hueco tras la
+    cabecera. Devuelve las etiquetas de los bloques.
+    """
+    salt, iterations, key = _key_material(secret)
+    header_raw = _build_header(salt, iterations, chunk_size)
+    aead = _aead(key)
+    out.write(header_raw)
+    out.write(bytes(COMMIT_SIZE))
+    
+    # Se retiene un bloque para saber cuál es el último
+    tags = []
+    index = 0
+    pending = next(chunks, b"")
+    for chunk in chunks:
+        record = _seal_chunk(aead, header_raw, index, pending, False)
+        out.write(record)
+        tags.append(record[-TAG_SIZE:])
+        pending = chunk
+        index += 1
+    record = _seal_chunk(aead, header_raw, index, pending, True)
+    out.write(record)
+    tags.append(record[-TAG_SIZE:])
+    
+    out.seek(len(header_raw))
+    out.write(_seal_commit(aead, header_raw, generation, tags))
+    out.seek(0, os.SEEK_END)
+    return tags
+
+
+def _iter_decrypted(f, header, secret, tags=None):
+    """Desencriptar bloque a bloque un archivo v2 o v3 abierto tras su cabecera
+    
+    En v3 los bloques se comprueban contra el registro de guardado; la
+    comprobación termina con el último bloque, así que quien consume los
+    datos no debe darlos por buenos hasta agotar el iterador. Si se pasa
+    tags, se le añaden las etiquetas de los bloques.
+    """
+    aead = _aead(_resolve_key(secret, header.salt, header.iterations))
+    record_size = NONCE_SIZE + header.chunk_size + TAG_SIZE
+    committed = header.version == FORMAT_COMMITTED
+    if committed:
+        count, digest = _open_commit(aead, header)
+        tags_hash = hashlib.sha256()
+    
+    index = 0
+    record = f.read(record_size)
+    while True:
+        following = f.read(record_size) if len(record) == record_size else b""
+        final = not following
+        yield _open_chunk(aead, header.raw, index, record, final)
+        tag = record[-TAG_SIZE:]
+        if tags is not None:
+            tags.append(tag)
+        if committed:
+            tags_hash.update(tag)
+            if index >= count or (final and (index + 1 != count
+                                              or tags_hash.digest() != digest)):
+                raise ValueError("Los bloques no corresponden al último guardado del archivo")
+        if final:
+            return
+        record = following
+        index += 1
+
+
+def _decrypt_fernet(f, header, secret) -> bytes:
+    """Desencriptar un archivo de los formatos Fernet anteriores"""
+    f.seek(header.data_offset)
+    key = _resolve_key(secret, header.salt, header.iterations)
+    return Fernet(key).decrypt(f.read())
+
+
+def _replace_atomically(file_path: Path, suffix, write):
+    """Escribir un archivo nuevo junto a file_path y sustituirlo al terminar"""
+    tmp_path = Path(str(file_path) + suffix)
+    try:
+        with open(tmp_path, 'wb') as out:
+            write(out)
+            out.flush()
+            os.fsync(out.fileno())
+        tmp_path.replace(file_path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+
+def encrypt_bytes(data: bytes, file_path: Path, secret, chunk_size: int = CHUNK_SIZE,
+                  generation: int = 1):
+    """Encriptar datos en memoria y guardarlos en file_path
+    
+    El archivo se escribe primero en un temporal y luego se sustituye, de
+    modo que nunca queda a medias. Los datos en claro no se escriben a disco.
+    Devuelve las etiquetas de los bloques escritos.
+    """
+    tags = []
+    _replace_atomically(file_path, '.encrypted', lambda out: tags.extend(_write_encrypted(
+        _iter_memory_chunks(data, chunk_size), out, secret, chunk_size, generation)))
+    return tags
+
+
+def _decrypt_from(f, secret) -> bytes:
+    """Desencriptar en memoria un archivo encriptado abierto al inicio"""
+    header = _read_header_from(f)
+    if header.version == FORMAT_FERNET_LEGACY or header.version == FORMAT_FERNET:
+        return _decrypt_fernet(f, header, secret)
+    
+    data = bytearray()
+    for chunk in _iter_decrypted(f, header, secret):
+        data += chunk
+    return data
+
+
+def decrypt_bytes(file_path: Path, secret) -> bytes:
+    """Leer un archivo encriptado y devolver su contenido en claro, en memoria"""
+    with open(file_path, 'rb') as f:
+        return _decrypt_from(f, secret)
+
+
+def decrypt_data(data: bytes, secret) -> bytes:
+    """Desencriptar el contenido ya leído de un archivo encriptado (p. ej. de un backup)"""
+    return _decrypt_from(io.BytesIO(data), secret)
+
+
+def encrypt_file(file_path: Path, secret) -> bool:
+    """Encriptar archivo de base de datos
+    
+    secret puede ser la contraseña o una SessionKey; con la clave de sesión
+    no se vuelve a derivar la clave. El archivo se procesa por bloques.
+    """
     try:
-        # Generar salt aleatorio
-        salt = os.urandom(16)
-        
-        # Derivar clave
-        key = derive_key(password, salt)
-        fernet = Fernet(key)
-        
-        # Leer archivo original
         with open(file_path, 'rb') as f:
-            data = f.read()
-        
-        # Encriptar datos
-        encrypted_data = fernet.encrypt(data)
-        
-        # Guardar archivo encriptado (salt + datos encriptados)
-        encrypted_path = Path(str(file_path) + '.encrypted')
-        with open(encrypted_path, 'wb') as f:
-            f.write(salt)
-            f.write(encrypted_data)
-        
-        # Reemplazar archivo original con el encriptado
-        encrypted_path.replace(file_path)
-        
+            _replace_atomically(file_path, '.encrypted', lambda out: _write_encrypted(
+                _iter_file_chunks(f, CHUNK_SIZE), out, secret))
         return True
     except Exception as e:
         print(f"Error al encriptar archivo: {e}")
         return False
 
 
-def decrypt_file(file_path: Path, password: str) -> bool:
-    """Desencriptar archivo de base de datos"""
-    try:
-        # Leer archivo encriptado
+def decrypt_file(file_path: Path, secret) -> bool:
+    """Desencriptar archivo de base de datos
+    
+    secret puede ser la contraseña o una SessionKey. Los archivos del formato
+    actual se procesan por bloques; los de formatos Fernet, de una vez.
+    """
+    def write_plain(out):
         with open(file_path, 'rb') as f:
-            salt = f.read(16)
-            encrypted_data = f.read()
+            header = _read_header_from(f)
+            if header.version == FORMAT_FERNET_LEGACY or header.version == FORMAT_FERNET:
+                out.write(_decrypt_fernet(f, header, secret))
+                return
+            for chunk in _iter_decrypted(f, header, secret):
+                out.write(chunk)
+    
+    try:
+        _replace_atomically(file_path, '.decrypted', write_plain)
+        return True
+    except Exception as e:
+        print(f"Error al desencriptar archivo: {e}")
+        return False
+
+
+def migrate_file(file_path: Path, secret) -> bool:
+    """Reescribir un archivo encriptado en un formato anterior en el actual"""
+    if not needs_migration(file_path):
+        return False
+    
+    data = decrypt_bytes(file_path, secret)
+    encrypt_bytes(data, file_path, secret)
+    return True
+
+
+class EncryptedPageStore:
+    """Archivo encriptado v3 que se actualiza bloque a bloque
+    
+    Recuerda un resumen (BLAKE2b) y la etiqueta de cada bloque guardado; al
+    guardar una nueva imagen de la base de datos solo se vuelven a encriptar
+    y escribir los bloques que han cambiado, junto con el registro de
+    guardado de la generación siguiente. Los bloques nuevos se escriben
+    primero en un diario (ya encriptados) y después en su sitio, así que una
+    interrupción a mitad deja el archivo anterior o el nuevo, nunca una
+    mezcla. El diario lleva los registros de guardado de antes y de después:
+    sobre otro archivo (p. ej. uno restaurado de una copia) no se aplica.
+    Los datos en claro nunca se escriben a disco.
+    """
+    
+    def __init__(self, file_path: Path, secret, chunk_size: int = PAGE_CHUNK_SIZE):
+        self.file_path = Path(file_path)
+        # No usar el sufijo "-journal": SQLite lo tomaría por su propio diario
+        self.journal_path = Path(str(file_path) + '.pagejournal')
+        self.secret = secret
+        self.chunk_size = chunk_size
+        self.header = None
+        self.digests = None
+        self.tags = None
+        self.generation = 0
+        self.last_written_bytes = 0
+    
+    def _digest(self, chunk) -> bytes:
+        """Resumen de un bloque en claro para detectar cambios"""
+        return hashlib.blake2b(chunk, digest_size=16).digest()
+    
+    def _record_offset(self, index) -> int:
+        """Posición en el archivo del bloque encriptado index"""
+        return self.header.data_offset + index * (NONCE_SIZE + self.header.chunk_size + TAG_SIZE)
+    
+    def load(self) -> bytes:
+        """Desencriptar el archivo completo y recordar el estado de sus bloques"""
+        self.recover()
+        self.header, self.digests, self.tags = None, None, None
+        with open(self.file_path, 'rb') as f:
+            header = _read_header_from(f)
+            self.generation = header.generation
+            if header.version == FORMAT_FERNET_LEGACY or header.version == FORMAT_FERNET:
+                return _decrypt_fernet(f, header, self.secret)
+            
+            data = bytearray()
+            digests = []
+            tags = []
+            for chunk in _iter_decrypted(f, header, self.secret, tags):
+                data += chunk
+                digests.append(self._digest(chunk))
         
-        # Derivar clave
-        key = derive_key(password, salt)
-        fernet = Fernet(key)
+        # Un archivo v2 o con otro tamaño de bloque se reescribe entero en el
+        # primer guardado
+        if header.version == FORMAT_COMMITTED and header.chunk_size == self.chunk_size:
+            self.header, self.digests, self.tags = header, digests, tags
+        return data
+    
+    def save(self, data) -> int:
+        """Guardar una nueva imagen, re-encriptando solo los bloques modificados
         
-        # Desencriptar datos
-        decrypted_data = fernet.decrypt(encrypted_data)
+        Devuelve el número de bloques escritos.
+        """
+        chunks = list(_iter_memory_chunks(data, self.chunk_size)) or [memoryview(b"")]
+        digests = [self._digest(chunk) for chunk in chunks]
         
-        # Guardar archivo desencriptado temporalmente
-        decrypted_path = Path(str(file_path) + '.decrypted')
-        with open(decrypted_path, 'wb') as f:
-            f.write(decrypted_data)
+        if self.header is None or self.digests is None or not self.file_path.exists():
+            self.tags = encrypt_bytes(data, self.file_path, self.secret, self.chunk_size,
+                                      self.generation + 1)
+            self.header = read_header(self.file_path)
+            self.generation = self.header.generation
+            self.digests = digests
+            self.last_written_bytes = len(data)
+            return len(chunks)
         
-        # Reemplazar archivo encriptado con el desencriptado
-        decrypted_path.replace(file_path)
+        old_count, new_count = len(self.digests), len(chunks)
+        dirty = {i for i in range(new_count)
+                 if i >= old_count or digests[i] != self.digests[i]}
+        if new_count != old_count:
+            # Cambia cuál es el último bloque: hay que volver a sellar ambos
+            dirty.add(new_count - 1)
+            if old_count - 1 < new_count:
+                dirty.add(old_count - 1)
         
-        return True
-    except Exception as e:
-        print(f"Error al desencriptar archivo: {e}")
-        return False
+        if dirty:
+            aead = _aead(_resolve_key(self.secret, self.header.salt, self.header.iterations))
+            records = [(i, _seal_chunk(aead, self.header.raw, i, chunks[i], i == new_count - 1))
+                       for i in sorted(dirty)]
+            tags = self.tags[:new_count] + [None] * (new_count - len(self.tags))
+            for index, record in records:
+                tags[index] = record[-TAG_SIZE:]
+            commit = _seal_commit(aead, self.header.raw, self.generation + 1, tags)
+            final_length = (self._record_offset(new_count - 1)
+                            + NONCE_SIZE + len(chunks[-1]) + TAG_SIZE)
+            self._write_journal(records, final_length, self.header.commit, commit)
+            self._apply(records, final_length, commit)
+            self.journal_path.unlink()
+            
+            self.header.commit = commit
+            self.generation = self.header.generation
+            self.tags = tags
+        
+        self.digests = digests
+        self.last_written_bytes = sum(len(chunks[i]) for i in dirty)
+        return len(dirty)
+    
+    def _write_journal(self, records, final_length, base_commit, commit):
+        """Guardar en el diario los bloques encriptados antes de aplicarlos"""
+        body = bytearray(_JOURNAL_HEADER.pack(JOURNAL_MAGIC, final_length, len(records)))
+        body += base_commit + commit
+        for index, record in records:
+            body += _JOURNAL_ENTRY.pack(index, len(record))
+            body += record
+        body += hashlib.sha256(body).digest()
+        
+        with open(self.journal_path, 'wb') as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _apply(self, records, final_length, commit=None):
+        """Escribir los bloques y el registro de guardado en su posición"""
+        with open(self.file_path, 'r+b') as f:
+            for index, record in records:
+                f.seek(self._record_offset(index))
+                f.write(record)
+            if commit is not None:
+                f.seek(self.header.data_offset - COMMIT_SIZE)
+                f.write(commit)
+            f.truncate(final_length)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def recover(self):
+        """Completar un guardado interrumpido a partir del diario, si existe
+        
+        Un diario incompleto se descarta: el archivo no llegó a modificarse.
+        También se descarta si el archivo no está en el guardado del que
+        parte el diario (ni en el que completa), por ejemplo porque se ha
+        restaurado desde una copia.
+        """
+        if not self.journal_path.exists():
+            return
+        
+        body = self.journal_path.read_bytes()
+        payload, checksum = body[:-32], body[-32:]
+        if (len(body) < _JOURNAL_HEADER.size + 32
+                or hashlib.sha256(payload).digest() != checksum):
+            self.journal_path.unlink()
+            return
+        
+        magic, final_length, count = _JOURNAL_HEADER.unpack_from(payload)
+        header = read_header(self.file_path)
+        pos = _JOURNAL_HEADER.size
+        commit = None
+        if magic == JOURNAL_MAGIC and header.version == FORMAT_COMMITTED:
+            base_commit = payload[pos:pos + COMMIT_SIZE]
+            commit = payload[pos + COMMIT_SIZE:pos + 2 * COMMIT_SIZE]
+            pos += 2 * COMMIT_SIZE
+            if header.commit not in (base_commit, commit):
+                self.journal_path.unlink()
+                return
+        elif not (magic == JOURNAL_MAGIC_V2 and header.version == FORMAT_CHUNKED):
+            self.journal_path.unlink()
+            return
+        
+        records = []
+        for _ in range(count):
+            index, length = _JOURNAL_ENTRY.unpack_from(payload, pos)
+            pos += _JOURNAL_ENTRY.size
+            records.append((index, payload[pos:pos + length]))
+            pos += length
+        
+        self.header = header
+        self._apply(records, final_length, commit)
+        self.journal_path.unlink()
 
 
 def is_encrypted(file_path: Path) -> bool:
-    """Verificar si un archivo está encriptado"""
-    if not file_path.exists():
-        return False
+    """Verificar si un archivo está encriptado
     
+    Solo se lee la cabecera: un archivo encriptado empieza por la cabecera de
+    Cordiax (o, en el formato original sin cabecera, por un salt aleatorio
+    seguido de un token Fernet). Cualquier otro contenido (una base de datos
+    SQLite, un archivo vacío o ajeno) no se considera encriptado. Lanza
+    ValueError si la cabecera de Cordiax está truncada o es de un formato no
+    soportado.
+    """
     try:
-        # Intentar abrir como base de datos SQLite
-        import sqlite3
-        conn = sqlite3.connect(str(file_path))
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1")
-        conn.close()
-        return False  # Si se puede abrir, no está encriptado
-    except:
-        return True  # Si no se puede abrir, probablemente está encriptado
+        with open(file_path, 'rb') as f:
+            prefix = f.read(SALT_SIZE + len(FERNET_TOKEN_PREFIX))
+            if not prefix.startswith(MAGIC):
+                return prefix[SALT_SIZE:] == FERNET_TOKEN_PREFIX
+            f.seek(0)
+            _read_header_from(f)
+    except FileNotFoundError:
+        return False
+    return True
 
 
 def get_encryption_key_file(user_data_dir: Path) -> Path:
@@ -110,13 +661,22 @@ def get_encryption_key_file(user_data_dir: Path) -> Path:
 
 
 def is_encryption_enabled(user_data_dir: Path) -> bool:
-    """Verificar si la encriptación está habilitada"""
-    return get_encryption_key_file(user_data_dir).exists()
+    """Verificar si la encriptación está habilitada
+    
+    El resultado se guarda en memoria: se consulta en cada operación de base
+    de datos y solo cambia a través de enable_encryption/disable_encryption.
+    """
+    enabled = _encryption_enabled.get(user_data_dir)
+    if enabled is None:
+        enabled = get_encryption_key_file(user_data_dir).exists()
+        _encryption_enabled[user_data_dir] = enabled
+    return enabled
 
 
 def enable_encryption(user_data_dir: Path):
     """Marcar la encriptación como habilitada"""
     get_encryption_key_file(user_data_dir).touch()
+    _encryption_enabled[user_data_dir] = True
 
 
 def disable_encryption(user_data_dir: Path):
@@ -124,3 +684,4 @@ def disable_encryption(user_data_dir: Path):
     key_file = get_encryption_key_file(user_data_dir)
     if key_file.exists():
         key_file.unlink()
+    _encryption_enabled[user_data_dir] = False
@@ -6,7 +6,8 @@ Gestión CRUD de materiales con control de inventario
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from modules import database
+from modules import db_executor
+from modules.virtual_table import VirtualTable
 import os
 import sys
 
@@ -49,8 +50,8 @@ class MaterialsModule:
         
         # Treeview
         columns = ("ID", "Nombre", "Categoría", "Cantidad", "Mínimo", "Unidad", "Estado")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -73,18 +74,17 @@ class MaterialsModule:
         
     def load_materials(self):
         """Cargar materiales desde la base de datos"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
         # Obtener materiales
-        materials = database.fetch_all("""
+        db_executor.deliver(self.tree, db_executor.fetch_all("""
             SELECT id, nombre, categoria, cantidad, cantidad_minima, unidad 
             FROM materiales 
             ORDER BY nombre
-        """)
-        
-        # Agregar a tabla
+        """), self.show_materials)
+    
+    def show_materials(self, materials):
+        """Mostrar los materiales en la tabla"""
+        # Actualizar la tabla con solo las diferencias
+        rows = []
         for material in materials:
             cantidad = material['cantidad'] or 0
             minimo = material['cantidad_minima'] or 0
@@ -96,7 +96,7 @@ class MaterialsModule:
                 estado = "✓ Normal"
                 tag = "normal"
             
-            self.tree.insert("", tk.END, values=(
+            rows.append((material['id'], (
                 material['id'],
                 material['nombre'],
                 material['categoria'] or "",
@@ -104,7 +104,9 @@ class MaterialsModule:
                 minimo,
                 material['unidad'] or "",
                 estado
-            ), tags=(tag,))
+            ), (tag,)))
+        
+        db_executor.reconcile(self.tree, rows)
     
     def new_material(self):
         """Crear nuevo material"""
@@ -135,9 +137,15 @@ class MaterialsModule:
         
         if messagebox.askyesno("Confirmar", 
                               f"¿Está seguro de eliminar {material_name}?"):
-            database.execute_query("DELETE FROM materiales WHERE id = ?", (material_id,))
-            self.load_materials()
-            messagebox.showinfo("Éxito", "Material eliminado correctamente")
+            def deleted(_):
+                self.load_materials()
+                messagebox.showinfo("Éxito", "Material eliminado correctamente")
+            
+            db_executor.deliver(
+                self.tree,
+                db_executor.execute_query("DELETE FROM materiales WHERE id = ?", (material_id,)),
+                deleted,
+                lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
 
 
 class MaterialDialog:
@@ -228,10 +236,12 @@ class MaterialDialog:
     
     def load_material_data(self):
         """Cargar datos del material"""
-        material = database.fetch_one(
+        db_executor.deliver(self.dialog, db_executor.fetch_one(
             "SELECT * FROM materiales WHERE id = ?", (self.material_id,)
-        )
-        
+        ), self.show_material_data)
+    
+    def show_material_data(self, material):
+        """Mostrar los datos del material en el formulario"""
         if material:
             self.nombre_var.set(material['nombre'])
             self.categoria_var.set(material['categoria'] or "")
@@ -247,32 +257,40 @@ class MaterialDialog:
             return
         
         try:
-            if self.material_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE materiales 
-                    SET nombre=?, categoria=?, cantidad=?, cantidad_minima=?, 
-                        unidad=?, notas=?
-                    WHERE id=?
-                """, (self.nombre_var.get(), self.categoria_var.get() or None,
-                     self.cantidad_var.get(), self.minimo_var.get(),
-                     self.unidad_var.get() or None,
-                     self.notas_text.get("1.0", tk.END).strip() or None,
-                     self.material_id))
-            else:
-                # Crear nuevo
-                database.execute_query("""
-                    INSERT INTO materiales 
-                    (nombre, categoria, cantidad, cantidad_minima, unidad, notas)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (self.nombre_var.get(), self.categoria_var.get() or None,
-                     self.cantidad_var.get(), self.minimo_var.get(),
-                     self.unidad_var.get() or None,
-                     self.notas_text.get("1.0", tk.END).strip() or None))
-            
-            messagebox.showinfo("Éxito", "Material guardado correctamente")
-            self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+            cantidad = self.cantidad_var.get()
+            minimo = self.minimo_var.get()
+        except tk.TclError:
+            messagebox.showerror("Error", "La cantidad y el mínimo deben ser números")
+            return
+        
+        if self.material_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE materiales 
+                SET nombre=?, categoria=?, cantidad=?, cantidad_minima=?, 
+                    unidad=?, notas=?
+                WHERE id=?
+            """, (self.nombre_var.get(), self.categoria_var.get() or None,
+                 cantidad, minimo,
+                 self.unidad_var.get() or None,
+                 self.notas_text.get("1.0", tk.END).strip() or None,
+                 self.material_id))
+        else:
+            # Crear nuevo
+            future = db_executor.execute_query("""
+                INSERT INTO materiales 
+                (nombre, categoria, cantidad, cantidad_minima, unidad, notas)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (self.nombre_var.get(), self.categoria_var.get() or None,
+                 cantidad, minimo,
+                 self.unidad_var.get() or None,
+                 self.notas_text.get("1.0", tk.END).strip() or None))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardado el material"""
+        messagebox.showinfo("Éxito", "Material guardado correctamente")
+        self.callback()
+        self.dialog.destroy()
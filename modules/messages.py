@@ -6,7 +6,8 @@ Sistema de mensajes internos para estudiantes
 
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
-from modules import database
+from modules import db_executor
+from modules.virtual_table import VirtualTable
 from datetime import datetime
 import os
 import sys
@@ -20,6 +21,9 @@ class MessagesModule:
         self.setup_ui()
         self.load_messages()
         
+        # Aplicar los cambios de otras ventanas sin recargar la lista
+        db_executor.watch(self.tree, self.on_data_changed, ("mensajes", "estudiantes"))
+        
     def setup_ui(self):
         """Configurar la interfaz"""
         # Título
@@ -65,8 +69,8 @@ class MessagesModule:
         
         # Treeview
         columns = ("ID", "Estudiante", "Asunto", "Fecha", "Leído")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -81,53 +85,87 @@ class MessagesModule:
         
         self.tree.pack(fill=tk.BOTH, expand=True)
         
+        # Los mensajes se cargan por páginas, los más recientes primero
+        self.pages = db_executor.PagedLoader(self.tree, scrollbar, self.message_item,
+                                             (("fecha", "DESC"), ("id", "DESC")))
+        
         # Configurar etiquetas para mensajes no leídos
         self.tree.tag_configure("unread", background="#ffffcc", font=("Arial", 10, "bold"))
         
         # Doble clic para ver mensaje
         self.tree.bind("<Double-1>", lambda e: self.view_message())
         
-    def load_messages(self):
-        """Cargar mensajes desde la base de datos"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Construir query según filtro
+    def build_query(self, row_ids=None):
+        """Construir la consulta de mensajes según el filtro"""
         filter_type = self.filter_var.get()
         
+        conditions = []
+        params = []
         if filter_type == "No Leídos":
-            where_clause = "WHERE m.leido = 0"
+            conditions.append("m.leido = 0")
         elif filter_type == "Leídos":
-            where_clause = "WHERE m.leido = 1"
-        else:
-            where_clause = ""
+            conditions.append("m.leido = 1")
         
-        # Obtener mensajes
-        messages = database.fetch_all(f"""
+        # Solo algunas filas
+        if row_ids:
+            conditions.append(f"m.id IN ({', '.join('?' for _ in row_ids)})")
+            params.extend(row_ids)
+        
+        query = """
             SELECT m.id, e.nombre, e.apellidos, m.asunto, m.fecha, m.leido
             FROM mensajes m
             JOIN estudiantes e ON m.estudiante_id = e.id
-            {where_clause}
-            ORDER BY m.fecha DESC
-        """)
-        
-        # Agregar a tabla
-        for msg in messages:
-            leido_str = "Sí" if msg['leido'] else "No"
-            tag = "" if msg['leido'] else "unread"
-            
-            self.tree.insert("", tk.END, values=(
-                msg['id'],
-                f"{msg['nombre']} {msg['apellidos']}",
-                msg['asunto'],
-                msg['fecha'],
-                leido_str
-            ), tags=(tag,))
+        """
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        return query, tuple(params) if params else None
+    
+    def load_messages(self):
+        """Cargar mensajes desde la base de datos"""
+        # Obtener mensajes (primera página; el resto al hacer scroll)
+        query, params = self.build_query()
+        self.pages.load(query, params)
+    
+    def on_data_changed(self, table, operation, row_ids):
+        """Aplicar un cambio de la base de datos a la tabla"""
+        if table != "mensajes" or row_ids is None:
+            # Un estudiante renombrado o un cambio masivo: se recarga todo
+            self.load_messages()
+            return
+        
+        if operation == "delete":
+            db_executor.patch_rows(self.tree, row_ids, [], self.message_values)
+            return
+        
+        # Los mensajes que dejan de cumplir el filtro desaparecen de la tabla
+        query, params = self.build_query(row_ids)
+        db_executor.deliver(
+            self.tree, db_executor.fetch_all(query, params),
+            lambda rows: db_executor.patch_rows(self.tree, row_ids, rows, self.message_values,
+                                                0, self.message_tags))
+    
+    def message_values(self, msg):
+        """Valores de la fila de un mensaje en la tabla"""
+        return (
+            msg['id'],
+            f"{msg['nombre']} {msg['apellidos']}",
+            msg['asunto'],
+            msg['fecha'],
+            "Sí" if msg['leido'] else "No"
+        )
+    
+    def message_tags(self, msg):
+        """Etiquetas de la fila de un mensaje (los no leídos se resaltan)"""
+        return ("" if msg['leido'] else "unread",)
+    
+    def message_item(self, msg):
+        """Fila de un mensaje en la tabla: (iid, valores, etiquetas)"""
+        return str(msg['id']), self.message_values(msg), self.message_tags(msg)
     
     def new_message(self):
         """Crear nuevo mensaje"""
-        MessageDialog(self.parent, self.load_messages)
+        MessageDialog(self.parent)
     
     def view_message(self):
         """Ver mensaje seleccionado"""
@@ -142,8 +180,7 @@ class MessagesModule:
         ViewMessageDialog(self.parent, message_id)
         
         # Marcar como leído
-        database.execute_query("UPDATE mensajes SET leido = 1 WHERE id = ?", (message_id,))
-        self.load_messages()
+        self.set_read(message_id)
     
     def mark_read(self):
         """Marcar mensaje como leído"""
@@ -155,8 +192,14 @@ class MessagesModule:
         item = self.tree.item(selection[0])
         message_id = item['values'][0]
         
-        database.execute_query("UPDATE mensajes SET leido = 1 WHERE id = ?", (message_id,))
-        self.load_messages()
+        self.set_read(message_id)
+    
+    def set_read(self, message_id):
+        """Marcar un mensaje como leído en segundo plano"""
+        db_executor.deliver(
+            self.tree,
+            db_executor.execute_query("UPDATE mensajes SET leido = 1 WHERE id = ?", (message_id,)),
+            on_error=lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
     
     def delete_message(self):
         """Eliminar mensaje seleccionado"""
@@ -169,15 +212,17 @@ class MessagesModule:
         message_id = item['values'][0]
         
         if messagebox.askyesno("Confirmar", "¿Está seguro de eliminar este mensaje?"):
-            database.execute_query("DELETE FROM mensajes WHERE id = ?", (message_id,))
-            self.load_messages()
-            messagebox.showinfo("Éxito", "Mensaje eliminado correctamente")
+            db_executor.deliver(
+                self.tree,
+                db_executor.execute_query("DELETE FROM mensajes WHERE id = ?", (message_id,)),
+                lambda _: messagebox.showinfo("Éxito", "Mensaje eliminado correctamente"),
+                lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
 
 
 class MessageDialog:
     """Diálogo para crear mensaje"""
     
-    def __init__(self, parent, callback):
+    def __init__(self, parent, callback=None):
         self.callback = callback
         
         self.dialog = tk.Toplevel(parent)
@@ -190,6 +235,7 @@ class MessageDialog:
         self._set_icon()
         
         self.setup_ui()
+        self.load_students()
     
     def _set_icon(self):
         """Set window icon"""
@@ -216,13 +262,7 @@ class MessageDialog:
         self.student_combo = ttk.Combobox(main_frame, textvariable=self.student_var, 
                                          width=47, state="readonly")
         self.student_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
-        
-        # Cargar estudiantes
-        students = database.fetch_all(
-            "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 ORDER BY apellidos, nombre"
-        )
-        self.student_list = [(s['id'], f"{s['nombre']} {s['apellidos']}") for s in students]
-        self.student_combo['values'] = [s[1] for s in self.student_list]
+        self.student_list = []
         row += 1
         
         # Asunto
@@ -247,6 +287,16 @@ class MessageDialog:
         
         main_frame.columnconfigure(1, weight=1)
     
+    def load_students(self):
+        """Cargar estudiantes"""
+        def show(students):
+            self.student_list = [(s['id'], f"{s['nombre']} {s['apellidos']}") for s in students]
+            self.student_combo['values'] = [s[1] for s in self.student_list]
+        
+        db_executor.deliver(self.dialog, db_executor.fetch_all_cached(
+            "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 ORDER BY apellidos, nombre"
+        ), show)
+    
     def save(self):
         """Guardar mensaje"""
         if not self.student_var.get() or not self.asunto_var.get():
@@ -262,19 +312,21 @@ class MessageDialog:
         student_index = self.student_combo.current()
         student_id = self.student_list[student_index][0]
         
-        try:
-            database.execute_query("""
-                INSERT INTO mensajes 
-                (estudiante_id, asunto, mensaje, leido)
-                VALUES (?, ?, ?, 0)
-            """, (student_id, self.asunto_var.get(), mensaje))
-            
-            messagebox.showinfo("Éxito", "Mensaje guardado correctamente")
+        future = db_executor.execute_query("""
+            INSERT INTO mensajes 
+            (estudiante_id, asunto, mensaje, leido)
+            VALUES (?, ?, ?, 0)
+        """, (student_id, self.asunto_var.get(), mensaje))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardado el mensaje"""
+        messagebox.showinfo("Éxito", "Mensaje guardado correctamente")
+        if self.callback:
             self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        self.dialog.destroy()
 
 
 class ViewMessageDialog:
@@ -335,13 +387,15 @@ class ViewMessageDialog:
     
     def load_message(self):
         """Cargar datos del mensaje"""
-        msg = database.fetch_one("""
+        db_executor.deliver(self.dialog, db_executor.fetch_one("""
             SELECT m.*, e.nombre, e.apellidos
             FROM mensajes m
             JOIN estudiantes e ON m.estudiante_id = e.id
             WHERE m.id = ?
-        """, (self.message_id,))
-        
+        """, (self.message_id,)), self.show_message)
+    
+    def show_message(self, msg):
+        """Mostrar los datos del mensaje"""
         if msg:
             self.student_label.config(text=f"Estudiante: {msg['nombre']} {msg['apellidos']}")
             self.asunto_label.config(text=f"Asunto: {msg['asunto']}")
@@ -6,7 +6,8 @@ Gestión de permisos con plantilla de 3 filas y sí/no
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from modules import database
+from modules import database, db_executor
+from modules.virtual_table import VirtualTable
 from datetime import date
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
@@ -25,6 +26,9 @@ class PermissionsModule:
         self.setup_ui()
         self.load_permissions()
         
+        # Actualizar solo las filas afectadas cuando cambian los datos
+        db_executor.watch(self.tree, self.on_data_changed, ("permisos", "estudiantes"))
+        
     def setup_ui(self):
         """Configurar la interfaz"""
         # Título
@@ -57,8 +61,8 @@ class PermissionsModule:
         
         # Treeview
         columns = ("ID", "Estudiante", "Tipo", "Respuesta", "Fecha", "Notas")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -74,35 +78,67 @@ class PermissionsModule:
         
         self.tree.pack(fill=tk.BOTH, expand=True)
         
-    def load_permissions(self):
-        """Cargar permisos desde la base de datos"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        # Los permisos se cargan por páginas, los más recientes primero
+        self.pages = db_executor.PagedLoader(self.tree, scrollbar, self.permission_item,
+                                             (("fecha", "DESC"), ("id", "DESC")))
         
-        # Obtener permisos
-        permissions = database.fetch_all("""
+    def build_query(self, row_ids=None):
+        """Construir la consulta de permisos"""
+        query = """
             SELECT p.id, e.nombre, e.apellidos, p.tipo_permiso, p.respuesta, 
                    p.fecha, p.notas
             FROM permisos p
             JOIN estudiantes e ON p.estudiante_id = e.id
-            ORDER BY p.fecha DESC, e.apellidos
-        """)
+        """
+        params = []
         
-        # Agregar a tabla
-        for perm in permissions:
-            self.tree.insert("", tk.END, values=(
-                perm['id'],
-                f"{perm['nombre']} {perm['apellidos']}",
-                perm['tipo_permiso'],
-                perm['respuesta'] or "",
-                perm['fecha'] or "",
-                perm['notas'] or ""
-            ))
+        # Solo algunas filas
+        if row_ids:
+            query += f" WHERE p.id IN ({', '.join('?' for _ in row_ids)})"
+            params.extend(row_ids)
+        
+        return query, tuple(params) if params else None
+    
+    def permission_values(self, perm):
+        """Valores de la fila de un permiso en la tabla"""
+        return (
+            perm['id'],
+            f"{perm['nombre']} {perm['apellidos']}",
+            perm['tipo_permiso'],
+            perm['respuesta'] or "",
+            perm['fecha'] or "",
+            perm['notas'] or ""
+        )
+    
+    def permission_item(self, perm):
+        """Fila de un permiso en la tabla: (iid, valores, etiquetas)"""
+        return str(perm['id']), self.permission_values(perm), ()
+    
+    def load_permissions(self):
+        """Cargar permisos desde la base de datos"""
+        # Obtener permisos (primera página; el resto al hacer scroll)
+        query, params = self.build_query()
+        self.pages.load(query, params)
+    
+    def on_data_changed(self, table, operation, row_ids):
+        """Aplicar un cambio de la base de datos a la tabla"""
+        if table != "permisos" or row_ids is None:
+            # Un estudiante renombrado o un cambio masivo: se recarga todo
+            self.load_permissions()
+            return
+        
+        if operation == "delete":
+            db_executor.patch_rows(self.tree, row_ids, [], self.permission_values)
+            return
+        
+        query, params = self.build_query(row_ids)
+        db_executor.deliver(
+            self.tree, db_executor.fetch_all(query, params),
+            lambda rows: db_executor.patch_rows(self.tree, row_ids, rows, self.permission_values, 0))
     
     def new_permission(self):
         """Crear nuevo permiso"""
-        PermissionDialog(self.parent, self.load_permissions)
+        PermissionDialog(self.parent)
     
     def edit_permission(self):
         """Editar permiso seleccionado"""
@@ -114,7 +150,7 @@ class PermissionsModule:
         item = self.tree.item(selection[0])
         permission_id = item['values'][0]
         
-        PermissionDialog(self.parent, self.load_permissions, permission_id)
+        PermissionDialog(self.parent, permission_id=permission_id)
     
     def delete_permission(self):
         """Eliminar permiso seleccionado"""
@@ -127,9 +163,11 @@ class PermissionsModule:
         permission_id = item['values'][0]
         
         if messagebox.askyesno("Confirmar", "¿Está seguro de eliminar este permiso?"):
-            database.execute_query("DELETE FROM permisos WHERE id = ?", (permission_id,))
-            self.load_permissions()
-            messagebox.showinfo("Éxito", "Permiso eliminado correctamente")
+            db_executor.deliver(
+                self.tree,
+                db_executor.execute_query("DELETE FROM permisos WHERE id = ?", (permission_id,)),
+                lambda _: messagebox.showinfo("Éxito", "Permiso eliminado correctamente"),
+                lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
     
     def generate_template(self):
         """Generar plantilla PDF de permisos"""
@@ -182,87 +220,97 @@ class PermissionsModule:
         if not filename:
             return
         
-        try:
-            doc = SimpleDocTemplate(filename, pagesize=A4)
-            story = []
-            styles = getSampleStyleSheet()
-            
-            # Título
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=16,
-                textColor=colors.HexColor('#1a237e'),
-                spaceAfter=20,
-                alignment=1
-            )
-            
-            story.append(Paragraph(f"PLANTILLA DE {tipo_permiso.upper()}", title_style))
-            story.append(Spacer(1, 0.2 * inch))
-            
-            # Obtener estudiantes activos
-            students = database.fetch_all("""
-                SELECT nombre, apellidos 
-                FROM estudiantes 
-                WHERE activo = 1 
-                ORDER BY apellidos, nombre
-            """)
-            
-            # Crear tabla con 3 columnas
-            data = [["Estudiante", "SÍ", "NO"]]
-            
-            for student in students:
-                nombre_completo = f"{student['nombre']} {student['apellidos']}"
-                data.append([nombre_completo, "☐", "☐"])
-            
-            # Crear tabla
-            t = Table(data, colWidths=[4*inch, 0.75*inch, 0.75*inch])
-            t.setStyle(TableStyle([
-                # Encabezado
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1a237e')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 12),
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                
-                # Contenido
-                ('FONT', (0, 1), (-1, -1), 'Helvetica', 10),
-                ('ALIGN', (0, 1), (0, -1), 'LEFT'),
-                ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
-                
-                # Bordes
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                
-                # Padding
-                ('LEFTPADDING', (0, 0), (-1, -1), 6),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-                ('TOPPADDING', (0, 0), (-1, -1), 6),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ]))
-            
-            story.append(t)
-            story.append(Spacer(1, 0.3 * inch))
-            
-            # Nota al pie
-            nota = Paragraph(
-                "<i>Por favor, marque con una X en la casilla correspondiente.</i>",
-                styles['Normal']
-            )
-            story.append(nota)
+        def done(_):
+            db_executor.set_busy(self.parent, False)
+            messagebox.showinfo("Éxito", f"Plantilla generada correctamente:\n{filename}")
+        
+        def failed(e):
+            db_executor.set_busy(self.parent, False)
+            messagebox.showerror("Error", f"Error al generar plantilla: {str(e)}")
+        
+        # La consulta y la generación del PDF se hacen fuera del hilo de Tk
+        db_executor.set_busy(self.parent, True)
+        db_executor.run_in_background(self.parent, self._write_permission_pdf,
+                                      filename, tipo_permiso,
+                                      on_success=done, on_error=failed)
+    
+    def _write_permission_pdf(self, filename, tipo_permiso):
+        """Escribir el PDF de la plantilla de permisos (fuera del hilo de Tk)"""
+        doc = SimpleDocTemplate(filename, pagesize=A4)
+        story = []
+        styles = getSampleStyleSheet()
+        
+        # Título
+        title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
+            textColor=colors.HexColor('#1a237e'),
+            spaceAfter=20,
+            alignment=1
+        )
+        
+        story.append(Paragraph(f"PLANTILLA DE {tipo_permiso.upper()}", title_style))
+        story.append(Spacer(1, 0.2 * inch))
+        
+        # Obtener estudiantes activos
+        students = database.fetch_iter("""
+            SELECT nombre, apellidos 
+            FROM estudiantes 
+            WHERE activo = 1 
+            ORDER BY apellidos, nombre
+        """)
+        
+        # Crear tabla con 3 columnas
+        data = [["Estudiante", "SÍ", "NO"]]
+        
+        for student in students:
+            nombre_completo = f"{student['nombre']} {student['apellidos']}"
+            data.append([nombre_completo, "☐", "☐"])
+        
+        # Crear tabla
+        t = Table(data, colWidths=[4*inch, 0.75*inch, 0.75*inch])
+        t.setStyle(TableStyle([
+            # Encabezado
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1a237e')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 12),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
             
-            # Generar PDF
-            doc.build(story)
+            # Contenido
+            ('FONT', (0, 1), (-1, -1), 'Helvetica', 10),
+            ('ALIGN', (0, 1), (0, -1), 'LEFT'),
+            ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
             
-            messagebox.showinfo("Éxito", f"Plantilla generada correctamente:\n{filename}")
+            # Bordes
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al generar plantilla: {str(e)}")
+            # Padding
+            ('LEFTPADDING', (0, 0), (-1, -1), 6),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+            ('TOPPADDING', (0, 0), (-1, -1), 6),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ]))
+        
+        story.append(t)
+        story.append(Spacer(1, 0.3 * inch))
+        
+        # Nota al pie
+        nota = Paragraph(
+            "<i>Por favor, marque con una X en la casilla correspondiente.</i>",
+            styles['Normal']
+        )
+        story.append(nota)
+        
+        # Generar PDF
+        doc.build(story)
 
 
 class PermissionDialog:
     """Diálogo para crear/editar permiso"""
     
-    def __init__(self, parent, callback, permission_id=None):
+    def __init__(self, parent, callback=None, permission_id=None):
         self.callback = callback
         self.permission_id = permission_id
         
@@ -276,9 +324,7 @@ class PermissionDialog:
         self._set_icon()
         
         self.setup_ui()
-        
-        if permission_id:
-            self.load_permission_data()
+        self.load_students()
     
     def _set_icon(self):
         """Set window icon"""
@@ -306,12 +352,7 @@ class PermissionDialog:
                                          width=37, state="readonly")
         self.student_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
         
-        # Cargar estudiantes
-        students = database.fetch_all(
-            "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 ORDER BY apellidos, nombre"
-        )
-        self.student_list = [(s['id'], f"{s['nombre']} {s['apellidos']}") for s in students]
-        self.student_combo['values'] = [s[1] for s in self.student_list]
+        self.student_list = []
         row += 1
         
         # Tipo de permiso
@@ -352,15 +393,29 @@ class PermissionDialog:
         
         main_frame.columnconfigure(1, weight=1)
     
+    def load_students(self):
+        """Cargar estudiantes y, al editar, los datos del permiso"""
+        def show(students):
+            self.student_list = [(s['id'], f"{s['nombre']} {s['apellidos']}") for s in students]
+            self.student_combo['values'] = [s[1] for s in self.student_list]
+            if self.permission_id:
+                self.load_permission_data()
+        
+        db_executor.deliver(self.dialog, db_executor.fetch_all_cached(
+            "SELECT id, nombre, apellidos FROM estudiantes WHERE activo = 1 ORDER BY apellidos, nombre"
+        ), show)
+    
     def load_permission_data(self):
         """Cargar datos del permiso"""
-        perm = database.fetch_one("""
+        db_executor.deliver(self.dialog, db_executor.fetch_one("""
             SELECT p.*, e.nombre, e.apellidos
             FROM permisos p
             JOIN estudiantes e ON p.estudiante_id = e.id
             WHERE p.id = ?
-        """, (self.permission_id,))
-        
+        """, (self.permission_id,)), self.show_permission_data)
+    
+    def show_permission_data(self, perm):
+        """Mostrar los datos del permiso en el formulario"""
         if perm:
             # Buscar y seleccionar estudiante
             for i, (sid, sname) in enumerate(self.student_list):
@@ -383,30 +438,32 @@ class PermissionDialog:
         student_index = self.student_combo.current()
         student_id = self.student_list[student_index][0]
         
-        try:
-            if self.permission_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE permisos 
-                    SET estudiante_id=?, tipo_permiso=?, respuesta=?, fecha=?, notas=?
-                    WHERE id=?
-                """, (student_id, self.tipo_var.get(), self.respuesta_var.get() or None,
-                     self.fecha_var.get() or None,
-                     self.notas_text.get("1.0", tk.END).strip() or None,
-                     self.permission_id))
-            else:
-                # Crear nuevo
-                database.execute_query("""
-                    INSERT INTO permisos 
-                    (estudiante_id, tipo_permiso, respuesta, fecha, notas)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (student_id, self.tipo_var.get(), self.respuesta_var.get() or None,
-                     self.fecha_var.get() or None,
-                     self.notas_text.get("1.0", tk.END).strip() or None))
-            
-            messagebox.showinfo("Éxito", "Permiso guardado correctamente")
+        if self.permission_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE permisos 
+                SET estudiante_id=?, tipo_permiso=?, respuesta=?, fecha=?, notas=?
+                WHERE id=?
+            """, (student_id, self.tipo_var.get(), self.respuesta_var.get() or None,
+                 self.fecha_var.get() or None,
+                 self.notas_text.get("1.0", tk.END).strip() or None,
+                 self.permission_id))
+        else:
+            # Crear nuevo
+            future = db_executor.execute_query("""
+                INSERT INTO permisos 
+                (estudiante_id, tipo_permiso, respuesta, fecha, notas)
+                VALUES (?, ?, ?, ?, ?)
+            """, (student_id, self.tipo_var.get(), self.respuesta_var.get() or None,
+                 self.fecha_var.get() or None,
+                 self.notas_text.get("1.0", tk.END).strip() or None))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardado el permiso"""
+        messagebox.showinfo("Éxito", "Permiso guardado correctamente")
+        if self.callback:
             self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        self.dialog.destroy()
@@ -6,7 +6,8 @@ Gestión CRUD de estudiantes
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from modules import database
+from modules import db_executor
+from modules.virtual_table import VirtualTable
 from datetime import datetime
 import os
 import sys
@@ -20,6 +21,9 @@ class StudentListModule:
         self.setup_ui()
         self.load_students()
         
+        # Actualizar solo las filas afectadas cuando cambian los datos
+        db_executor.watch(self.tree, self.on_data_changed, ("estudiantes", "centros", "aulas"))
+        
     def setup_ui(self):
         """Configurar la interfaz"""
         # Título
@@ -71,8 +75,8 @@ class StudentListModule:
         
         # Treeview
         columns = ("ID", "Nombre", "Apellidos", "Centro", "Aula", "F. Nacimiento", "Teléfono", "Estado")
-        self.tree = ttk.Treeview(table_frame, columns=columns, show="headings",
-                                yscrollcommand=scrollbar.set)
+        self.tree = VirtualTable(table_frame, columns=columns, show="headings",
+                                 yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.tree.yview)
         
         # Configurar columnas
@@ -98,27 +102,27 @@ class StudentListModule:
         
     def load_filters(self):
         """Cargar opciones de filtro"""
-        # Cargar centros
-        centros = database.fetch_all("SELECT id, nombre FROM centros ORDER BY nombre")
-        centro_names = ["Todos"] + [c['nombre'] for c in centros]
-        self.centro_filter_combo['values'] = centro_names
         if not self.centro_filter_var.get():
             self.centro_filter_var.set("Todos")
-        
-        # Cargar aulas
-        aulas = database.fetch_all("SELECT id, nombre FROM aulas ORDER BY nombre")
-        aula_names = ["Todas"] + [a['nombre'] for a in aulas]
-        self.aula_filter_combo['values'] = aula_names
         if not self.aula_filter_var.get():
             self.aula_filter_var.set("Todas")
         
-    def load_students(self):
-        """Cargar estudiantes desde la base de datos"""
-        # Limpiar tabla
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        # Cargar centros
+        def show_centros(centros):
+            self.centro_filter_combo['values'] = ["Todos"] + [c['nombre'] for c in centros]
+        
+        db_executor.deliver(self.centro_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM centros ORDER BY nombre"), show_centros)
+        
+        # Cargar aulas
+        def show_aulas(aulas):
+            self.aula_filter_combo['values'] = ["Todas"] + [a['nombre'] for a in aulas]
+        
+        db_executor.deliver(self.aula_filter_combo, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM aulas ORDER BY nombre"), show_aulas)
         
-        # Construir consulta con filtros
+    def build_query(self, row_ids=None):
+        """Construir la consulta de estudiantes con los filtros actuales"""
         query = """
             SELECT e.id, e.nombre, e.apellidos, e.fecha_nacimiento, e.telefono, e.activo,
                    c.nombre as centro_nombre, a.nombre as aula_nombre
@@ -129,6 +133,11 @@ class StudentListModule:
         """
         params = []
         
+        # Solo algunas filas
+        if row_ids:
+            query += f" AND e.id IN ({', '.join('?' for _ in row_ids)})"
+            params.extend(row_ids)
+        
         # Filtro por centro
         if self.centro_filter_var.get() and self.centro_filter_var.get() != "Todos":
             query += " AND c.nombre = ?"
@@ -140,27 +149,64 @@ class StudentListModule:
             params.append(self.aula_filter_var.get())
         
         query += " ORDER BY e.apellidos, e.nombre"
-        
+        return query, tuple(params) if params else None
+    
+    def student_values(self, student):
+        """Valores de la fila de un estudiante en la tabla"""
+        estado = "Activo" if student['activo'] else "Inactivo"
+        return (
+            student['id'],
+            student['nombre'],
+            student['apellidos'],
+            student['centro_nombre'] or "",
+            student['aula_nombre'] or "",
+            student['fecha_nacimiento'] or "",
+            student['telefono'] or "",
+            estado
+        )
+    
+    def load_students(self):
+        """Cargar estudiantes desde la base de datos"""
         # Obtener estudiantes
-        students = database.fetch_all(query, tuple(params) if params else None)
-        
-        # Agregar a tabla
-        for student in students:
-            estado = "Activo" if student['activo'] else "Inactivo"
-            self.tree.insert("", tk.END, values=(
-                student['id'],
-                student['nombre'],
-                student['apellidos'],
-                student['centro_nombre'] or "",
-                student['aula_nombre'] or "",
-                student['fecha_nacimiento'] or "",
-                student['telefono'] or "",
-                estado
-            ))
+        query, params = self.build_query()
+        
+        # Solo se pinta el resultado de la última carga solicitada
+        self._load_request = getattr(self, "_load_request", 0) + 1
+        request = self._load_request
+        
+        def show(students):
+            if request != self._load_request:
+                return
+            # Actualizar la tabla con solo las diferencias
+            db_executor.reconcile(self.tree, [
+                (student['id'], self.student_values(student), ()) for student in students
+            ])
+        
+        db_executor.deliver(self.tree, db_executor.fetch_all(query, params), show)
+    
+    def on_data_changed(self, table, operation, row_ids):
+        """Aplicar un cambio de la base de datos a la tabla"""
+        if table != "estudiantes":
+            # Un centro o aula renombrado afecta a filtros y a muchas filas
+            self.reload_data()
+            return
+        
+        if row_ids is None:
+            self.load_students()
+            return
+        
+        if operation == "delete":
+            db_executor.patch_rows(self.tree, row_ids, [], self.student_values)
+            return
+        
+        query, params = self.build_query(row_ids)
+        db_executor.deliver(
+            self.tree, db_executor.fetch_all(query, params),
+            lambda rows: db_executor.patch_rows(self.tree, row_ids, rows, self.student_values))
     
     def new_student(self):
         """Crear nuevo estudiante"""
-        StudentDialog(self.parent, self.reload_data)
+        StudentDialog(self.parent)
     
     def reload_data(self):
         """Recargar filtros y estudiantes"""
@@ -177,7 +223,7 @@ class StudentListModule:
         item = self.tree.item(selection[0])
         student_id = item['values'][0]
         
-        StudentDialog(self.parent, self.reload_data, student_id)
+        StudentDialog(self.parent, student_id=student_id)
     
     def delete_student(self):
         """Eliminar estudiante seleccionado"""
@@ -192,15 +238,17 @@ class StudentListModule:
         
         if messagebox.askyesno("Confirmar", 
                               f"¿Está seguro de eliminar a {student_name}?"):
-            database.execute_query("DELETE FROM estudiantes WHERE id = ?", (student_id,))
-            self.load_students()
-            messagebox.showinfo("Éxito", "Estudiante eliminado correctamente")
+            db_executor.deliver(
+                self.tree,
+                db_executor.execute_query("DELETE FROM estudiantes WHERE id = ?", (student_id,)),
+                lambda _: messagebox.showinfo("Éxito", "Estudiante eliminado correctamente"),
+                lambda e: messagebox.showerror("Error", f"Error al eliminar: {str(e)}"))
 
 
 class StudentDialog:
     """Diálogo para crear/editar estudiante"""
     
-    def __init__(self, parent, callback, student_id=None):
+    def __init__(self, parent, callback=None, student_id=None):
         self.callback = callback
         self.student_id = student_id
         
@@ -258,9 +306,14 @@ class StudentDialog:
         self.centro_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
         
         # Cargar centros
-        centros = database.fetch_all("SELECT id, nombre FROM centros ORDER BY nombre")
-        self.centros_dict = {f"{c['nombre']}": c['id'] for c in centros}
-        self.centro_combo['values'] = [""] + list(self.centros_dict.keys())
+        self.centros_dict = {}
+        
+        def show_centros(centros):
+            self.centros_dict = {f"{c['nombre']}": c['id'] for c in centros}
+            self.centro_combo['values'] = [""] + list(self.centros_dict.keys())
+        
+        db_executor.deliver(self.dialog, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM centros ORDER BY nombre"), show_centros)
         row += 1
         
         ttk.Label(main_frame, text="Aula:").grid(row=row, column=0, sticky=tk.W, pady=5)
@@ -270,9 +323,14 @@ class StudentDialog:
         self.aula_combo.grid(row=row, column=1, pady=5, sticky=tk.EW)
         
         # Cargar aulas
-        aulas = database.fetch_all("SELECT id, nombre FROM aulas ORDER BY nombre")
-        self.aulas_dict = {f"{a['nombre']}": a['id'] for a in aulas}
-        self.aula_combo['values'] = [""] + list(self.aulas_dict.keys())
+        self.aulas_dict = {}
+        
+        def show_aulas(aulas):
+            self.aulas_dict = {f"{a['nombre']}": a['id'] for a in aulas}
+            self.aula_combo['values'] = [""] + list(self.aulas_dict.keys())
+        
+        db_executor.deliver(self.dialog, db_executor.fetch_all_cached(
+            "SELECT id, nombre FROM aulas ORDER BY nombre"), show_aulas)
         row += 1
         
         ttk.Label(main_frame, text="F. Nacimiento:").grid(row=row, column=0, sticky=tk.W, pady=5)
@@ -323,10 +381,16 @@ class StudentDialog:
     
     def load_student_data(self):
         """Cargar datos del estudiante"""
-        student = database.fetch_one(
-            "SELECT * FROM estudiantes WHERE id = ?", (self.student_id,)
-        )
-        
+        db_executor.deliver(self.dialog, db_executor.fetch_one("""
+            SELECT e.*, c.nombre as centro_nombre, a.nombre as aula_nombre
+            FROM estudiantes e
+            LEFT JOIN centros c ON e.centro_id = c.id
+            LEFT JOIN aulas a ON e.aula_id = a.id
+            WHERE e.id = ?
+        """, (self.student_id,)), self.show_student_data)
+    
+    def show_student_data(self, student):
+        """Mostrar los datos del estudiante en el formulario"""
         if student:
             self.nombre_var.set(student['nombre'])
             self.apellidos_var.set(student['apellidos'])
@@ -337,17 +401,11 @@ class StudentDialog:
             self.notas_text.insert("1.0", student['notas'] or "")
             self.activo_var.set(bool(student['activo']))
             
-            # Seleccionar centro
-            if student['centro_id']:
-                centro = database.fetch_one("SELECT nombre FROM centros WHERE id = ?", (student['centro_id'],))
-                if centro:
-                    self.centro_var.set(centro['nombre'])
-            
-            # Seleccionar aula
-            if student['aula_id']:
-                aula = database.fetch_one("SELECT nombre FROM aulas WHERE id = ?", (student['aula_id'],))
-                if aula:
-                    self.aula_var.set(aula['nombre'])
+            # Seleccionar centro y aula
+            if student['centro_nombre']:
+                self.centro_var.set(student['centro_nombre'])
+            if student['aula_nombre']:
+                self.aula_var.set(student['aula_nombre'])
     
     def save(self):
         """Guardar estudiante"""
@@ -379,31 +437,33 @@ class StudentDialog:
             'aula_id': aula_id
         }
         
-        try:
-            if self.student_id:
-                # Actualizar
-                database.execute_query("""
-                    UPDATE estudiantes 
-                    SET nombre=?, apellidos=?, fecha_nacimiento=?, direccion=?, 
-                        telefono=?, email_familia=?, notas=?, activo=?, centro_id=?, aula_id=?
-                    WHERE id=?
-                """, (data['nombre'], data['apellidos'], data['fecha_nacimiento'],
-                     data['direccion'], data['telefono'], data['email_familia'],
-                     data['notas'], data['activo'], data['centro_id'], data['aula_id'], 
-                     self.student_id))
-            else:
-                # Crear nuevo
-                database.execute_query("""
-                    INSERT INTO estudiantes 
-                    (nombre, apellidos, fecha_nacimiento, direccion, telefono, email_familia, notas, activo, centro_id, aula_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (data['nombre'], data['apellidos'], data['fecha_nacimiento'],
-                     data['direccion'], data['telefono'], data['email_familia'],
-                     data['notas'], data['activo'], data['centro_id'], data['aula_id']))
-            
-            messagebox.showinfo("Éxito", "Estudiante guardado correctamente")
+        if self.student_id:
+            # Actualizar
+            future = db_executor.execute_query("""
+                UPDATE estudiantes 
+                SET nombre=?, apellidos=?, fecha_nacimiento=?, direccion=?, 
+                    telefono=?, email_familia=?, notas=?, activo=?, centro_id=?, aula_id=?
+                WHERE id=?
+            """, (data['nombre'], data['apellidos'], data['fecha_nacimiento'],
+                 data['direccion'], data['telefono'], data['email_familia'],
+                 data['notas'], data['activo'], data['centro_id'], data['aula_id'], 
+                 self.student_id))
+        else:
+            # Crear nuevo
+            future = db_executor.execute_query("""
+                INSERT INTO estudiantes 
+                (nombre, apellidos, fecha_nacimiento, direccion, telefono, email_familia, notas, activo, centro_id, aula_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (data['nombre'], data['apellidos'], data['fecha_nacimiento'],
+                 data['direccion'], data['telefono'], data['email_familia'],
+                 data['notas'], data['activo'], data['centro_id'], data['aula_id']))
+        
+        db_executor.deliver(self.dialog, future, self.saved,
+                            lambda e: messagebox.showerror("Error", f"Error al guardar: {str(e)}"))
+    
+    def saved(self, _):
+        """Cerrar el diálogo una vez guardado el estudiante"""
+        messagebox.showinfo("Éxito", "Estudiante guardado correctamente")
+        if self.callback:
             self.callback()
-            self.dialog.destroy()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al guardar: {str(e)}")
+        self.dialog.destroy()
@@ -6,6 +6,7 @@ Maneja el diálogo de contraseña al arranque
 
 import tkinter as tk
 from tkinter import ttk, messagebox
+from modules import database
 
 
 class UnlockDialog:
@@ -73,6 +74,19 @@ class UnlockDialog:
             messagebox.showwarning("Advertencia", "Por favor, ingrese una contraseña")
             return
         
+        # Derivar la clave de sesión una sola vez y cargar la base de datos
+        self.dialog.config(cursor="watch")
+        self.dialog.update_idletasks()
+        try:
+            unlocked = database.unlock(password)
+        finally:
+            self.dialog.config(cursor="")
+        
+        if not unlocked:
+            messagebox.showerror("Error", "Contraseña incorrecta")
+            self.password_entry.delete(0, tk.END)
+            return
+        
         self.result = password
         self.dialog.destroy()
         
@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+"""
+Tabla virtual
+Treeview que solo crea los elementos de Tk de las filas visibles
+
+Las filas viven en una lista de Python y el Treeview interno muestra en cada
+momento una ventana de ellas; al hacer scroll se sustituyen los elementos
+visibles. Así, una tabla de decenas de miles de filas se carga y se vacía
+sin crear ni borrar un elemento de Tk por fila.
+
+VirtualTable se usa como un ttk.Treeview: admite insert, delete, item,
+exists, get_children, selection, see, yview y yscrollcommand, y delega el
+resto (heading, column, tag_configure, bind, pack...) en el Treeview interno.
+Además ordena por columna al pulsar su cabecera; el orden elegido se vuelve
+a aplicar antes de pintar cuando se añaden, mueven o cambian filas.
+"""
+
+import tkinter as tk
+from tkinter import ttk
+
+
+DEFAULT_ROW_HEIGHT = 20
+DEFAULT_VISIBLE_ROWS = 20
+WHEEL_ROWS = 3
+SORT_ARROWS = {False: " ▲", True: " ▼"}
+
+
+def _sort_key(value):
+    """Clave de orden que admite mezclar números, textos y vacíos"""
+    if value is None or value == "":
+        return (2, "")
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value).lower())
+
+
+class VirtualTable:
+    """Treeview con scroll virtual para tablas grandes"""
+
+    def __init__(self, parent, columns=(), yscrollcommand=None, **kwargs):
+        self.tree = ttk.Treeview(parent, columns=columns, **kwargs)
+        self.yscrollcommand = yscrollcommand
+
+        # Datos: lista de [iid, valores, etiquetas], índice iid -> fila e
+        # índice iid -> posición (este se rehace solo cuando se necesita)
+        self.rows = []
+        self._rows_by_iid = {}
+        self._positions = {}
+        self._next_iid = 0
+
+        # Ventana visible
+        self.offset = 0
+        self._rendered = []
+        # Valores y etiquetas con que se pintó cada elemento visible
+        self._painted = {}
+        self._render_pending = False
+        self._row_height = DEFAULT_ROW_HEIGHT
+        self._header_height = DEFAULT_ROW_HEIGHT
+
+        self._selected = set()
+        self._sort_column = None
+        self._sort_reverse = False
+        self._sort_stale = False
+        self._heading_text = {}
+
+        for column in columns:
+            self.tree.heading(column, command=lambda c=column: self.sort_by(c))
+
+        self.tree.bind("<Configure>", lambda e: self._schedule_render(), add="+")
+        self.tree.bind("<MouseWheel>", self._on_wheel, add="+")
+        self.tree.bind("<Button-4>", lambda e: self._scroll_rows(-WHEEL_ROWS), add="+")
+        self.tree.bind("<Button-5>", lambda e: self._scroll_rows(WHEEL_ROWS), add="+")
+        for sequence, step in (("<Up>", -1), ("<Down>", 1),
+                               ("<Prior>", "page-"), ("<Next>", "page+"),
+                               ("<Home>", "home"), ("<End>", "end")):
+            self.tree.bind(sequence, lambda e, s=step: self._move_focus(s), add="+")
+
+    # --- Delegación en el Treeview interno ---------------------------------
+
+    def __getattr__(self, name):
+        return getattr(self.tree, name)
+
+    def __getitem__(self, key):
+        return self.tree[key]
+
+    def __str__(self):
+        return str(self.tree)
+
+    def configure(self, cnf=None, **kwargs):
+        """Como Treeview.configure; yscrollcommand se gestiona aquí"""
+        if cnf:
+            kwargs.update(cnf)
+        if "yscrollcommand" in kwargs:
+            self.yscrollcommand = kwargs.pop("yscrollcommand")
+            self._update_scroll()
+        if kwargs:
+            return self.tree.configure(**kwargs)
+
+    config = configure
+
+    # --- Datos ---------------------------------------------------------------
+
+    def _position(self, iid):
+        """Posición de una fila en la lista de datos"""
+        if self._positions is None:
+            self._positions = {row[0]: index for index, row in enumerate(self.rows)}
+        return self._positions[iid]
+
+    def exists(self, iid):
+        """Comprobar si existe una fila"""
+        return str(iid) in self._rows_by_iid
+
+    def get_children(self, item=""):
+        """Identificadores de todas las filas, en orden"""
+        return tuple(row[0] for row in self.rows)
+
+    def insert(self, parent, index, iid=None, values=(), tags=(), **kwargs):
+        """Añadir una fila (parent se ignora: la tabla es plana)"""
+        if iid is None:
+            self._next_iid += 1
+            iid = f"V{self._next_iid:06d}"
+        iid = str(iid)
+        if self.exists(iid):
+            raise tk.TclError(f'Item {iid} already exists')
+        if isinstance(tags, str):
+            tags = (tags,)
+
+        row = [iid, tuple(values), tuple(tags)]
+        self._rows_by_iid[iid] = row
+        if index == "end" or index == tk.END or index >= len(self.rows):
+            if self._positions is not None:
+                self._positions[iid] = len(self.rows)
+            self.rows.append(row)
+        else:
+            # Las posiciones se recalculan una sola vez, cuando se pidan
+            self.rows.insert(max(int(index), 0), row)
+            self._positions = None
+
+        self._sort_stale = True
+        self._schedule_render()
+        return iid
+
+    def set_rows(self, rows):
+        """Sustituir todas las filas por rows: iterable de (iid, valores, etiquetas)"""
+        self.rows = [[str(iid), tuple(values), tuple(tags)] for iid, values, tags in rows]
+        self._rows_by_iid = {row[0]: row for row in self.rows}
+        self._positions = None
+        self._selected.intersection_update(row[0] for row in self.rows)
+        if self._sort_column is not None:
+            self._sort_rows()
+        self._schedule_render()
+
+    def clear(self):
+        """Vaciar la tabla"""
+        self.rows = []
+        self._rows_by_iid = {}
+        self._sort_stale = False
+        self._positions = {}
+        self._selected.clear()
+        self.offset = 0
+        self._schedule_render()
+
+    def delete(self, *iids):
+        """Eliminar filas (los identificadores que no existen se ignoran)"""
+        if not iids:
+            return
+        remove = {str(iid) for iid in iids}
+        self.rows = [row for row in self.rows if row[0] not in remove]
+        for iid in remove:
+            self._rows_by_iid.pop(iid, None)
+        self._positions = None
+        self._selected -= remove
+        self._schedule_render()
+
+    def index(self, iid):
+        """Posición de una fila"""
+        return self._position(str(iid))
+
+    def move(self, iid, parent, index):
+        """Mover una fila a otra posición, como Treeview.move (parent se ignora)
+
+        Igual que en Tk, la fila queda detrás de la que ocupa index - 1 antes
+        de moverla.
+        """
+        position = self._position(str(iid))
+        if index == "end" or index == tk.END:
+            index = len(self.rows)
+        index = int(index)
+        sibling = self.rows[min(index, len(self.rows)) - 1] if index > 0 else None
+        if sibling is self.rows[position]:
+            return
+
+        row = self.rows.pop(position)
+        target = self.rows.index(sibling) + 1 if sibling is not None else 0
+        self.rows.insert(target, row)
+        self._positions = None
+        self._sort_stale = True
+        self._schedule_render()
+
+    def item(self, iid, option=None, **kwargs):
+        """Leer o modificar una fila, como Treeview.item"""
+        row = self._rows_by_iid[str(iid)]
+        if kwargs:
+            if "values" in kwargs:
+                row[1] = tuple(kwargs["values"])
+                # Con la tabla ordenada, la fila puede cambiar de sitio
+                self._sort_stale = True
+            if "tags" in kwargs:
+                tags = kwargs["tags"]
+                row[2] = (tags,) if isinstance(tags, str) else tuple(tags)
+            if row[0] in self._painted or self._sort_column is not None:
+                self._schedule_render()
+            return None
+
+        info = {"text": "", "image": "", "values": list(row[1]),
+                "open": 0, "tags": list(row[2])}
+        return info[option] if option is not None else info
+
+    def set(self, iid, column=None, value=None):
+        """Leer o cambiar el valor de una celda, como Treeview.set"""
+        row = self._rows_by_iid[str(iid)]
+        columns = list(self.tree["columns"])
+        if column is None:
+            return dict(zip(columns, row[1]))
+        index = columns.index(column)
+        if value is None:
+            return row[1][index]
+        values = list(row[1])
+        values[index] = value
+        self.item(iid, values=values)
+
+    # --- Selección -------------------------------------------------------------
+
+    def _sync_selection(self):
+        """Incorporar a la selección lo que el usuario ha marcado en la ventana visible"""
+        try:
+            selected = {iid for iid in self.tree.selection() if self.exists(iid)}
+        except tk.TclError:
+            return
+        self._selected = (self._selected - set(self._rendered)) | selected
+
+    def selection(self):
+        """Identificadores de las filas seleccionadas, en orden"""
+        self._sync_selection()
+        return tuple(sorted(self._selected, key=self._position))
+
+    def selection_set(self, *iids):
+        """Seleccionar filas por su identificador
+
+        La selección se pasa en el acto a los elementos visibles: si no,
+        _sync_selection() recuperaría la anterior del Treeview antes del
+        siguiente pintado.
+        """
+        if len(iids) == 1 and isinstance(iids[0], (list, tuple)):
+            iids = iids[0]
+        self._selected = {str(iid) for iid in iids if self.exists(iid)}
+        try:
+            self._show_selection()
+        except tk.TclError:
+            pass
+        self._schedule_render()
+
+    def _show_selection(self):
+        """Marcar en el Treeview las filas visibles seleccionadas
+
+        selection_set genera <<TreeviewSelect>>: solo se llama si la
+        selección visible cambia.
+        """
+        selected = [iid for iid in self._rendered if iid in self._selected]
+        if set(selected) != set(self.tree.selection()):
+            self.tree.selection_set(selected)
+
+    def select(self, iid):
+        """Seleccionar una fila por su identificador y mostrarla"""
+        self.selection_set(iid)
+        self.see(iid)
+        self.tree.event_generate("<<TreeviewSelect>>")
+
+    def see(self, iid):
+        """Desplazar la ventana hasta que la fila sea visible"""
+        position = self._position(str(iid))
+        visible = self._visible_rows()
+        if position < self.offset:
+            self.offset = position
+        elif position >= self.offset + visible:
+            self.offset = position - visible + 1
+        self._schedule_render()
+
+    # --- Orden -----------------------------------------------------------------
+
+    def sort_by(self, column, reverse=None):
+        """Ordenar las filas por una columna (pulsar de nuevo invierte el orden)"""
+        if reverse is None:
+            reverse = not self._sort_reverse if column == self._sort_column else False
+
+        previous = self._sort_column
+        self._sort_column = column
+        self._sort_reverse = reverse
+        self._sort_rows()
+
+        for name in (previous, column):
+            if name is None:
+                continue
+            if name not in self._heading_text:
+                self._heading_text[name] = self.tree.heading(name, "text")
+            text = self._heading_text[name]
+            if name == column:
+                text += SORT_ARROWS[reverse]
+            self.tree.heading(name, text=text)
+
+        self._schedule_render()
+
+    def _sort_rows(self):
+        """Aplicar el orden elegido a la lista de datos"""
+        index = list(self.tree["columns"]).index(self._sort_column)
+        self.rows.sort(key=lambda row: _sort_key(row[1][index] if index < len(row[1]) else None),
+                       reverse=self._sort_reverse)
+        self._positions = None
+        self._sort_stale = False
+
+    # --- Scroll y pintado ---------------------------------------------------------
+
+    def _visible_rows(self):
+        """Número de filas completas que caben en el Treeview"""
+        height = self.tree.winfo_height()
+        if height <= 1:
+            return DEFAULT_VISIBLE_ROWS
+        return max(1, (height - self._header_height) // self._row_height)
+
+    def _clamp_offset(self):
+        """Mantener la ventana dentro de los datos"""
+        self.offset = max(0, min(self.offset, len(self.rows) - self._visible_rows()))
+
+    def yview(self, *args):
+        """Como Treeview.yview: devuelve la fracción visible o desplaza la ventana"""
+        if not args:
+            return self._fractions()
+
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.rows))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            if args[2] == "pages":
+                amount *= self._visible_rows()
+            self.offset += amount
+        self._render()
+
+    def _fractions(self):
+        """Fracción de los datos que muestra la ventana visible"""
+        total = len(self.rows)
+        if not total:
+            return 0.0, 1.0
+        first = self.offset / total
+        last = min(1.0, (self.offset + self._visible_rows()) / total)
+        return first, last
+
+    def _scroll_rows(self, amount):
+        """Desplazar la ventana un número de filas"""
+        self.offset += amount
+        self._render()
+        return "break"
+
+    def _on_wheel(self, event):
+        """Rueda del ratón (Windows y macOS)"""
+        steps = -int(event.delta / 120) if abs(event.delta) >= 120 else -int(event.delta)
+        return self._scroll_rows(steps * WHEEL_ROWS)
+
+    def _move_focus(self, step):
+        """Mover la fila activa con el teclado sin salir de los datos"""
+        if not self.rows:
+            return "break"
+
+        focus = self.tree.focus()
+        position = self._position(focus) if focus and self.exists(focus) else self.offset
+        visible = self._visible_rows()
+        if step == "page-":
+            position -= visible
+        elif step == "page+":
+            position += visible
+        elif step == "home":
+            position = 0
+        elif step == "end":
+            position = len(self.rows) - 1
+        else:
+            position += step
+        position = max(0, min(position, len(self.rows) - 1))
+
+        iid = self.rows[position][0]
+        self.select(iid)
+        self._render()
+        self.tree.focus(iid)
+        return "break"
+
+    def _schedule_render(self):
+        """Pintar la ventana visible cuando Tk esté libre (agrupa varios cambios)"""
+        if self._render_pending:
+            return
+        self._render_pending = True
+        try:
+            self.tree.after_idle(self._render)
+        except tk.TclError:
+            # El widget ya no existe
+            self._render_pending = False
+
+    def _render(self):
+        """Llevar los elementos del Treeview a las filas de la ventana visible
+
+        Solo se crean los elementos que entran en la ventana y se borran los
+        que salen; los que siguen visibles se conservan (con su selección) y
+        se actualizan si sus valores han cambiado.
+        """
+        self._render_pending = False
+        try:
+            self._sync_selection()
+            if self._sort_stale and self._sort_column is not None:
+                self._sort_rows()
+            self._clamp_offset()
+
+            window = self.rows[self.offset:self.offset + self._visible_rows()]
+            wanted = {row[0] for row in window}
+            stale = [iid for iid in self._rendered if iid not in wanted]
+            if stale:
+                self.tree.delete(*stale)
+                for iid in stale:
+                    del self._painted[iid]
+
+            order = [iid for iid in self._rendered if iid in wanted]
+            for index, (iid, values, tags) in enumerate(window):
+                if iid not in self._painted:
+                    self.tree.insert("", index, iid=iid, values=values, tags=tags)
+                    order.insert(index, iid)
+                else:
+                    if order[index] != iid:
+                        self.tree.move(iid, "", index)
+                        order.remove(iid)
+                        order.insert(index, iid)
+                    if self._painted[iid] != (values, tags):
+                        self.tree.item(iid, values=values, tags=tags)
+                self._painted[iid] = (values, tags)
+            self._rendered = order
+
+            self._show_selection()
+        except tk.TclError:
+            # El widget se ha destruido mientras había un pintado pendiente
+            return
+
+        self._measure_rows()
+        self._update_scroll()
+
+    def _measure_rows(self):
+        """Tomar la altura real de fila y de cabecera del primer elemento pintado"""
+        if not self._rendered:
+            return
+        bbox = self.tree.bbox(self._rendered[0])
+        if bbox:
+            x, y, width, height = bbox
+            if height > 0:
+                self._header_height = y
+                if height != self._row_height:
+                    self._row_height = height
+                    self._schedule_render()
+
+    def _update_scroll(self):
+        """Avisar a la barra de scroll de la posición de la ventana"""
+        if self.yscrollcommand:
+            first, last = self._fractions()
+            self.yscrollcommand(first, last)
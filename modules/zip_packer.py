@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Empaquetador de archivos .cordiax.zip
+Elige STORED o DEFLATED por archivo y comprime en paralelo los miembros grandes
+
+Los formatos que ya van comprimidos (.docx, .xlsx, .pptx, .pdf, imágenes...)
+se guardan sin recomprimir; para el resto se prueba a comprimir una muestra
+y solo se usa DEFLATED si merece la pena (una base de datos encriptada, por
+ejemplo, no se comprime). Los miembros grandes se dividen en trozos que se
+comprimen en un grupo de hilos (zlib libera el GIL) y se concatenan en un
+único flujo deflate, como hace pigz: cada trozo usa los últimos 32 KiB del
+anterior como diccionario y termina con un vaciado completo, así que el
+resultado es un zip estándar que cualquier herramienta puede abrir.
+"""
+
+import os
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+
+COMPRESS_LEVEL = 6
+PROBE_SIZE = 64 * 1024
+# Por encima de esta proporción (comprimido / original) no compensa comprimir
+PROBE_MAX_RATIO = 0.9
+PIECE_SIZE = 1024 * 1024
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+WINDOW_SIZE = 32 * 1024
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Partes internas de zipfile que usa la compresión en paralelo (ver
+# tests/test_zip_packer.py); sin ellas se comprime en un solo hilo
+_ZIPFILE_INTERNALS = ("_writecheck", "_didModify", "fp", "start_dir", "NameToInfo", "filelist")
+
+# Formatos que ya van comprimidos por dentro
+STORED_EXTENSIONS = {
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".pdf",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp",
+    ".mp3", ".mp4", ".m4a", ".avi", ".mov",
+}
+
+
+def is_compressible(sample):
+    """Probar a comprimir una muestra con el nivel más rápido"""
+    if not sample:
+        return False
+    sample = sample[:PROBE_SIZE]
+    return len(zlib.compress(sample, 1)) < len(sample) * PROBE_MAX_RATIO
+
+
+def choose_compression(name, sample):
+    """ZIP_STORED o ZIP_DEFLATED según la extensión y una muestra del contenido"""
+    if Path(name).suffix.lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED if is_compressible(sample) else zipfile.ZIP_STORED
+
+
+def _deflate_piece(piece, window, last, level):
+    """Comprimir un trozo como parte de un flujo deflate sin cabecera"""
+    if window:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=window)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(piece) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+
+def _pieces(blocks):
+    """Reagrupar bloques de datos en trozos de PIECE_SIZE, marcando el último"""
+    buffer = b""
+    for block in blocks:
+        buffer += block
+        while len(buffer) > PIECE_SIZE:
+            yield buffer[:PIECE_SIZE], False
+            buffer = buffer[PIECE_SIZE:]
+    yield buffer, True
+
+
+class ZipPacker:
+    """Escritor de .cordiax.zip con compresión por archivo y en paralelo
+
+    Uso:
+        with ZipPacker(ruta) as packer:
+            packer.add("documentos/a.docx", bloques, tamaño, mtime)
+    """
+
+    def __init__(self, zip_path, workers=DEFAULT_WORKERS, level=COMPRESS_LEVEL):
+        self.zipf = zipfile.ZipFile(str(zip_path), 'w', zipfile.ZIP_DEFLATED)
+        self.level = level
+        self.workers = workers
+        self.pool = None
+        if workers > 1 and all(hasattr(self.zipf, name) for name in _ZIPFILE_INTERNALS):
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cordiax-zip")
+        self.stats = {"stored": 0, "deflated": 0, "parallel": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+        self.zipf.close()
+
+    def add(self, arcname, blocks, size, mtime, progress=None):
+        """Añadir un miembro a partir de un iterable de bloques de bytes
+
+        progress(n) se llama con los bytes de origen procesados.
+        """
+        blocks = iter(blocks)
+        first = next(blocks, b"")
+        blocks = _prepend(first, blocks)
+
+        date_time = datetime.fromtimestamp(mtime).timetuple()[:6]
+        info = zipfile.ZipInfo(arcname, date_time=max(date_time, (1980, 1, 1, 0, 0, 0)))
+        info.compress_type = choose_compression(arcname, first)
+        info.external_attr = 0o644 << 16
+        info.file_size = size
+
+        if info.compress_type == zipfile.ZIP_STORED:
+            self.stats["stored"] += 1
+        else:
+            self.stats["deflated"] += 1
+            if self.pool is not None and size >= PARALLEL_MIN_SIZE:
+                self.stats["parallel"] += 1
+                self._add_parallel(info, blocks, size, progress)
+                return
+
+        with self.zipf.open(info, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as member:
+            for block in blocks:
+                member.write(block)
+                if progress:
+                    progress(len(block))
+
+    def add_file(self, arcname, path, progress=None):
+        """Añadir un archivo del disco"""
+        stat = Path(path).stat()
+        with open(path, 'rb') as f:
+            self.add(arcname, iter(lambda: f.read(PIECE_SIZE), b""), stat.st_size,
+                     stat.st_mtime, progress)
+
+    def _add_parallel(self, info, blocks, size, progress):
+        """Escribir un miembro DEFLATED comprimiendo sus trozos en paralelo
+
+        Se escribe la cabecera local, después los trozos comprimidos en orden
+        según van terminando y al final se vuelve a escribir la cabecera con
+        el CRC y los tamaños reales, igual que hace zipfile al cerrar un
+        miembro en un archivo con seek. zipfile no permite escribir un flujo
+        deflate ya comprimido con su API pública, así que se usan sus partes
+        internas (_ZIPFILE_INTERNALS); tests/test_zip_packer.py comprueba el
+        resultado con testzip().
+        """
+        zipf = self.zipf
+        # Se reserva zip64 si el comprimido pudiera pasar del límite
+        zip64 = size * 1.01 + PIECE_SIZE > zipfile.ZIP64_LIMIT
+        zipf._writecheck(info)
+        zipf._didModify = True
+        info.header_offset = zipf.fp.tell()
+        info.CRC = 0
+        info.compress_size = 0
+        zipf.fp.write(info.FileHeader(zip64))
+
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        pending = deque()
+        window = b""
+
+        def write_oldest():
+            nonlocal compress_size
+            data = pending.popleft().result()
+            zipf.fp.write(data)
+            compress_size += len(data)
+
+        for piece, last in _pieces(blocks):
+            pending.append(self.pool.submit(_deflate_piece, piece, window, last, self.level))
+            window = (window + piece)[-WINDOW_SIZE:]
+            crc = zlib.crc32(piece, crc)
+            file_size += len(piece)
+            if progress:
+                progress(len(piece))
+            # Como mucho dos trozos por hilo en memoria
+            if len(pending) >= self.workers * 2:
+                write_oldest()
+        while pending:
+            write_oldest()
+
+        info.CRC = crc
+        info.file_size = file_size
+        info.compress_size = compress_size
+        end = zipf.fp.tell()
+        zipf.fp.seek(info.header_offset)
+        zipf.fp.write(info.FileHeader(zip64))
+        zipf.fp.seek(end)
+        zipf.filelist.append(info)
+        zipf.NameToInfo[info.filename] = info
+        zipf.start_dir = end
+
+
+def _prepend(first, blocks):
+    """Volver a poner delante el primer bloque, ya leído para la prueba"""
+    if first:
+        yield first
+    yield from blocks
+
+
+def pack_files(zip_path, files, workers=DEFAULT_WORKERS, level=COMPRESS_LEVEL):
+    """Crear un zip a partir de una lista de (nombre en el zip, ruta); devuelve las estadísticas"""
+    with ZipPacker(zip_path, workers, level) as packer:
+        for arcname, path in files:
+            packer.add_file(arcname, path)
+    return packer.stats
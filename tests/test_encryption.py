@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Archivo encriptado por bloques
+Comprueba que un bloque de un guardado anterior no se acepta en el archivo
+actual y que el diario de un guardado interrumpido solo se aplica sobre el
+archivo del que parte
+
+Uso:
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules import encryption
+
+
+CHUNK_SIZE = 1024
+
+
+class EncryptedPageStoreTest(unittest.TestCase):
+    """Registro de guardado y diario de EncryptedPageStore"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = encryption.create_session_key("contraseña")
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.db_path = self.work_dir / "cordiax.db"
+        self.data = bytearray(os.urandom(CHUNK_SIZE * 4))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def open_store(self):
+        return encryption.EncryptedPageStore(self.db_path, self.key, CHUNK_SIZE)
+
+    def record_offset(self, index):
+        header = encryption.read_header(self.db_path)
+        return header.data_offset + index * (encryption.NONCE_SIZE + CHUNK_SIZE
+                                             + encryption.TAG_SIZE)
+
+    def test_incremental_saves_round_trip(self):
+        store = self.open_store()
+        store.save(self.data)
+        self.data[CHUNK_SIZE:CHUNK_SIZE + 4] = b"\x00\x01\x02\x03"
+        self.assertEqual(store.save(self.data), 1)
+        self.data += b"cola"
+        store.save(self.data)
+
+        reopened = self.open_store()
+        self.assertEqual(reopened.load(), self.data)
+        self.assertEqual(encryption.read_header(self.db_path).generation, 3)
+
+    def test_chunk_from_previous_save_is_rejected(self):
+        store = self.open_store()
+        store.save(self.data)
+        offset = self.record_offset(1)
+        size = encryption.NONCE_SIZE + CHUNK_SIZE + encryption.TAG_SIZE
+        old_record = self.db_path.read_bytes()[offset:offset + size]
+
+        self.data[CHUNK_SIZE:CHUNK_SIZE + 4] = b"\x00\x01\x02\x03"
+        store.save(self.data)
+        with open(self.db_path, "r+b") as f:
+            f.seek(offset)
+            f.write(old_record)
+
+        with self.assertRaises(ValueError):
+            encryption.decrypt_bytes(self.db_path, self.key)
+
+    def interrupt_save(self, store):
+        """Guardar self.data dejando el diario escrito pero sin aplicar"""
+        def crash(*args):
+            raise OSError("interrumpido")
+        store._apply = crash
+        with self.assertRaises(OSError):
+            store.save(self.data)
+        self.assertTrue(store.journal_path.exists())
+
+    def test_interrupted_save_is_completed(self):
+        store = self.open_store()
+        store.save(self.data)
+        self.data[:4] = b"\x00\x01\x02\x03"
+        self.interrupt_save(store)
+
+        reopened = self.open_store()
+        self.assertEqual(reopened.load(), self.data)
+        self.assertFalse(reopened.journal_path.exists())
+
+    def test_stale_journal_is_not_replayed(self):
+        store = self.open_store()
+        store.save(self.data)
+        backup = self.db_path.read_bytes()
+        self.data[:4] = b"\x00\x01\x02\x03"
+        store.save(self.data)
+        self.data[:4] = b"\x04\x05\x06\x07"
+        self.interrupt_save(store)
+
+        # El archivo se sustituye por una copia anterior: el diario no le corresponde
+        self.db_path.write_bytes(backup)
+        restored = self.open_store()
+        restored.load()
+        self.assertFalse(restored.journal_path.exists())
+        self.assertEqual(self.db_path.read_bytes(), backup)
+
+
+if __name__ == "__main__":
+    unittest.main()
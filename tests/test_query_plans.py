@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Planes de las consultas de asistencia y mensajes
+Comprueba con EXPLAIN QUERY PLAN que las consultas de los listados usan los
+índices creados por las migraciones y no recorren la tabla entera
+
+Uso:
+    python -m unittest discover tests
+"""
+
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules import database
+
+
+# Consulta del listado de asistencia de un día (AssistanceModule.build_query)
+ASSISTANCE_QUERY = """
+    SELECT a.id, e.nombre, e.apellidos, a.fecha, a.estado,
+           a.hora_entrada, a.hora_salida, a.notas,
+           c.nombre as centro_nombre, au.nombre as aula_nombre
+    FROM asistencia a
+    JOIN estudiantes e ON a.estudiante_id = e.id
+    LEFT JOIN centros c ON e.centro_id = c.id
+    LEFT JOIN aulas au ON e.aula_id = au.id
+    WHERE a.fecha = ?
+    ORDER BY e.apellidos, e.nombre
+"""
+
+# Estudiantes ya registrados un día (check-in rápido)
+CHECKED_IN_QUERY = "SELECT estudiante_id FROM asistencia WHERE fecha = ?"
+
+# Listado de mensajes (MessagesModule.load_messages), paginado por fecha
+MESSAGES_QUERY = """
+    SELECT m.id, e.nombre, e.apellidos, m.asunto, m.fecha, m.leido
+    FROM mensajes m
+    JOIN estudiantes e ON m.estudiante_id = e.id
+"""
+MESSAGES_ORDER = (("fecha", "DESC"), ("id", "DESC"))
+
+
+class QueryPlanTest(unittest.TestCase):
+    """Las migraciones crean los índices y las consultas los usan"""
+
+    def setUp(self):
+        self.data_dir = Path(tempfile.mkdtemp())
+        self.previous = (database.USER_DATA_DIR, database.DB_PATH)
+        database.USER_DATA_DIR = self.data_dir
+        database.DB_PATH = None
+        # Sin initialize_database(): no hace falta la copia automática
+        database.migrate_database()
+        database.optimize()
+
+    def tearDown(self):
+        database.close_all_connections()
+        database.USER_DATA_DIR, database.DB_PATH = self.previous
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def plan(self, query, params=()):
+        """Texto de cada paso del plan de una consulta"""
+        rows = database.fetch_all("EXPLAIN QUERY PLAN " + query, params)
+        return " | ".join(row["detail"] for row in rows)
+
+    def page_query(self, after=None):
+        """Consulta de una página de mensajes, tal como la construye fetch_page"""
+        sql = f"SELECT * FROM ({MESSAGES_QUERY})"
+        params = []
+        if after is not None:
+            condition, params = database._keyset_condition(MESSAGES_ORDER, after)
+            sql += f" WHERE {condition}"
+        sql += " ORDER BY " + ", ".join(f"{c} {d}" for c, d in MESSAGES_ORDER) + " LIMIT ?"
+        return sql, tuple(params) + (database.PAGE_SIZE,)
+
+    def test_migrations_reach_latest_version(self):
+        self.assertEqual(database.get_schema_version(), database.MIGRATIONS[-1][0])
+
+    def test_assistance_by_date_uses_index(self):
+        plan = self.plan(ASSISTANCE_QUERY, ("2024-01-15",))
+        self.assertIn("idx_asistencia_fecha_estudiante", plan)
+        self.assertNotIn("SCAN a", plan)
+
+    def test_checked_in_students_use_covering_index(self):
+        plan = self.plan(CHECKED_IN_QUERY, ("2024-01-15",))
+        self.assertIn("COVERING INDEX idx_asistencia_fecha_estudiante", plan)
+
+    def test_first_message_page_uses_date_index(self):
+        plan = self.plan(*self.page_query())
+        self.assertIn("idx_mensajes_fecha", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_next_message_page_seeks_date_index(self):
+        plan = self.plan(*self.page_query(after=("2024-01-15 10:00:00", 42)))
+        self.assertIn("SEARCH m USING INDEX idx_mensajes_fecha", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Tabla virtual
+Comprueba que la selección hecha desde el código (select, teclado) llega al
+Treeview y sustituye a la anterior, y que las inserciones por posición
+mantienen la tabla coherente
+
+El Treeview de Tk se sustituye por uno mínimo en memoria: las pruebas no
+necesitan pantalla.
+
+Uso:
+    python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules import virtual_table
+
+
+class FakeTreeview:
+    """Lo justo de ttk.Treeview para que VirtualTable pinte sus filas"""
+
+    def __init__(self, parent=None, columns=(), **kwargs):
+        self.options = {"columns": tuple(columns)}
+        self.children = []
+        self.values = {}
+        self.selected = ()
+        self.focused = ""
+        self.idle = []
+        self.events = []
+
+    def __getitem__(self, key):
+        return self.options[key]
+
+    def heading(self, column, option=None, **kwargs):
+        return ""
+
+    def bind(self, *args, **kwargs):
+        pass
+
+    def after_idle(self, func):
+        self.idle.append(func)
+
+    def winfo_height(self):
+        return 1
+
+    def bbox(self, iid):
+        return None
+
+    def insert(self, parent, index, iid=None, values=(), tags=()):
+        self.children.insert(index, iid)
+        self.values[iid] = values
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.children.remove(iid)
+            del self.values[iid]
+        self.selected = tuple(iid for iid in self.selected if iid not in iids)
+
+    def move(self, iid, parent, index):
+        self.children.remove(iid)
+        self.children.insert(index, iid)
+
+    def item(self, iid, **kwargs):
+        self.values[iid] = kwargs.get("values", self.values[iid])
+
+    def selection(self):
+        return self.selected
+
+    def selection_set(self, iids):
+        self.selected = tuple(iids)
+
+    def focus(self, iid=None):
+        if iid is None:
+            return self.focused
+        self.focused = iid
+
+    def event_generate(self, sequence):
+        self.events.append(sequence)
+
+
+class VirtualTableSelectionTest(unittest.TestCase):
+    """La selección y la navegación con teclado sobre la ventana visible"""
+
+    def setUp(self):
+        patcher = mock.patch.object(virtual_table.ttk, "Treeview", FakeTreeview)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.table = virtual_table.VirtualTable(None, columns=("nombre",))
+        self.table.set_rows((str(i), (f"fila {i}",), ()) for i in range(100))
+        self.render()
+
+    def render(self):
+        """Ejecutar los pintados pendientes, como haría el bucle de Tk"""
+        while self.table.tree.idle:
+            self.table.tree.idle.pop(0)()
+
+    def test_select_replaces_visible_selection(self):
+        self.table.select("3")
+        self.table.select("5")
+        self.render()
+        self.assertEqual(self.table.selection(), ("5",))
+        self.assertEqual(self.table.tree.selection(), ("5",))
+
+    def test_select_row_outside_window(self):
+        # Fila marcada por el usuario en la ventana visible
+        self.table.tree.selection_set(("2",))
+        self.table.select("70")
+        self.render()
+        self.assertEqual(self.table.selection(), ("70",))
+        self.assertEqual(self.table.tree.selection(), ("70",))
+        self.assertIn("70", self.table.tree.children)
+
+    def test_keyboard_navigation(self):
+        table = self.table
+        visible = virtual_table.DEFAULT_VISIBLE_ROWS
+
+        table._move_focus(1)
+        self.assertEqual(table.selection(), ("1",))
+        table._move_focus(1)
+        self.assertEqual(table.selection(), ("2",))
+        table._move_focus(-1)
+        self.assertEqual(table.selection(), ("1",))
+
+        table._move_focus("page+")
+        self.assertEqual(table.selection(), (str(1 + visible),))
+        self.assertEqual(table.tree.selection(), (str(1 + visible),))
+
+        table._move_focus("end")
+        self.assertEqual(table.selection(), ("99",))
+        self.assertEqual(table.tree.focus(), "99")
+        self.assertIn("99", table.tree.children)
+
+        table._move_focus("page-")
+        self.assertEqual(table.selection(), (str(99 - visible),))
+
+        table._move_focus("home")
+        self.render()
+        self.assertEqual(table.selection(), ("0",))
+        self.assertEqual(table.tree.selection(), ("0",))
+        self.assertEqual(table.tree.children[0], "0")
+
+    def test_positional_inserts(self):
+        table = self.table
+        for i in range(10):
+            table.insert("", 0, iid=f"n{i}", values=(f"nueva {i}",))
+        self.render()
+        self.assertEqual(table.get_children()[:10], tuple(f"n{i}" for i in range(9, -1, -1)))
+        self.assertEqual(table.index("0"), 10)
+        self.assertEqual(table.item("n3", "values"), ["nueva 3"])
+        self.assertEqual(table.tree.children[:3], ["n9", "n8", "n7"])
+
+        table.delete("n9")
+        self.assertFalse(table.exists("n9"))
+        self.assertEqual(table.index("n8"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
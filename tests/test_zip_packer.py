@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Compresión en paralelo de los .cordiax.zip
+Comprueba que los miembros que ZipPacker comprime en paralelo (escribiendo
+el flujo deflate con las partes internas de zipfile) forman un zip válido
+que zipfile lee y verifica con testzip()
+
+Uso:
+    python -m unittest discover tests
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules import zip_packer
+
+
+def compressible_data(size, seed):
+    """Texto repetitivo pero no constante, para que deflate trabaje de verdad"""
+    rng = random.Random(seed)
+    words = [b"asistencia", b"estudiante", b"centro", b"aula", b"permiso", b"menu"]
+    parts = []
+    total = 0
+    while total < size:
+        part = rng.choice(words) + b" %d\n" % rng.randrange(100000)
+        parts.append(part)
+        total += len(part)
+    return b"".join(parts)[:size]
+
+
+class ZipPackerTest(unittest.TestCase):
+    """Los miembros en paralelo y los normales conviven en un zip válido"""
+
+    def setUp(self):
+        self.work_dir = Path(tempfile.mkdtemp())
+        self.files = {
+            "cordiax.db": compressible_data(zip_packer.PARALLEL_MIN_SIZE * 2 + 12345, 1),
+            "documentos/notas.txt": compressible_data(50000, 2),
+            "documentos/vacio.txt": b"",
+            "documentos/foto.jpg": os.urandom(70000),
+            # Un trozo exacto más uno: el último trozo del flujo queda pequeño
+            "pdfs/informe.csv": compressible_data(zip_packer.PARALLEL_MIN_SIZE + 1, 3),
+        }
+        self.paths = []
+        for arcname, data in self.files.items():
+            path = self.work_dir / "src" / arcname
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            self.paths.append((arcname, path))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def pack(self, workers):
+        zip_path = self.work_dir / f"copia_{workers}.cordiax.zip"
+        stats = zip_packer.pack_files(zip_path, self.paths, workers=workers)
+        return zip_path, stats
+
+    def test_parallel_members_pass_testzip(self):
+        zip_path, stats = self.pack(workers=4)
+        self.assertEqual(stats["parallel"], 2)
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(sorted(zipf.namelist()), sorted(self.files))
+            for arcname, data in self.files.items():
+                self.assertEqual(zipf.read(arcname), data)
+
+            info = zipf.getinfo("cordiax.db")
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            self.assertLess(info.compress_size, info.file_size)
+            self.assertEqual(zipf.getinfo("documentos/foto.jpg").compress_type,
+                             zipfile.ZIP_STORED)
+
+    def test_parallel_and_single_thread_give_same_contents(self):
+        parallel_path, _ = self.pack(workers=4)
+        single_path, stats = self.pack(workers=1)
+        self.assertEqual(stats["parallel"], 0)
+
+        with zipfile.ZipFile(parallel_path) as parallel, zipfile.ZipFile(single_path) as single:
+            for arcname in self.files:
+                self.assertEqual(parallel.getinfo(arcname).CRC, single.getinfo(arcname).CRC)
+                self.assertEqual(parallel.read(arcname), single.read(arcname))
+
+    def test_zip_can_be_appended_after_parallel_member(self):
+        zip_path, _ = self.pack(workers=4)
+        with zipfile.ZipFile(zip_path, "a") as zipf:
+            zipf.writestr("extra.txt", b"extra")
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.read("extra.txt"), b"extra")
+            self.assertEqual(zipf.read("cordiax.db"), self.files["cordiax.db"])
+
+
+if __name__ == "__main__":
+    unittest.main()